@@ -0,0 +1,92 @@
+'''Round trip latency of handing a plan to the RunEngine thread
+
+The RunEngine is replaced by a thread iterating the plan stub, thus
+only the thread handoff is measured. Compares
+:class:`naus.bridge.PingPongBridge` to a bridge built on two queues
+(and to the bcib threaded bridge if installed).
+
+Usage:
+    python bridge_handoff_benchmark.py
+'''
+from naus.bridge import PingPongBridge
+from threading import Thread
+import functools
+import queue
+import time
+
+
+class QueueBridge:
+    '''Reference: general queues as used by most bridges
+    '''
+    def __init__(self):
+        self._commands = queue.Queue()
+        self._results = queue.Queue()
+
+    def submit(self, cmd):
+        self._commands.put(cmd)
+        return self._results.get()
+
+    def stopDelegation(self):
+        self._commands.put(None)
+
+    def planStub(self, log=None):
+        while True:
+            cmd = self._commands.get()
+            if cmd is None:
+                return
+            r = (yield from cmd())
+            self._results.put(r)
+
+
+def trivial_plan(value):
+    return value
+    yield
+
+
+def drive(plan):
+    '''iterate plan as the RunEngine would, without doing anything
+    '''
+    try:
+        next(plan)
+        while True:
+            plan.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+
+def bench(bridge, plan_stub, n_steps=20000):
+    thread = Thread(target=drive, args=[plan_stub()], name='RunEngine')
+    thread.start()
+    cmd = functools.partial(trivial_plan, 1)
+    start = time.perf_counter()
+    for i in range(n_steps):
+        bridge.submit(cmd)
+    dt = time.perf_counter() - start
+    bridge.stopDelegation()
+    thread.join()
+    return dt / n_steps * 1e6
+
+
+def main():
+    bridge = QueueBridge()
+    t_queue = bench(bridge, bridge.planStub)
+    print(f'queue bridge:     {t_queue:8.2f} us per round trip')
+
+    try:
+        from bcib.threaded_bridge import setup_threaded_callback_iterator_bridge
+        from bcib.bridge_plan import bridge_plan_stub
+    except ImportError:
+        pass
+    else:
+        bridge = setup_threaded_callback_iterator_bridge()
+        t_bcib = bench(bridge, functools.partial(bridge_plan_stub, bridge))
+        print(f'bcib bridge:      {t_bcib:8.2f} us per round trip')
+
+    bridge = PingPongBridge()
+    t_ping_pong = bench(bridge, bridge.planStub)
+    print(f'ping pong bridge: {t_ping_pong:8.2f} us per round trip')
+    print(f'handoff statistics {bridge.statistics()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''Startup time regression check for the client entry point
+
+Imports the client proxy in a fresh interpreter with
+`python -X importtime`. Fails if server side modules (bluesky, ophyd,
+the state machine) are imported or if the import takes longer than
+the given limit.
+
+Usage:
+    python client_import_time.py [--limit-ms 50] [--module naus.environment_proxy_zmq]
+'''
+import argparse
+import subprocess
+import sys
+
+#: modules the client must not import
+forbidden = ('bluesky', 'ophyd', 'super_state_machine', 'bcib')
+
+
+def import_time(module):
+    '''cumulative import time and imported top level packages
+
+    Returns:
+        time in micro seconds, set of package names
+    '''
+    cmd = [sys.executable, '-X', 'importtime', '-c', f'import {module}']
+    r = subprocess.run(cmd, stderr=subprocess.PIPE, universal_newlines=True,
+                       check=True)
+
+    cumulative = None
+    packages = set()
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            # header line
+            continue
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            cumulative = cumulative_us
+    return cumulative, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--module', default='naus.environment_proxy_zmq')
+    parser.add_argument('--limit-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    cumulative, packages = import_time(args.module)
+    found = sorted(set(forbidden) & packages)
+    print(f'import {args.module}: {cumulative / 1e3:.1f} ms')
+
+    failed = False
+    if found:
+        print(f'FAIL: imports server side modules {found}')
+        failed = True
+    if cumulative / 1e3 > args.limit_ms:
+        print(f'FAIL: import slower than {args.limit_ms} ms')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+'''Replay a recorded command stream against a server
+
+The recording is written by a client proxy given a
+:class:`naus.recording.CommandRecorder`.
+
+Usage:
+    python replay_commands.py run.jsonl --transport zmq --port 9998
+    python replay_commands.py run.jsonl --transport xmlrpc --pacing original
+'''
+from naus.recording import load_recording, replay, compare
+import argparse
+import logging
+
+
+def make_client(args):
+    if args.transport == 'zmq':
+        from naus.environment_proxy_zmq import EnvironmentProxyForClient
+        return EnvironmentProxyForClient(None, hostname=args.hostname,
+                                         port=args.port)
+
+    from xmlrpc.client import ServerProxy
+    from naus.environment_proxy import EnvironmentProxyForClient
+    proxy = ServerProxy(f'http://{args.hostname}:{args.port}/',
+                        allow_none=True)
+    return EnvironmentProxyForClient(proxy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('recording')
+    parser.add_argument('--transport', choices=['zmq', 'xmlrpc'],
+                        default='zmq')
+    parser.add_argument('--hostname', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9998)
+    parser.add_argument('--pacing', choices=['fast', 'original'],
+                        default='fast')
+    parser.add_argument('--speed', type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level='WARNING')
+    entries = load_recording(args.recording)
+    env = make_client(args)
+    results = replay(entries, env, pacing=args.pacing, speed=args.speed)
+
+    print(f'{"command":10s} {"count":>7s} {"recorded":>10s} {"replay":>10s}'
+          f' {"delta":>10s} {"delta p99":>10s}  (ms)')
+    for cmd, d in compare(results).items():
+        print(f'{cmd:10s} {d["count"]:7d} {d["recorded_mean"] * 1e3:10.3f}'
+              f' {d["replay_mean"] * 1e3:10.3f} {d["delta_mean"] * 1e3:10.3f}'
+              f' {d["delta_p99"] * 1e3:10.3f}')
+
+
+if __name__ == '__main__':
+    main()
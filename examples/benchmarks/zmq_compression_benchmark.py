@@ -0,0 +1,96 @@
+'''Benchmark array compression of the zmq proxy
+
+Synthetic image sized observations are compressed with all available
+codecs, and sent over a local tcp connection with and without
+compression.
+
+Usage:
+    python zmq_compression_benchmark.py
+
+Measured on a local tcp connection (1024 x 1024 frames): raw 0.7 to
+1.4 ms per frame, as before compression was added; zlib 5 to 49 ms,
+lzma 18 to 280 ms. The codecs compress the camera frame by 1.9
+(zlib) and 2.1 (lzma), constant or smooth data by 10 to 4700, noise
+not at all (sent raw after the ratio check).
+'''
+from naus.environment_proxy_zmq import (ArrayCompressor, get_codecs,
+                                        EnvironmentProxyForServer,
+                                        EnvironmentProxyForClient)
+import numpy as np
+import time
+
+
+def synthetic_frames(shape=(1024, 1024), seed=1974):
+    '''Frames with different compressibility
+
+    Returns:
+        dictionary of name: array
+    '''
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    cy, cx = shape[0] / 2, shape[1] / 2
+    spot = 4000 * np.exp(-((x - cx)**2 + (y - cy)**2) / (2 * 80**2))
+    camera = rng.poisson(spot + 100).astype(np.uint16)
+
+    spectrum = np.sin(np.linspace(0, 50, shape[0] * shape[1] // 4))
+    spectrum = np.round(spectrum, 3)
+    frames = {
+        'camera_uint16': camera,
+        'dark_uint16': np.zeros(shape, dtype=np.uint16) + 100,
+        'spectrum_float64': spectrum,
+        'noise_float32': rng.normal(size=shape).astype(np.float32),
+    }
+    return frames
+
+
+def bench_codecs(frames, n_repeat=5):
+    codecs = get_codecs()
+    print(f'{"frame":20s} {"codec":6s} {"ratio":>7s} {"enc MB/s":>9s}'
+          f' {"dec MB/s":>9s}')
+    for name, A in frames.items():
+        for codec in codecs:
+            compressor = ArrayCompressor(codec, threshold=0, min_ratio=0)
+            decompress = codecs[codec][1]
+
+            start = time.perf_counter()
+            for i in range(n_repeat):
+                used, buf = compressor.encode(A)
+            t_enc = (time.perf_counter() - start) / n_repeat
+
+            start = time.perf_counter()
+            for i in range(n_repeat):
+                decompress(buf)
+            t_dec = (time.perf_counter() - start) / n_repeat
+
+            mb = A.nbytes / 1e6
+            ratio = A.nbytes / len(buf)
+            print(f'{name:20s} {codec:6s} {ratio:7.2f} {mb / t_enc:9.1f}'
+                  f' {mb / t_dec:9.1f}')
+
+
+def bench_transfer(frames, port=9990, n_repeat=20):
+    settings = [None] + list(get_codecs())
+    for cnt, codec in enumerate(settings):
+        server = EnvironmentProxyForServer(None, port=port + cnt)
+        client = EnvironmentProxyForClient(None, port=port + cnt,
+                                           compression=codec)
+        for name, A in frames.items():
+            start = time.perf_counter()
+            for i in range(n_repeat):
+                client.sendData({}, A)
+                md, B = server.receiveData()
+            dt = (time.perf_counter() - start) / n_repeat
+            assert np.array_equal(A, B)
+            codec_used = md['A_codec']
+            print(f'{str(codec):6s} {name:20s} sent as {codec_used:6s}'
+                  f' {dt * 1e3:8.2f} ms per frame')
+
+
+def main():
+    frames = synthetic_frames()
+    bench_codecs(frames)
+    bench_transfer(frames)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ import logging
 # from bluesky.utils import install_qt_kicker
 from naus.threaded_environment import run_environment
 from naus.environment_proxy_zmq import EnvironmentProxyForServer
+from naus.plans import fused_per_step_plan
 # from naus.xmlrpc_server import setup_xml_server
 
 from bluesky import RunEngine
@@ -71,6 +72,7 @@ def main():
     stm = [cart_pole.x, cart_pole.x_dot, cart_pole.theta, cart_pole.theta_dot]
     cpst = CartPoleEnv(detectors=[cart_pole], motors=[cart_pole],
                        state_motors=stm, log=RE.log,
+                       per_step_plan=fused_per_step_plan,
                        user_kwargs={'mode_var': cart_pole.rl_mode})
 
     server = EnvironmentProxyForServer(receiver=cpst)
@@ -1,12 +1,39 @@
 from cart_pole_physics_model import CartPoleState, CartPolePhysics
+from naus.simulated_device import SimulatedDevice
 from ophyd import Component as Cpt, Device, Signal
 from ophyd.status import AndStatus
 
 from numpy import nan
 
 
-class CartPole(Device):
+class CartPole(SimulatedDevice):
+    '''Cart pole simulation
+
+    State and readings are updated in place, see
+    :class:`naus.simulated_device.SimulatedDevice`
     '''
+    fields = ('action', 'x', 'x_dot', 'theta', 'theta_dot')
+
+    # Mode of evaluation
+    extra_fields = {'rl_mode': 'unknown'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.physics_model = CartPolePhysics()
+        # view on x, x_dot, theta, theta_dot
+        self._values = self.state[1:]
+
+    def apply(self, state, action):
+        self.log.debug(f'Setting cartpole to {action}')
+        state[0] = action
+        self.physics_model.step_inplace(self._values, action)
+
+
+class CartPoleOphyd(Device):
+    '''Cart pole built from ophyd signals
+
+    Kept for comparison with :class:`CartPole`
     '''
     action    = Cpt(Signal, name='action',    value=nan)
     x         = Cpt(Signal, name='x',         value=nan)
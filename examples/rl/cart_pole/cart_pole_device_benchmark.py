@@ -0,0 +1,42 @@
+'''Compare set and read throughput of the cart pole devices
+
+Usage:
+    python cart_pole_device_benchmark.py
+
+Measured with ophyd 1.11: about 800 steps/s for the signal based
+device (as the CartPole of the baseline), 58000 to 81000 steps/s for
+the simulated device.
+'''
+from cart_pole_device import CartPole, CartPoleOphyd
+import time
+
+
+def bench(device, n_steps=20000):
+    device.x.set(0.01)
+    device.x_dot.set(0.0)
+    device.theta.set(0.01)
+    device.theta_dot.set(0.0)
+
+    start = time.perf_counter()
+    for i in range(n_steps):
+        status = device.set(i % 2)
+        status.wait()
+        device.read()
+        if i % 10 == 9:
+            # keep the pole within a sane range
+            device.x.set(0.01)
+            device.theta.set(0.01)
+    dt = time.perf_counter() - start
+    return n_steps / dt
+
+
+def main():
+    old = bench(CartPoleOphyd(name='cp'))
+    new = bench(CartPole(name='cp'))
+    print(f'ophyd signals:    {old:10.0f} steps/s')
+    print(f'simulated device: {new:10.0f} steps/s')
+    print(f'speed up:         {new / old:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
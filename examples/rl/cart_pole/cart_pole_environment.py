@@ -1,4 +1,5 @@
 from naus.environment import Environment
+from naus.rules import Rules, Bound, EpisodeRules
 import bluesky.plan_stubs as bps
 from cart_pole_physics_model import CartPoleState
 from gym.utils import seeding
@@ -27,7 +28,15 @@ class CartPoleEnv(Environment):
         self.theta_threshold_radians = 12 * 2 * np.pi / 360
         self.x_threshold = 2.4
 
-        self.steps_beyond_done = None
+        # only the right end of the track terminates the episode
+        self.rules = Rules(
+            fields=('x', 'x_dot', 'theta', 'theta_dot'),
+            bounds=[Bound('x', high=self.x_threshold),
+                    Bound('theta', -self.theta_threshold_radians,
+                          self.theta_threshold_radians)],
+            reward=1.0, reward_beyond_done=0.0,
+        ).compile()
+        self.episode_rules = EpisodeRules(self.rules, log=self.log)
 
         kwargs = copy.copy(self.user_kwargs)
         # Make sure it is a known keyword argument
@@ -44,8 +53,7 @@ class CartPoleEnv(Environment):
         self.action_space = spaces.Discrete(2)
         self.observation_space = spaces.Box(-high, high, dtype=np.float32)
 
-    def set_mode(self, mode):
-
+    def _setModeCommand(self, mode):
         kwargs = copy.copy(self.user_kwargs)
         # Make sure it is a known keyword argument
         kwargs['mode_var']
@@ -55,7 +63,13 @@ class CartPoleEnv(Environment):
         cmd = functools.partial(plan_set_mode, self.detectors, self.motors,
                                 self.state_motors,
                                 *self.user_args, **kwargs)
-        self._submit(cmd)
+        return cmd
+
+    def set_mode(self, mode):
+        self._submit(self._setModeCommand(mode))
+
+    def planSetMode(self, mode):
+        yield from self._runPlan(self._setModeCommand(mode))
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
@@ -89,45 +103,15 @@ class CartPoleEnv(Environment):
     def getStateToResetTo(self):
         start = self.np_random.uniform(low=-0.05, high=0.05, size=(4,))
         # should be in the reset method ...
-        self.steps_beyond_done = None
+        self.episode_rules.reset()
         return start
 
-    def computeRewardTerminal(self, dic):
+    @property
+    def steps_beyond_done(self):
+        return self.episode_rules.steps_beyond_done
 
-        state = self.extractState(dic)
-        x = state.x
-        theta = state.theta
-
-        if False:
-            done = x < -self.x_threshold \
-                    or x > self.x_threshold \
-                    or theta < -self.theta_threshold_radians \
-                    or theta > self.theta_threshold_radians
-        else:
-            done = x > self.x_threshold \
-                    or theta < -self.theta_threshold_radians \
-                    or theta > self.theta_threshold_radians
-
-        done = bool(done)
-
-        if not done:
-            reward = 1.0
-        elif self.steps_beyond_done is None:
-            # Pole just fell!
-            self.steps_beyond_done = 0
-            reward = 1.0
-        else:
-            if self.steps_beyond_done == 0:
-                txt = (
-                    """You are calling 'step()' even though this environment
- has already returned done = True. You should always call 'reset()' once you
- receive 'done = True' -- any further steps are undefined behaviour."""
-                )
-                self.log.warn(txt)
-            self.steps_beyond_done += 1
-            reward = 0.0
-
-        return reward, done
+    def computeRewardTerminal(self, dic):
+        return self.episode_rules(self.extractState(dic).values)
 
     def computeState(self, dic):
         return self.extractState(dic).values
@@ -0,0 +1,98 @@
+'''Load test of the zmq server proxy with a simulated cart pole
+
+Starts one server proxy per synthetic agent, each in a thread of its
+own and all in this process, serving a cart pole simulation without
+bluesky. Then the number of agents is increased until the throughput
+saturates.
+
+Usage:
+    python cart_pole_load_test.py --max-agents 16 --duration 5
+'''
+from cart_pole_physics_model import CartPolePhysics
+from naus.environment_proxy_zmq import EnvironmentProxyForServer
+from naus.load_test import ramp_up, run_load_test, summarise
+from threading import Thread
+import numpy as np
+import argparse
+import logging
+
+logger = logging.getLogger('naus')
+
+
+class SimulatedCartPole:
+    '''receiver for the server proxy: cart pole physics only
+    '''
+    x_threshold = 2.4
+    theta_threshold_radians = 12 * 2 * np.pi / 360
+
+    def __init__(self):
+        self.physics = CartPolePhysics()
+        self.values = np.zeros(4)
+        self.rng = np.random.RandomState()
+        self.mode = None
+
+    def setup(self):
+        return self.values
+
+    def seed(self, seed=None):
+        self.rng = np.random.RandomState(seed)
+        return [seed]
+
+    def set_mode(self, mode):
+        self.mode = mode
+
+    def reset(self):
+        self.values[:] = self.rng.uniform(low=-0.05, high=0.05, size=(4,))
+        return self.values
+
+    def step(self, action):
+        self.physics.step_inplace(self.values, int(action))
+        x, x_dot, theta, theta_dot = self.values
+        done = bool(abs(x) > self.x_threshold
+                    or abs(theta) > self.theta_threshold_radians)
+        return self.values, 1.0, done, {}
+
+
+def start_servers(base_port, n_servers):
+    ports = []
+    for cnt in range(n_servers):
+        port = base_port + cnt
+        server = EnvironmentProxyForServer(SimulatedCartPole(), port=port)
+        thread = Thread(target=server, name=f'server {port}', daemon=True)
+        thread.start()
+        ports.append(port)
+    return ports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=9800)
+    parser.add_argument('--max-agents', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--agents', type=int, default=None,
+                        help='fixed number of agents instead of ramping up')
+    args = parser.parse_args()
+
+    logging.basicConfig(level='WARNING')
+    ports = start_servers(args.port, args.max_agents)
+
+    if args.agents is not None:
+        reports = run_load_test(ports[:args.agents], duration=args.duration,
+                                report_interval=args.interval)
+        for row in summarise(reports, args.interval):
+            print(row)
+        return
+
+    levels, saturation = ramp_up(ports, duration=args.duration,
+                                 report_interval=args.interval)
+    for n_agents, summary in levels:
+        print(f'{n_agents:4d} agents: {summary["throughput"]:10.1f} cmd/s'
+              f' p50 {summary.get("p50", np.nan) * 1e3:7.3f} ms'
+              f' p99 {summary.get("p99", np.nan) * 1e3:7.3f} ms'
+              f' errors {summary["error_rate"]:.3%}')
+    print(f'throughput saturates at {saturation} agents')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
-import numpy as np
 from dataclasses import dataclass
+import math
 
 
 @dataclass
@@ -33,24 +33,18 @@ class CartPolePhysics:
         self.tau = 0.02  # seconds between state updates
         self.kinematics_integrator = 'euler'
 
-    def __call__(self, state, action):
-
-        x = state.x
-        x_dot = state.x_dot
-        theta = state.theta
-        theta_dot = state.theta_dot
+    def integrate(self, x, x_dot, theta, theta_dot, action):
+        '''one time step on scalars
 
-        assert(np.isfinite(x))
-        assert(np.isfinite(x_dot))
-        assert(np.isfinite(theta))
-        assert(np.isfinite(theta_dot))
+        Returns:
+            x, x_dot, theta, theta_dot after the step
+        '''
+        assert(math.isfinite(x + x_dot + theta + theta_dot))
 
         force = self.force_mag if action==1 else -self.force_mag
 
-        assert(np.isfinite(force))
-
-        costheta = np.cos(theta)
-        sintheta = np.sin(theta)
+        costheta = math.cos(theta)
+        sintheta = math.sin(theta)
 
         temp = (force + self.polemass_length * theta_dot**2 * sintheta)
         temp /= self.total_mass
@@ -73,10 +67,25 @@ class CartPolePhysics:
             theta_dot = theta_dot + self.tau * thetaacc
             theta = theta + self.tau * theta_dot
 
-        assert(np.isfinite(x))
-        assert(np.isfinite(x_dot))
-        assert(np.isfinite(theta))
-        assert(np.isfinite(theta_dot))
+        assert(math.isfinite(x + x_dot + theta + theta_dot))
+        return x, x_dot, theta, theta_dot
+
+    def __call__(self, state, action):
+        x, x_dot, theta, theta_dot = self.integrate(
+            float(state.x), float(state.x_dot), float(state.theta),
+            float(state.theta_dot), action
+        )
         state = CartPoleState(x=x, x_dot=x_dot, theta=theta,
                               theta_dot=theta_dot)
         return state
+
+    def step_inplace(self, values, action):
+        '''same as __call__ but on array values = [x, x_dot, theta, theta_dot]
+
+        The values are updated in place.
+        '''
+        x, x_dot, theta, theta_dot = self.integrate(*values.tolist(), action)
+        values[0] = x
+        values[1] = x_dot
+        values[2] = theta
+        values[3] = theta_dot
@@ -0,0 +1,75 @@
+'''Fit a surrogate of the cart pole and compare it to the physics model
+
+The steps are recorded from the physics model directly, a random agent
+choosing the actions. For real devices wrap the environment with
+:class:`naus.surrogate.TransitionRecorder` instead.
+'''
+from cart_pole_physics_model import CartPolePhysics
+from naus.surrogate import (TransitionDataset, TransitionModel,
+                            PolynomialRegressor, MLPRegressor,
+                            SurrogateEnvironment, validate,
+                            validate_rollouts)
+import numpy as np
+import time
+
+
+def terminal(states):
+    x, theta = states[:, 0], states[:, 2]
+    return (np.absolute(x) > 2.4) | (np.absolute(theta) > 12 * 2 * np.pi / 360)
+
+
+def record(n_episodes=200, seed=1974):
+    rng = np.random.RandomState(seed)
+    physics = CartPolePhysics()
+    dataset = TransitionDataset()
+    for episode in range(n_episodes):
+        values = rng.uniform(low=-0.05, high=0.05, size=(4,))
+        dataset.newEpisode()
+        for step in range(500):
+            action = rng.randint(2)
+            state = values.copy()
+            physics.step_inplace(values, action)
+            done = bool(terminal(values[np.newaxis, :])[0])
+            dataset.append(state, action, values, 1.0, done)
+            if done:
+                break
+    return dataset
+
+
+def main():
+    dataset = record()
+    train, test = dataset.split(0.8, seed=42)
+    print(f'train {train}, test {test}')
+
+    for regressor in (PolynomialRegressor(degree=1),
+                      PolynomialRegressor(degree=2),
+                      MLPRegressor(hidden=(32, 32), epochs=100, seed=1)):
+        model = TransitionModel(regressor, n_actions=2, terminal=terminal)
+        start = time.perf_counter()
+        model.fit(train)
+        dt = time.perf_counter() - start
+        report = validate(model, test)
+        rollout = validate_rollouts(model, test, horizon=20)
+        print(f'{regressor}: fitted in {dt:.2f} s')
+        print(f'    one step nrmse {report["state_nrmse"]}')
+        print(f'    done accuracy  {report["done_accuracy"]:.3f}')
+        print(f'    rmse after 20 steps {rollout[-1]}')
+
+    n_batch = 1024
+    surrogate = SurrogateEnvironment(model, train.initialStates(),
+                                     batch_size=n_batch, max_steps=500,
+                                     seed=3)
+    surrogate.resetBatch()
+    rng = np.random.RandomState(7)
+    n_steps = 200
+    start = time.perf_counter()
+    for cnt in range(n_steps):
+        states, rewards, dones = surrogate.stepBatch(rng.randint(2, size=n_batch))
+        if dones.any():
+            surrogate.resetBatch(dones)
+    dt = time.perf_counter() - start
+    print(f'surrogate: {n_steps * n_batch / dt:.0f} steps per second')
+
+
+if __name__ == '__main__':
+    main()
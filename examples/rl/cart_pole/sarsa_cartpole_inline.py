@@ -0,0 +1,155 @@
+'''SARSA on the cart pole, the agent executed within the RunEngine
+
+Same agent as sarsa_cartpole.py, but no server, proxy or second
+thread: the training loop of keras-rl (`Agent.fit`, `Agent.test`) is
+written out as plan, calling the agent's `forward` and `backward`
+and driving the environment by its plan methods
+(see :mod:`naus.inline`).
+'''
+import logging
+# logging.basicConfig(level='INFO')
+
+from keras.models import Sequential
+from keras.layers import Dense, Activation, Flatten
+from keras.optimizers import Adam
+
+from rl.agents import SARSAAgent
+from rl.policy import BoltzmannQPolicy
+
+from naus.inline import run_agent
+from naus.plans import fused_per_step_plan
+from bluesky import RunEngine
+from cart_pole_device import CartPole
+from cart_pole_environment import CartPoleEnv
+
+import numpy as np
+import copy
+
+ENV_NAME = 'CartPole-v0'
+
+log = logging.getLogger('naus')
+
+
+def build_agent(nb_actions=2, n_os=4):
+    model = Sequential()
+    model.add(Flatten(input_shape=[1] + [n_os]))
+    model.add(Dense(16))
+    model.add(Activation('relu'))
+    model.add(Dense(16))
+    model.add(Activation('relu'))
+    model.add(Dense(16))
+    model.add(Activation('relu'))
+    model.add(Dense(nb_actions))
+    model.add(Activation('linear'))
+    print(model.summary())
+
+    # SARSA does not require a memory.
+    policy = BoltzmannQPolicy()
+    sarsa = SARSAAgent(model=model, nb_actions=nb_actions,
+                       nb_steps_warmup=10, policy=policy)
+    sarsa.compile(Adam(lr=1e-3), metrics=['mae'])
+    return sarsa
+
+
+def fit(actor, env, nb_steps):
+    '''plan version of actor.fit(env, nb_steps)
+    '''
+    actor.training = True
+    actor._on_train_begin()
+    actor.step = 0
+    episode = 0
+    observation = None
+    episode_reward = 0.0
+    while actor.step < nb_steps:
+        if observation is None:
+            actor.reset_states()
+            observation = copy.deepcopy((yield from env.planReset()))
+            episode_reward = 0.0
+
+        action = actor.forward(observation)
+        observation, reward, done, info = (yield from env.planStep(action))
+        observation = copy.deepcopy(observation)
+        actor.backward(reward, terminal=done)
+        episode_reward += reward
+        actor.step += 1
+
+        if done:
+            # as keras-rl: let the agent see the terminal observation
+            actor.forward(observation)
+            actor.backward(0., terminal=False)
+            log.info(f'episode {episode}: reward {episode_reward}'
+                     f' steps {actor.step}')
+            observation = None
+            episode += 1
+    actor._on_train_end()
+
+
+def test(actor, env, nb_episodes):
+    '''plan version of actor.test(env, nb_episodes)
+
+    Returns:
+        the reward of each episode
+    '''
+    actor.training = False
+    actor.step = 0
+    rewards = []
+    for episode in range(nb_episodes):
+        actor.reset_states()
+        observation = copy.deepcopy((yield from env.planReset()))
+        episode_reward = 0.0
+        done = False
+        while not done:
+            action = actor.forward(observation)
+            observation, reward, done, info = (yield from env.planStep(action))
+            observation = copy.deepcopy(observation)
+            actor.backward(reward, terminal=done)
+            episode_reward += reward
+            actor.step += 1
+        log.info(f'test episode {episode}: reward {episode_reward}')
+        rewards.append(episode_reward)
+    return rewards
+
+
+def run_test(actor, env, *, nb_steps=50000, nb_episodes=5):
+    '''the agent: plan executed by :func:`naus.inline.run_agent`
+    '''
+    yield from env.planSetup()
+
+    yield from env.planSetMode('fit')
+    yield from fit(actor, env, nb_steps)
+
+    log.info('\nsaving weights\n')
+    actor.save_weights('sarsa_{}_weights.h5f'.format(ENV_NAME), overwrite=True)
+
+    yield from env.planSetMode('test')
+    rewards = (yield from test(actor, env, nb_episodes))
+    return rewards
+
+
+def main():
+    cart_pole = CartPole(name='cp')
+
+    RE = RunEngine({})
+    cart_pole.log = RE.log
+
+    stm = [cart_pole.x, cart_pole.x_dot, cart_pole.theta, cart_pole.theta_dot]
+    env = CartPoleEnv(detectors=[cart_pole], motors=[cart_pole],
+                      state_motors=stm, log=RE.log,
+                      per_step_plan=fused_per_step_plan,
+                      user_kwargs={'mode_var': cart_pole.rl_mode})
+    np.random.seed(1974)
+    env.seed(1974)
+
+    actor = build_agent()
+
+    def agent(env):
+        r = (yield from run_test(actor, env))
+        return r
+
+    RE(run_agent(env, agent, log=RE.log))
+
+
+if __name__ == '__main__':
+    print("Starting")
+    main()
+    print("Done")
@@ -0,0 +1,28 @@
+'''Import modules when they are first used
+
+Keeps the import of the client side modules light.
+'''
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    '''module name, executed at the first attribute access
+
+    Raises:
+        ImportError: if the module can not be found
+    '''
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
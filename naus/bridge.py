@@ -0,0 +1,293 @@
+'''Bridge handing plans from the agent thread to the RunEngine
+
+The environment submits one plan at a time and waits for its result
+(see :meth:`naus.environment.Environment._submit`): a strict ping-pong.
+:class:`PingPongBridge` uses a single slot for the command and one for
+the result, each signalled by a bare lock used as binary semaphore,
+instead of general queues (which allocate a lock for each waiter). On
+machines with more than one cpu a waiting thread first spins for a
+short time (yielding the GIL) before it blocks.
+
+It can be used instead of the bridge of
+:mod:`bcib.threaded_bridge`:
+
+::
+
+    from naus.bridge import PingPongBridge
+
+    RE(run_environment(env, partial, bridge=PingPongBridge()))
+'''
+from bluesky import plan_stubs as bps
+
+from . import metrics
+from threading import Lock
+import os
+import logging
+import time
+
+logger = logging.getLogger('naus')
+
+handoff_seconds = metrics.Histogram(
+    'naus_bridge_handoff_seconds',
+    'Time from posting a command or result until the other thread woke up',
+    ('direction',),
+    buckets=(1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+             1e-3, 2.5e-3, 5e-3, 1e-2, .1, 1.)
+)
+
+#: command telling the plan stub to stop
+_stop_delegation = object()
+#: returned by :meth:`PingPongBridge.nextCommand` if nothing arrived
+timed_out = object()
+
+
+class HandoffStatistics:
+    '''Latency of handing over a command or result
+    '''
+    __slots__ = ['count', 'total', 'max', 'spun', '_histogram']
+
+    def __init__(self, direction):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        #: number of handoffs caught while spinning
+        self.spun = 0
+        self._histogram = handoff_seconds.labels(direction)
+
+    def record(self, dt, spun):
+        self.count += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+        self.spun += spun
+        self._histogram.observe(dt)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def asDict(self):
+        return dict(count=self.count, mean=self.mean, max=self.max,
+                    spun=self.spun)
+
+
+class _Signal:
+    '''binary semaphore built on a bare lock
+
+    The lock is held while the signal is not set: its state is the
+    only flag, thus acquiring it in :meth:`wait` clears the signal in
+    the same step. The mutex serialises concurrent :meth:`set` calls.
+    '''
+    __slots__ = ['_lock', '_mutex']
+
+    def __init__(self):
+        self._lock = Lock()
+        self._lock.acquire()
+        self._mutex = Lock()
+
+    def set(self):
+        with self._mutex:
+            if self._lock.locked():
+                self._lock.release()
+
+    def is_set(self):
+        return not self._lock.locked()
+
+    def wait(self, timeout=None):
+        '''wait until set and clear it
+
+        Returns:
+            True if the signal was set
+        '''
+        if timeout is None:
+            timeout = -1
+        return self._lock.acquire(timeout=timeout)
+
+
+def _default_spin_time():
+    if (os.cpu_count() or 1) > 1:
+        return 20e-6
+    # Spinning only delays the other thread
+    return 0.0
+
+
+class PingPongBridge:
+    '''Single slot handoff between agent thread and RunEngine
+
+    Args:
+        spin_time: seconds to spin before blocking. Defaults to 20 us
+                   on multi cpu machines, 0 otherwise
+        poll_time: the plan stub returns control to the RunEngine at
+                   least this often while waiting for a command
+
+    The agent calls :meth:`submit`, the RunEngine executes
+    :meth:`planStub`.
+    '''
+    def __init__(self, *, spin_time=None, poll_time=0.5, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+
+        if spin_time is None:
+            spin_time = _default_spin_time()
+        self.spin_time = float(spin_time)
+        self.poll_time = float(poll_time)
+
+        self._command = None
+        self._command_posted = 0.0
+        self._command_ready = _Signal()
+        # Identifies the command a result belongs to: a result
+        # arriving after its submit timed out is dropped
+        self._generation = 0
+        self._executing = 0
+
+        self._result = None
+        self._exception = None
+        self._result_generation = 0
+        self._result_posted = 0.0
+        self._result_ready = _Signal()
+
+        self.to_plan = HandoffStatistics('to_plan')
+        self.to_agent = HandoffStatistics('to_agent')
+
+    def _wait(self, event, timeout):
+        '''spin then block. Clears the signal
+
+        Returns:
+            (signal was set, caught while spinning)
+        '''
+        spun = event.is_set()
+        if not spun and self.spin_time > 0:
+            end = time.perf_counter() + self.spin_time
+            while time.perf_counter() < end:
+                # let the other thread take the GIL
+                time.sleep(0)
+                if event.is_set():
+                    spun = True
+                    break
+        return event.wait(timeout), spun
+
+    # -------------------------------------------------------------------------
+    # Agent side
+    def submit(self, cmd, timeout=None):
+        '''execute plan cmd in the RunEngine and return its result
+
+        Args:
+            cmd:     callable returning a plan
+            timeout: seconds to wait for the result. None: wait for
+                     ever
+
+        Raises:
+            TimeoutError: if the result did not arrive in time
+        '''
+        generation = self._post(cmd)
+        remaining = timeout
+        if timeout is not None:
+            end = time.monotonic() + timeout
+        while True:
+            if timeout is not None:
+                remaining = max(end - time.monotonic(), 0.0)
+            ready, spun = self._wait(self._result_ready, remaining)
+            if not ready:
+                txt = f'plan {cmd} did not finish within {timeout} s'
+                raise TimeoutError(txt)
+            if self._result_generation == generation:
+                break
+            self.log.warning('Bridge: dropping result of an abandoned command')
+        self.to_agent.record(time.perf_counter() - self._result_posted, spun)
+
+        exc = self._exception
+        r = self._result
+        self._exception = None
+        self._result = None
+        if exc is not None:
+            raise exc
+        return r
+
+    def stopDelegation(self):
+        '''make the plan stub return
+        '''
+        self._post(_stop_delegation)
+
+    def _post(self, cmd):
+        self._generation += 1
+        self._command = (self._generation, cmd)
+        self._command_posted = time.perf_counter()
+        self._command_ready.set()
+        return self._generation
+
+    # -------------------------------------------------------------------------
+    # RunEngine side
+    def nextCommand(self, timeout=None):
+        '''wait for the next command
+
+        Returns:
+            the command or :data:`timed_out`
+        '''
+        ready, spun = self._wait(self._command_ready, timeout)
+        if not ready:
+            return timed_out
+        self.to_plan.record(time.perf_counter() - self._command_posted, spun)
+        self._executing, cmd = self._command
+        self._command = None
+        return cmd
+
+    def setResult(self, r, exception=None):
+        self._result = r
+        self._exception = exception
+        self._result_generation = self._executing
+        self._result_posted = time.perf_counter()
+        self._result_ready.set()
+
+    def planStub(self, log=None):
+        '''plan executing the submitted commands until delegation stops
+
+        Returns:
+            number of commands executed
+        '''
+        if log is None:
+            log = self.log
+
+        cnt = 0
+        while True:
+            cmd = self.nextCommand(self.poll_time)
+            if cmd is timed_out:
+                # give the RunEngine a chance to handle pause requests
+                yield from bps.null()
+                continue
+            if cmd is _stop_delegation:
+                log.debug(f'Bridge delegation stopped after {cnt} commands')
+                return cnt
+
+            cnt += 1
+            try:
+                r = (yield from cmd())
+            except Exception as exc:
+                log.error(f'Bridge: command {cmd} raised {exc}')
+                self.setResult(None, exc)
+            else:
+                self.setResult(r)
+
+    def handoffState(self):
+        '''where the last command is
+
+        Returns:
+            'idle': result handed back, 'queued': not yet picked up by
+            the RunEngine, 'executing': plan running
+        '''
+        if self._result_generation == self._generation:
+            return 'idle'
+        if self._executing == self._generation:
+            return 'executing'
+        return 'queued'
+
+    def statistics(self):
+        return dict(to_plan=self.to_plan.asDict(),
+                    to_agent=self.to_agent.asDict())
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = f'{cls_name}(spin_time={self.spin_time}, poll_time={self.poll_time})'
+        return txt
@@ -0,0 +1,359 @@
+'''Store the events of runs as columns
+
+Persisting every step with the usual per document callbacks costs
+python work per event in the RunEngine thread. :class:`ColumnarSink`
+only copies the values of an event into preallocated numpy chunks, one
+column per data key. Full chunks are written by a background thread
+to raw files (one per column and descriptor) next to a small json
+descriptor, thus they can be memory mapped when read back.
+
+Layout of a run directory (named by the uid of the start document):
+
+::
+
+    start.json  stop.json  manifest.json
+    <descriptor uid>/time.bin  <descriptor uid>/seq_num.bin
+    <descriptor uid>/uid.bin
+    <descriptor uid>/<data key>.bin  <descriptor uid>/<data key>.ts.bin
+    <descriptor uid>/<data key>.jsonl      (non numeric data keys)
+
+A stream (e.g. 'primary') may get several descriptors in one run, thus
+the columns and the manifest are kept per descriptor; each entry of
+the manifest names its stream.
+
+:func:`load_run` maps the columns, :func:`documents` rebuilds the
+bluesky documents.
+
+Typical usage:
+
+::
+
+    from naus.document_sink import ColumnarSink, documents
+
+    sink = ColumnarSink('runs')
+    RE.subscribe(sink)
+    RE(run_environment(env, partial))
+    sink.close()
+
+    for name, doc in documents('runs/<uid>'):
+        ...
+'''
+from threading import Thread
+import logging
+import queue
+import heapq
+import json
+import os
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+_numeric_dtypes = {'number': np.float64, 'integer': np.int64,
+                   'boolean': np.bool_}
+
+
+def _column_dtype(data_key):
+    '''numpy dtype for a data key, None for non numeric ones
+    '''
+    dtype_str = data_key.get('dtype_str')
+    if dtype_str:
+        dtype = np.dtype(dtype_str)
+        if dtype.kind in 'biuf':
+            return dtype
+        return None
+    dtype = data_key.get('dtype')
+    if dtype == 'array':
+        return np.dtype(np.float64)
+    dtype = _numeric_dtypes.get(dtype)
+    if dtype is None:
+        return None
+    return np.dtype(dtype)
+
+
+def _file_name(key):
+    return key.replace(os.sep, '_')
+
+
+class _Stream:
+    '''the chunks of the columns of one event descriptor
+    '''
+    def __init__(self, directory, descriptor, chunk_size):
+        self.directory = directory
+        self.descriptor = descriptor
+        self.name = descriptor.get('name', 'primary')
+        self.chunk_size = chunk_size
+
+        self.columns = {}
+        self.objects = []
+        for key, data_key in descriptor['data_keys'].items():
+            dtype = _column_dtype(data_key)
+            if dtype is None:
+                self.objects.append(key)
+            else:
+                shape = tuple(data_key.get('shape') or ())
+                self.columns[key] = (dtype, shape)
+        self.n_rows = 0
+        self._new()
+
+    def _new(self):
+        n = self.chunk_size
+        self.time = np.empty(n)
+        self.seq_num = np.empty(n, dtype=np.int64)
+        self.uid = np.empty(n, dtype='S36')
+        self.values = {key: np.empty((n,) + shape, dtype=dtype)
+                       for key, (dtype, shape) in self.columns.items()}
+        self.timestamps = {key: np.empty(n) for key in self.descriptor['data_keys']}
+        self.object_values = {key: [] for key in self.objects}
+        self.fill = 0
+
+    def append(self, doc):
+        '''copy the event
+
+        Returns:
+            True if the chunk is full
+        '''
+        i = self.fill
+        self.time[i] = doc['time']
+        self.seq_num[i] = doc['seq_num']
+        self.uid[i] = doc['uid']
+        data = doc['data']
+        for key, column in self.values.items():
+            column[i] = data[key]
+        for key, values in self.object_values.items():
+            values.append(data[key])
+        timestamps = doc['timestamps']
+        for key, column in self.timestamps.items():
+            column[i] = timestamps[key]
+        self.fill = i + 1
+        return self.fill == self.chunk_size
+
+    def take(self):
+        '''the filled part of the chunk, replaced by a new one
+        '''
+        n = self.fill
+        chunk = dict(
+            time=self.time[:n], seq_num=self.seq_num[:n], uid=self.uid[:n],
+            values={key: val[:n] for key, val in self.values.items()},
+            timestamps={key: val[:n] for key, val in self.timestamps.items()},
+            objects=self.object_values,
+        )
+        self.n_rows += n
+        self._new()
+        return chunk
+
+    def manifest(self):
+        columns = {key: dict(dtype=dtype.str, shape=list(shape))
+                   for key, (dtype, shape) in self.columns.items()}
+        return dict(name=self.name, descriptor=self.descriptor,
+                    n_rows=self.n_rows,
+                    columns=columns, objects=self.objects,
+                    files={key: _file_name(key)
+                           for key in self.descriptor['data_keys']})
+
+
+class ColumnarSink:
+    '''RunEngine callback storing events in columns
+
+    Args:
+        directory:  where the run directories are created
+        chunk_size: events per chunk handed to the writer thread
+        max_chunks: chunks queued for writing before the RunEngine
+                    thread has to wait for the writer
+
+    Call :meth:`close` when done: it waits for the writer.
+    '''
+    def __init__(self, directory, *, chunk_size=4096, max_chunks=64,
+                 log=None):
+        if log is None:
+            log = logger
+        self.log = log
+        self.directory = directory
+        self.chunk_size = int(chunk_size)
+
+        self._run_dir = None
+        self._start = None
+        self._streams = {}
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._thread = Thread(target=self._write, name='naus document sink',
+                              daemon=True)
+        self._thread.start()
+
+    # -------------------------------------------------------------------------
+    # RunEngine thread
+    def __call__(self, name, doc):
+        method = getattr(self, name, None)
+        if method is not None:
+            method(doc)
+
+    def start(self, doc):
+        self._run_dir = os.path.join(self.directory, doc['uid'])
+        self._start = doc
+        self._streams = {}
+        self._queue.put(('json', self._run_dir, 'start.json', doc))
+
+    def descriptor(self, doc):
+        self._streams[doc['uid']] = _Stream(
+            os.path.join(self._run_dir, doc['uid']), doc, self.chunk_size
+        )
+
+    def event(self, doc):
+        stream = self._streams[doc['descriptor']]
+        if stream.append(doc):
+            self._queue.put(('chunk', stream.directory, stream.take(), None))
+
+    def event_page(self, doc):
+        n = len(doc['seq_num'])
+        for i in range(n):
+            self.event(dict(
+                descriptor=doc['descriptor'], time=doc['time'][i],
+                seq_num=doc['seq_num'][i], uid=doc['uid'][i],
+                data={key: val[i] for key, val in doc['data'].items()},
+                timestamps={key: val[i]
+                            for key, val in doc['timestamps'].items()},
+            ))
+
+    def stop(self, doc):
+        manifest = {}
+        for uid, stream in self._streams.items():
+            if stream.fill:
+                self._queue.put(('chunk', stream.directory, stream.take(),
+                                 None))
+            manifest[uid] = stream.manifest()
+        self._queue.put(('json', self._run_dir, 'manifest.json', manifest))
+        self._queue.put(('json', self._run_dir, 'stop.json', doc))
+        self._streams = {}
+
+    def flush(self):
+        '''wait until all queued chunks are written
+        '''
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    # -------------------------------------------------------------------------
+    # writer thread
+    def _write(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                kind, directory, payload, doc = task
+                os.makedirs(directory, exist_ok=True)
+                if kind == 'json':
+                    with open(os.path.join(directory, payload), 'wt') as fp:
+                        json.dump(doc, fp)
+                else:
+                    self._writeChunk(directory, payload)
+            except Exception as exc:
+                self.log.error(f'{self}: writing failed: {exc}')
+            finally:
+                self._queue.task_done()
+
+    def _writeChunk(self, directory, chunk):
+        def append(name, A):
+            with open(os.path.join(directory, name), 'ab') as fp:
+                fp.write(np.ascontiguousarray(A).data)
+
+        append('time.bin', chunk['time'])
+        append('seq_num.bin', chunk['seq_num'])
+        append('uid.bin', chunk['uid'])
+        for key, A in chunk['values'].items():
+            append(f'{_file_name(key)}.bin', A)
+        for key, A in chunk['timestamps'].items():
+            append(f'{_file_name(key)}.ts.bin', A)
+        for key, values in chunk['objects'].items():
+            with open(os.path.join(directory, f'{_file_name(key)}.jsonl'),
+                      'at') as fp:
+                for val in values:
+                    fp.write(json.dumps(val))
+                    fp.write('\n')
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return (f'{cls_name}({self.directory!r},'
+                f' chunk_size={self.chunk_size})')
+
+
+def load_run(run_dir):
+    '''map the columns of a run written by :class:`ColumnarSink`
+
+    Returns:
+        dictionary with the start and stop document and per descriptor
+        uid the stream name, the descriptor and the columns (memory
+        mapped arrays, lists for non numeric data keys)
+    '''
+    def load_json(name):
+        with open(os.path.join(run_dir, name), 'rt') as fp:
+            return json.load(fp)
+
+    def memmap(directory, name, dtype, n_rows, shape=()):
+        if n_rows == 0:
+            return np.empty((0,) + tuple(shape), dtype=dtype)
+        return np.memmap(os.path.join(directory, name), dtype=dtype,
+                         mode='r', shape=(n_rows,) + tuple(shape))
+
+    run = dict(start=load_json('start.json'), stop=load_json('stop.json'),
+               streams={})
+    for uid, manifest in load_json('manifest.json').items():
+        directory = os.path.join(run_dir, uid)
+        n = manifest['n_rows']
+        files = manifest['files']
+        stream = dict(
+            name=manifest['name'], descriptor=manifest['descriptor'],
+            n_rows=n,
+            time=memmap(directory, 'time.bin', np.float64, n),
+            seq_num=memmap(directory, 'seq_num.bin', np.int64, n),
+            uid=memmap(directory, 'uid.bin', 'S36', n),
+            data={}, timestamps={},
+        )
+        for key, column in manifest['columns'].items():
+            stream['data'][key] = memmap(directory, f'{files[key]}.bin',
+                                         np.dtype(column['dtype']), n,
+                                         column['shape'])
+        for key in manifest['objects']:
+            filename = os.path.join(directory, f'{files[key]}.jsonl')
+            with open(filename, 'rt') as fp:
+                stream['data'][key] = [json.loads(line) for line in fp]
+        for key in files:
+            stream['timestamps'][key] = memmap(directory,
+                                               f'{files[key]}.ts.bin',
+                                               np.float64, n)
+        run['streams'][uid] = stream
+    return run
+
+
+def _events(stream):
+    descriptor_uid = stream['descriptor']['uid']
+    data = stream['data']
+    timestamps = stream['timestamps']
+    for i in range(stream['n_rows']):
+        event = dict(
+            descriptor=descriptor_uid, time=float(stream['time'][i]),
+            seq_num=int(stream['seq_num'][i]),
+            uid=stream['uid'][i].decode(),
+            data={key: (val[i].tolist() if isinstance(val, np.ndarray)
+                        else val[i]) for key, val in data.items()},
+            timestamps={key: float(val[i]) for key, val in timestamps.items()},
+        )
+        yield event['time'], i, event
+
+
+def documents(run_dir):
+    '''rebuild the documents of a run written by :class:`ColumnarSink`
+
+    Yields:
+        (name, document) as emitted by the RunEngine. Events of
+        different streams are merged by time
+    '''
+    run = load_run(run_dir)
+    yield 'start', run['start']
+    streams = run['streams'].values()
+    for stream in streams:
+        yield 'descriptor', stream['descriptor']
+    for t, i, event in heapq.merge(*[_events(stream) for stream in streams],
+                                   key=lambda item: (item[0], item[1])):
+        yield 'event', event
+    yield 'stop', run['stop']
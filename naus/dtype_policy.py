@@ -0,0 +1,142 @@
+'''Data types of observations and actions
+
+The spaces an environment declares (e.g. `Box(..., dtype=np.float32)`,
+`Discrete(2)`) define the types its observations and actions travel
+in. :class:`DtypePolicy` derives them once:
+
+* observations take the dtype of the observation space
+* discrete actions the smallest integer type holding all actions
+  (`uint8` for `Discrete(2)`, `int8` for `Discrete(3, start=-1)`)
+
+The environment casts the result of `computeState` once; the proxies
+then send the arrays as they are, without converting each element.
+Values outside the range of an integer dtype raise a `ValueError`
+instead of wrapping around.
+
+gym is not imported: spaces are recognised by their attributes.
+'''
+import logging
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+
+def space_dtype(space):
+    '''dtype for values of space
+
+    Returns:
+        a numpy dtype, a dictionary of them for a dictionary space or
+        None if unknown
+    '''
+    if space is None:
+        return None
+    spaces = getattr(space, 'spaces', None)
+    if isinstance(spaces, dict):
+        return {key: space_dtype(sub) for key, sub in spaces.items()}
+    n = getattr(space, 'n', None)
+    if n is not None:
+        # Discrete: start ... start + n - 1
+        start = int(getattr(space, 'start', 0))
+        return _integer_dtype(start, start + max(int(n) - 1, 0))
+    nvec = getattr(space, 'nvec', None)
+    if nvec is not None:
+        # MultiDiscrete
+        start = np.asarray(getattr(space, 'start', 0))
+        high = np.asarray(nvec) - 1 + start
+        return _integer_dtype(int(np.min(start)), int(np.max(high)))
+    dtype = getattr(space, 'dtype', None)
+    if dtype is None:
+        return None
+    return np.dtype(dtype)
+
+
+def _integer_dtype(low, high):
+    '''smallest integer dtype holding low ... high
+    '''
+    if low >= 0:
+        return np.min_scalar_type(high)
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    raise ValueError(f'no integer dtype holds {low} ... {high}')
+
+
+def _check_range(value, dtype):
+    '''raise if value can not be represented in the integer dtype
+    '''
+    if value.size == 0 or np.can_cast(value.dtype, dtype, casting='safe'):
+        return
+    if value.dtype.kind == 'f' and not np.array_equal(value, np.round(value)):
+        raise ValueError(f'{value} are not integers: can not cast to {dtype}')
+    info = np.iinfo(dtype)
+    if value.min() < info.min or value.max() > info.max:
+        txt = f'{value} out of range [{info.min}, {info.max}] of {dtype}'
+        raise ValueError(txt)
+
+
+def _cast(value, dtype):
+    if dtype is None:
+        return value
+    if isinstance(dtype, dict):
+        return {key: _cast(val, dtype.get(key)) for key, val in value.items()}
+    if dtype.kind in 'iu':
+        value = np.asarray(value)
+        _check_range(value, dtype)
+    return np.asarray(value, dtype=dtype)
+
+
+def _dtype_to_str(dtype):
+    if dtype is None:
+        return None
+    if isinstance(dtype, dict):
+        return {key: _dtype_to_str(val) for key, val in dtype.items()}
+    return dtype.str
+
+
+def _as_dtype(dtype):
+    if dtype is None:
+        return None
+    if isinstance(dtype, dict):
+        return {key: _as_dtype(val) for key, val in dtype.items()}
+    return np.dtype(dtype)
+
+
+class DtypePolicy:
+    '''types observations and actions are cast to
+
+    Args:
+        observation: numpy dtype or its name (or dictionary key: dtype
+                     for a dictionary observation). None: not cast
+        action:      numpy dtype of the actions. None: not cast
+    '''
+    def __init__(self, observation=None, action=None):
+        self.observation = _as_dtype(observation)
+        self.action = _as_dtype(action)
+
+    @classmethod
+    def fromSpaces(cls, observation_space=None, action_space=None):
+        return cls(space_dtype(observation_space), space_dtype(action_space))
+
+    @classmethod
+    def fromDict(cls, d):
+        '''inverse of :meth:`asDict`
+        '''
+        return cls(d.get('observation'), d.get('action'))
+
+    def asDict(self):
+        '''json serialisable description, e.g. for sending to a client
+        '''
+        return dict(observation=_dtype_to_str(self.observation),
+                    action=_dtype_to_str(self.action))
+
+    def castObservation(self, observation):
+        return _cast(observation, self.observation)
+
+    def castAction(self, action):
+        return _cast(action, self.action)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        d = self.asDict()
+        return f'{cls_name}(observation={d["observation"]!r}, action={d["action"]!r})'
@@ -1,134 +1,192 @@
 '''OpenAI compatible environment
 
-Todo:
-    This module does not need to depend on bluesky if the plans
-    are put in a separate module
+The default plans are defined in :mod:`naus.plans`. This module does
+not import bluesky.
 '''
-
-from bluesky import plan_stubs as bps, preprocessors as bpp
-import super_state_machine.machines
-
+from .plans import per_step_plan, setup_plan, reset_plan, teardown_plan
+from .plans import supports_fused_step, supports_restore, emit_reading_first
+from .watchdog import DeadlineExceeded
+from . import metrics
 from abc import abstractmethod
+import collections
 import functools
+import inspect
 import enum
 import logging
+import time
+import weakref
 logger = logging.getLogger('naus')
 
 
-def per_step_plan(detectors, motors, actions, *args, log=None, **kwargs):
-    '''execute one step and return detecors readings
-
-    Applies the actions to the motors and reads the detectors.
-
-    Args:
-        detectors: detectors to read from
-        motors:    motors to apply the actions to
-        actions:   keras-rl requested actions
-
-    Returns:
-        the detector readings.
+class TransitionError(Exception):
+    '''Transition not allowed by :class:`EnvironmentState`
     '''
-    if log is None:
-        log = logger
-
-    motors = list(motors)
-    action = list(actions)
-
-    # There should be a func
-    ml = []
-    for m, a in zip(motors, action):
-        ml.extend([m, a])
-    args = tuple(ml)
-
-    log.debug(f'Executing move (bps.mv) {args}')
-    yield from bps.mv(*args)
 
-    r = (yield from bps.trigger_and_read(detectors))
-    log.debug(f'Read {detectors} to {r}')
 
-    return r
-
-
-def setup_plan(detectors, motors, *args, log=None, **kwargs):
-    '''retrieve the actual status
+class EnvironmentState:
+    '''State the environment is currently in.
 
-    Reads the detectors and returns the state
+    Mainly used for cross checking purposes.
 
-    Args:
-        detectors: detectors to read from
+    For each state `x` (e.g. 'stepping') a method `set_x` and a
+    property `is_x` are provided. A transition not listed in
+    :attr:`transitions` raises :class:`TransitionError`.
 
-    Motors are passed for convenience for a user that intends to
-    implement his own plan.
+    Transitions are checked against a precomputed bitmask. The time
+    (:func:`time.monotonic`) a state was entered last is kept in
+    :attr:`timestamps`, the last transitions in :attr:`history`.
     '''
-    if log is None:
-        log = logger
-
-    yield from bps.checkpoint()
-    log.info(f'Reading detectors {detectors}')
-    r = (yield from bps.trigger_and_read(detectors))
-    log.info(f'setup returned {r}')
-    return r
-
+    class States(enum.Enum):
+        UNDEFINED = 'undefined'
+        SETUP = 'setting_up'
+        TEARDOWN = 'tearing_down'
+        RESETTING = 'resetting'
+        INITIALISED = 'initialised'
+        STEPPING = 'stepping'
+        DONE = 'done'
+        FAILED = 'failed'
 
-def reset_plan(detectors, state_motors, saved_state, *args, log=None,
-               **kwargs):
-    '''plan to revert environment to original state
+    initial_state = 'undefined'
+    transitions = {
+        'undefined':    ['resetting', 'setting_up', 'tearing_down', 'failed'],
+        'setting_up':   ['initialised', 'tearing_down', 'failed'],
+        'resetting':    ['initialised', 'tearing_down', 'failed'],
+        'initialised':  ['stepping',   'done', 'resetting', 'tearing_down', 'failed'],
+        'stepping':     ['stepping',   'done', 'resetting', 'tearing_down', 'failed'],
+        'done':         ['setting_up', 'done', 'resetting', 'tearing_down', 'failed'],
+        'tearing_down': ['undefined', 'failed'],
+        'failed':       ['undefined', 'resetting', 'tearing_down', 'failed'],
+    }
+
+    #: number of transitions kept in :attr:`history`
+    history_length = 64
+
+    def __init__(self):
+        index = self._index_of[self.initial_state]
+        self._index = index
+        self._allowed = self._allowed_masks[index]
+        self.timestamps = [None] * len(self._states)
+        self.timestamps[index] = time.monotonic()
+        self.history = collections.deque(maxlen=self.history_length)
 
-    Uses :func:`per_step_plan`. Passes the `state_motors`
-    as motors and the `saved_state` as actions.
-    '''
-    if log is None:
-        log = logger
+    @property
+    def actual_state(self):
+        return self._states[self._index]
 
-    log.info(
-        f'Executing reset plan on {state_motors} and saved_state {saved_state}'
-    )
-    r = (yield from per_step_plan(detectors, state_motors, saved_state))
-    log.info(f'Reset plan read {r}')
-    return r
+    @property
+    def state(self):
+        return self._states[self._index].value
 
+    def can_be(self, value):
+        return bool(self._allowed & (1 << self._index_of[value]))
 
-def teardown_plan(detectors, motors, actions, state_motors, state_actions,
-                  *args, log=None, **kwargs):
-    '''Typically: nothing to do
+    def set_(self, value):
+        '''transition to state value
+        '''
+        getattr(self, 'set_' + self.States(value).value)()
 
-    Args:
-        detectors: the detectors registered to the environment
+    def transitionLog(self):
+        '''last transitions as list of (timestamp, state value)
+        '''
+        states = self._states
+        return [(t, states[index].value) for t, index in self.history]
 
-    Todo:
-        Consider resetting to original state
-    '''
-    if log is None:
-        log = logger
+    def timeInState(self):
+        '''seconds since the current state was entered
+        '''
+        return time.monotonic() - self.timestamps[self._index]
 
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'<{cls_name} state={self.state!r}>'
 
-class EnvironmentState(super_state_machine.machines.StateMachine):
-    '''State the environment is currently in.
 
-    Mainly used for cross checking purposes.
+def _build_state_machine(cls):
+    '''add transition tables and set_x, is_x methods to cls
     '''
-    class States(enum.Enum):
-        UNDEFINED = 'undefined'
-        SETUP = 'setting_up'
-        TEARDOWN = 'tearing_down'
-        RESETTING = 'resetting'
-        INITIALISED = 'initialised'
-        STEPPING = 'stepping'
-        DONE = 'done'
-        FAILED = 'failed'
-
-    class Meta:
-        initial_state = 'undefined'
-        transitions = {
-            'undefined':    ['resetting', 'setting_up', 'tearing_down', 'failed'],
-            'setting_up':   ['initialised', 'tearing_down', 'failed'],
-            'resetting':    ['initialised', 'tearing_down', 'failed'],
-            'initialised':  ['stepping',   'done', 'resetting', 'tearing_down', 'failed'],
-            'stepping':     ['stepping',   'done', 'resetting', 'tearing_down', 'failed'],
-            'done':         ['setting_up', 'done', 'resetting', 'tearing_down', 'failed'],
-            'tearing_down': ['undefined', 'failed'],
-            'failed':       ['undefined', 'resetting', 'tearing_down', 'failed'],
-        }
+    states = tuple(cls.States)
+    index_of = {state.value: index for index, state in enumerate(states)}
+    masks = []
+    for state in states:
+        mask = 0
+        for target in cls.transitions[state.value]:
+            mask |= 1 << index_of[target]
+        masks.append(mask)
+
+    cls._states = states
+    cls._index_of = index_of
+    cls._allowed_masks = tuple(masks)
+
+    def make_setter(index, value):
+        bit = 1 << index
+        allowed = masks[index]
+        monotonic = time.monotonic
+
+        def setter(self):
+            if not self._allowed & bit:
+                txt = f"Can't transit from {self.state!r} to {value!r}."
+                raise TransitionError(txt)
+            now = monotonic()
+            self.timestamps[index] = now
+            self.history.append((now, index))
+            self._index = index
+            self._allowed = allowed
+
+        setter.__name__ = f'set_{value}'
+        setter.__doc__ = f'transition to state {value!r}'
+        return setter
+
+    def make_checker(index, value):
+        def checker(self):
+            return self._index == index
+        checker.__doc__ = f'True if in state {value!r}'
+        return property(checker)
+
+    for index, state in enumerate(states):
+        value = state.value
+        setattr(cls, f'set_{value}', make_setter(index, value))
+        setattr(cls, f'is_{value}', make_checker(index, value))
+    return cls
+
+
+_build_state_machine(EnvironmentState)
+
+
+steps_total = metrics.Counter(
+    'naus_environment_steps_total', 'Steps executed by the environment',
+    ('environment',)
+)
+resets_total = metrics.Counter(
+    'naus_environment_resets_total', 'Resets executed by the environment',
+    ('environment',)
+)
+episodes_total = metrics.Counter(
+    'naus_environment_episodes_total', 'Episodes finished by the environment',
+    ('environment',)
+)
+environment_state = metrics.StateSet(
+    'naus_environment_state', 'Current state of the environment',
+    [state.value for state in EnvironmentState.States], ('environment',)
+)
+
+
+#: instances created per environment class: labels of their metrics
+_n_instances = collections.Counter()
+
+
+def _default_metrics_name(cls_name):
+    _n_instances[cls_name] += 1
+    n = _n_instances[cls_name]
+    if n == 1:
+        return cls_name
+    return f'{cls_name}_{n}'
+
+
+def _state_of(ref):
+    env = ref()
+    if env is None:
+        return None
+    return env.state.state
 
 
 class Environment:
@@ -140,6 +198,9 @@ class Environment:
                     (see also argument per_step_plan)
         state_motors : motors (or actuators) to reset the state to
                     the original state (see reset_plan)
+        metrics_name : label of the metrics of this environment.
+                    None: the class name, numbered from the second
+                    instance on (e.g. `CartPoleEnv_2`)
 
     It uses the motors to execute the actions requested. At each
     step it hands the motors and detectors to the per_step plan.
@@ -175,11 +236,35 @@ class Environment:
     * :meth:`computeRewardTerminal`: This is called after each
       step. It must return the reward of the last step and if the
       epoch has terminated.
+      :mod:`naus.rules` allows declaring them instead.
 
     Finally the user has to assign a
     :class:`bcib.CallbackIteratorBridge` to the .bridge attribute
     unless you use
     :func:`naus.threaded_environment.run_environment`.
+
+    An agent executed within the RunEngine uses the plan methods
+    :meth:`planSetup`, :meth:`planReset`, :meth:`planStep` and
+    :meth:`planClose` instead (see :mod:`naus.inline`). They share
+    all processing with their counterparts.
+
+    Instruments (e.g. :class:`naus.profiler.StackSampler`) can be
+    added. Their methods `onStep` and `onEpisodeEnd` are called after
+    each step or at the end of each episode.
+
+    A :class:`naus.watchdog.DeadlineWatchdog` enforces deadlines on
+    the plans submitted for setup, reset, step and teardown. A missed
+    deadline raises :class:`naus.watchdog.DeadlineExceeded` and moves
+    the environment to the failed state.
+
+    The state returned by :meth:`computeState` is cast to the dtype of
+    the observation space (see :meth:`dtypePolicy`).
+
+    If the state motors can be restored directly and the detectors
+    read without trigger (see :func:`naus.plans.supports_restore` and
+    :func:`naus.plans.supports_fused_step`), :meth:`reset` does not
+    submit the reset plan. The reading of the detectors is emitted with
+    the next plan. Set `fast_reset` to False to always use the plan.
     '''
     def __init__(self, *, detectors, motors, state_motors, log=None,
                  per_step_plan=per_step_plan,
@@ -189,6 +274,11 @@ class Environment:
                  user_args=(),
                  user_kwargs={},
                  plan_bridge=None,
+                 instruments=(),
+                 watchdog=None,
+                 dtype_policy=None,
+                 fast_reset=True,
+                 metrics_name=None,
     ):
         '''
         Todo:
@@ -214,10 +304,33 @@ class Environment:
 
         self.state_to_reset_to = None
 
-        self._bridge = plan_bridge
+        self.instruments = list(instruments)
+        self.watchdog = watchdog
+        if watchdog is not None:
+            self.addInstrument(watchdog)
+
+        self._dtype_policy = dtype_policy
+        # None: not yet checked if the devices support it
+        self._fast_reset = None if fast_reset else False
+        self._emit_reading = False
+
+        self._bridge = None
+        self._bridge_timeout = False
+        if plan_bridge is not None:
+            self.bridge = plan_bridge
 
         self.state = EnvironmentState()
 
+        if metrics_name is None:
+            metrics_name = _default_metrics_name(self.__class__.__name__)
+        self.metrics_name = name = metrics_name
+        self._steps_total = steps_total.labels(name)
+        self._resets_total = resets_total.labels(name)
+        self._episodes_total = episodes_total.labels(name)
+        environment_state.labels(name).set_function(
+            functools.partial(_state_of, weakref.ref(self))
+        )
+
     #-------------------------------------------------------------------------
     # Methods to override in a derived class
     @abstractmethod
@@ -293,6 +406,26 @@ class Environment:
         terminal = None
         return reward, reward
 
+    def dtypePolicy(self):
+        '''types observations and actions are cast to
+
+        Derived from the `observation_space` and `action_space` of the
+        environment at the first call, unless given to the constructor.
+
+        Returns:
+            a :class:`naus.dtype_policy.DtypePolicy`
+        '''
+        policy = self._dtype_policy
+        if policy is None:
+            from .dtype_policy import DtypePolicy
+            policy = DtypePolicy.fromSpaces(
+                getattr(self, 'observation_space', None),
+                getattr(self, 'action_space', None)
+            )
+            self._dtype_policy = policy
+            self.log.info(f'{self.__class__.__name__}: using {policy}')
+        return policy
+
     def checkOnStart(self):
         '''
 
@@ -309,28 +442,38 @@ class Environment:
         :meth:`storeInitialState`.
 
         '''
+        cmd = self._setupCommand()
+        # self.log.debug(f'{cls_name}.setup: submitting command {cmd}')
+        r = self._submit(cmd, 'setup')
+        self._setupResult(r)
+
+    def _setupCommand(self):
         self.state.set_setting_up()
         cmd = functools.partial(self.setup_plan, self.detectors, self.motors,
                                 self.user_args, self.user_kwargs)
-        cls_name = self.__class__.__name__
-        # self.log.debug(f'{cls_name}.setup: submitting command {cmd}')
-        r = self._submit(cmd)
+        return cmd
+
+    def _setupResult(self, r):
         self.storeInitialState(r)
         self.state.set_initialised()
 
     def close(self):
         '''What to emit to the run engine?
         '''
+        cmd = self._teardownCommand()
+        self._submit(cmd, 'teardown')
+
+        # Inform bluesky that we are done ...
+        self._bridge.stopDelegation()
+        self.state.set_undefined()
+
+    def _teardownCommand(self):
         self.state.set_tearing_down()
         reset_state = self.getStateToResetTo()
         cmd = functools.partial(self.teardown_plan, self.detectors, self.motors,
                                 self.state_motors, reset_state,
                                 self.user_args, self.user_kwargs)
-        self._submit(cmd)
-
-        # Inform bluesky that we are done ...
-        self._bridge.stopDelegation()
-        self.state.set_undefined()
+        return cmd
 
     def done(self):
         self._bridge.stopDelegation()
@@ -362,7 +505,14 @@ class Environment:
                                   debugging, and sometimes
                                   learning).
         """
+        cmd = self._stepCommand(actions)
+        # self.log.debug(f'step executing command {cmd}')
+        r_dic = self._submit(cmd, 'step')
+        return self._stepResult(r_dic)
 
+    def _stepCommand(self, actions):
+        '''check the actions, build the per step plan
+        '''
         self.state.set_stepping()
 
         lm = len(self.motors)
@@ -383,21 +533,30 @@ class Environment:
                 raise AssertionError(txt)
         except Exception:
             self.state.set_stepping()
-            self.bridge.stopDelegation()
+            # executed as plan there is no bridge to stop
+            if self._bridge is not None:
+                self._bridge.stopDelegation()
             raise
 
         cmd = functools.partial(self.per_step_plan, self.detectors,
                                 self.motors, actions,
                                 *self.user_args, **self.user_kwargs)
-        # self.log.debug(f'step executing command {cmd}')
-        r_dic = self._submit(cmd)
+        return cmd
 
-        # Process result
-        state = self.computeState(r_dic)
+    def _stepResult(self, r_dic):
+        '''observation, reward, done and info from the step's reading
+        '''
+        state = self.dtypePolicy().castObservation(self.computeState(r_dic))
         reward, done = self.computeRewardTerminal(r_dic)
         info = {}
+        self._steps_total.value += 1
+        for instrument in self.instruments:
+            instrument.onStep(self)
         if done:
+            self._episodes_total.value += 1
             self.state.set_done()
+            for instrument in self.instruments:
+                instrument.onEpisodeEnd(self)
         return state, reward, done, info
 
     def reset(self):
@@ -407,28 +566,115 @@ class Environment:
             The device should now what its inital state was.
             What's the bluesky equivalent to this call
         '''
+        reset_state = self._beginReset()
+        if self.canResetFast():
+            r_dic = self._restore(reset_state)
+        else:
+            # self.log.warning(f'reset: Starting to apply plan {self.user_kwargs}')
+            cmd = self._resetCommand(reset_state)
+            # Process result
+            r_dic = self._submit(cmd, 'reset')
+            # self.log.warning('reset: Applied plan')
+        return self._resetResult(r_dic)
+
+    def _beginReset(self):
         self.state.set_resetting()
         reset_state = self.getStateToResetTo()
 
         assert(self.state_motors is not None)
         assert(self.detectors is not None)
+        return reset_state
 
-        # self.log.warning(f'reset: Starting to apply plan {self.user_kwargs}')
+    def _resetCommand(self, reset_state):
         cmd = functools.partial(self.reset_plan, self.detectors,
                                 self.state_motors, reset_state,
                                 *self.user_args, **self.user_kwargs)
-        # Process result
-        r_dic = self._submit(cmd)
-        # self.log.warning('reset: Applied plan')
+        return cmd
 
+    def _resetResult(self, r_dic):
         # Translate it to a state
         #self.log.warning(f'reset: computing state {r_dic}')
-        state = self.computeState(r_dic)
+        state = self.dtypePolicy().castObservation(self.computeState(r_dic))
         # self.log.warning(f'reset: computed state {state}')
         assert(state is not None)
+        self._resets_total.value += 1
         self.state.set_initialised()
         return state
 
+    # -------------------------------------------------------------------------
+    # The same methods as plans: for an agent executed within the
+    # RunEngine (see :mod:`naus.inline`). Each returns what its
+    # counterpart returns, e.g. `r = (yield from env.planStep(actions))`
+    def planSetup(self):
+        '''plan version of :meth:`setup`
+        '''
+        r = (yield from self._runPlan(self._setupCommand(), 'setup'))
+        self._setupResult(r)
+
+    def planReset(self):
+        '''plan version of :meth:`reset`
+
+        Returns:
+            the observation
+        '''
+        reset_state = self._beginReset()
+        if self.canResetFast():
+            r_dic = self._restore(reset_state)
+        else:
+            cmd = self._resetCommand(reset_state)
+            r_dic = (yield from self._runPlan(cmd, 'reset'))
+        return self._resetResult(r_dic)
+
+    def planStep(self, actions):
+        '''plan version of :meth:`step`
+
+        Returns:
+            observation, reward, done, info
+        '''
+        cmd = self._stepCommand(actions)
+        r_dic = (yield from self._runPlan(cmd, 'step'))
+        return self._stepResult(r_dic)
+
+    def planClose(self):
+        '''plan version of :meth:`close`
+        '''
+        yield from self._runPlan(self._teardownCommand(), 'teardown')
+        self.state.set_undefined()
+
+    def canResetFast(self):
+        '''True if reset can restore the state motors directly
+
+        Only if the default reset plan is used: a plan given by the
+        user is always executed.
+        '''
+        if self._fast_reset is None:
+            self._fast_reset = (
+                self.reset_plan is reset_plan
+                and all(supports_restore(m) for m in self.state_motors)
+                and all(supports_fused_step(d) for d in self.detectors)
+            )
+            if self._fast_reset:
+                self.log.info(f'{self.__class__.__name__}: resetting by'
+                              ' restoring the state motors')
+        return self._fast_reset
+
+    def _restore(self, reset_state):
+        '''restore the state motors, read the detectors
+
+        Executed in the agent's thread: the RunEngine thread is waiting
+        for the next command meanwhile (or is the agent's thread, if
+        called by :meth:`planReset`).
+        '''
+        assert(not self.state.is_failed)
+        for motor, value in zip(self.state_motors, list(reset_state)):
+            motor.restore(value)
+        r = {}
+        for det in self.detectors:
+            r.update(det.read())
+        # The document stream gets the reading with the next plan
+        self._emit_reading = True
+        return r
+
     def __enter__(self):
         """Support with-statement for the environment. """
         self.checkOnStart()
@@ -456,18 +702,98 @@ class Environment:
         )
         return txt
 
-    def _submit(self, cmd):
+    def addInstrument(self, instrument):
+        '''add an instrument if not yet known
+        '''
+        if instrument not in self.instruments:
+            self.instruments.append(instrument)
+
+    def instrument(self, name):
+        '''find instrument by its name
+        '''
+        for instrument in self.instruments:
+            if instrument.name == name:
+                return instrument
+        cls_name = self.__class__.__name__
+        raise KeyError(f'{cls_name}: no instrument named {name}')
+
+    def _submit(self, cmd, kind=None):
+        '''execute plan cmd using the bridge
+
+        Args:
+            kind: command kind used for selecting the deadline
+        '''
         assert(not self.state.is_failed)
         if self._bridge is None:
             raise AssertionError('bridge obj is None')
+
+        cmd = self._pendingReading(cmd)
+        watchdog = self.watchdog
+        timeout = None
+        if watchdog is not None:
+            timeout = watchdog.arm(kind)
+
         try:
-            r = self._bridge.submit(cmd)
-        except Exception:
+            if timeout is not None and self._bridge_timeout:
+                r = self._bridge.submit(cmd, timeout=timeout)
+            else:
+                r = self._bridge.submit(cmd)
+        except Exception as exc:
+            missed = watchdog is not None and watchdog.disarm()
+            self.state.set_failed()
+            self._bridge.stopDelegation()
+            if missed:
+                self._raiseDeadlineExceeded(kind, exc)
+            raise
+
+        if watchdog is not None and watchdog.disarm():
+            # Finished, but too late: the plan is being aborted
             self.state.set_failed()
             self._bridge.stopDelegation()
+            self._raiseDeadlineExceeded(kind, None)
+        return r
+
+    def _runPlan(self, cmd, kind=None):
+        '''execute plan cmd within the calling plan
+
+        Counterpart of :meth:`_submit` for the plan methods: no bridge
+        is involved.
+        '''
+        assert(not self.state.is_failed)
+        cmd = self._pendingReading(cmd)
+        watchdog = self.watchdog
+        if watchdog is not None:
+            watchdog.arm(kind)
+
+        try:
+            r = (yield from cmd())
+        except Exception as exc:
+            missed = watchdog is not None and watchdog.disarm()
+            self.state.set_failed()
+            if missed:
+                self._raiseDeadlineExceeded(kind, exc)
             raise
+
+        if watchdog is not None and watchdog.disarm():
+            self.state.set_failed()
+            self._raiseDeadlineExceeded(kind, None)
         return r
 
+    def _pendingReading(self, cmd):
+        '''prepend the reading of a reset done without plan
+        '''
+        if self._emit_reading:
+            self._emit_reading = False
+            cmd = functools.partial(emit_reading_first, self.detectors, cmd)
+        return cmd
+
+    def _raiseDeadlineExceeded(self, kind, exc):
+        report = self.watchdog.lastReport()
+        summary = report['summary'] if report else 'no report'
+        cls_name = self.__class__.__name__
+        txt = f'{cls_name}: {kind} missed its deadline: {summary}'
+        raise DeadlineExceeded(txt, report) from exc
+
     @property
     def bridge(self):
         assert(self._bridge is not None)
@@ -480,6 +806,19 @@ class Environment:
         assert(callable(obj.stopDelegation))
         self.log.info(f'Replacing bridge {self._bridge} with {obj}')
         self._bridge = obj
+        # can the agent stop waiting for a plan exceeding its deadline?
+        try:
+            parameters = inspect.signature(obj.submit).parameters
+        except (TypeError, ValueError):
+            parameters = {}
+        self._bridge_timeout = 'timeout' in parameters
+        if self.watchdog is not None:
+            self.watchdog.bridge = obj
+            if not self._bridge_timeout:
+                self.log.warning(
+                    f'Bridge {obj} does not support a timeout: on a missed'
+                    ' deadline the agent waits until the plan is aborted'
+                )
 
     def clearLinkToBridge(self):
         self.log.info(f'Clearing link to bridge {self._bridge}')
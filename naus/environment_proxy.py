@@ -4,10 +4,23 @@ Todo:
     review if xmlrpc is an appropriate choice
 '''
 
+from .recording import recorded
 import logging
 logger = logging.getLogger('naus')
 
 
+def _to_list(seq):
+    '''sequence to list, in one call for arrays
+
+    xmlrpc knows only doubles: the observation dtype only determines
+    the values' precision
+    '''
+    tolist = getattr(seq, 'tolist', None)
+    if tolist is not None:
+        return tolist()
+    return [float(x) for x in seq]
+
+
 class _EnvironmentProxy:
     '''
 
@@ -66,7 +79,7 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
             raise exc
 
         # self.log.warning(f'Reset environment returned {r}')
-        r = [float(x) for x in r]
+        r = _to_list(r)
         # self.log.warning(f'Reset returned {r}')
         return r
 
@@ -77,7 +90,7 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
         r = self._rec.step(*args, **kwargs)
         state, action, done, info = r
         # self.log.debug(f'step returned unconverted {r}')
-        state = [float(x) for x in state]
+        state = _to_list(state)
         r = state, action, done, info
         # self.log.debug(f'step returned {r}')
         return r
@@ -93,20 +106,37 @@ class EnvironmentProxyForClient(_EnvironmentProxy):
 
     This makes the different keras-rl callback methods compatible
     with xmlrpc.
+
+    Args:
+        recorder: a :class:`naus.recording.CommandRecorder`. If given
+                  all commands are recorded
     '''
+    def __init__(self, receiver, *, recorder=None, **kwargs):
+        super().__init__(receiver, **kwargs)
+        self.recorder = recorder
+
+    @recorded
     def seed(self, *args, **kwargs):
         seed = self._rec.seed(*args, **kwargs)
         r = int(seed)
         return r
 
+    @recorded
     def setup(self):
         return self._rec.setup()
 
+    @recorded
     def reset(self):
         return self._rec.reset()
 
+    @recorded
     def step(self, actions):
-        actions = list(actions)
+        tolist = getattr(actions, 'tolist', None)
+        if tolist is not None:
+            # numpy integers can not be marshalled
+            actions = tolist()
+        else:
+            actions = list(actions)
         return self._rec.step(actions)
 
     def steps_beyond_done(self, *args, **kwargs):
@@ -2,15 +2,140 @@
 
 Purpose:
     See if xmlrpc is a performance bottleneck.
+
+This module is all an agent node needs: it does not depend on bluesky
+or ophyd. zmq and numpy are loaded when first used.
 '''
 
-import zmq
-import numpy as np
+from ._lazy import lazy_import
+from .recording import recorded
+from . import metrics
+import collections
+import functools
 import logging
 import itertools
+import threading
+import time
+
+zmq = lazy_import('zmq')
+np = lazy_import('numpy')
 
 logger = logging.getLogger('naus')
 
+
+@functools.lru_cache(maxsize=None)
+def get_codecs():
+    '''Codecs usable for compressing array frames
+
+    Returns:
+        dictionary mapping the codec name to a (compress, decompress)
+        tuple. zlib and lzma are always available, lz4 and zstd are
+        added if the modules are installed.
+
+    The modules are imported at the first call.
+    '''
+    import lzma
+    import zlib
+
+    codecs = {
+        'zlib': (functools.partial(zlib.compress, level=1), zlib.decompress),
+        'lzma': (functools.partial(lzma.compress, preset=0), lzma.decompress),
+    }
+    try:
+        import lz4.frame
+    except ImportError:
+        pass
+    else:
+        codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        codecs['zstd'] = (zstandard.ZstdCompressor(level=1).compress,
+                          zstandard.ZstdDecompressor().decompress)
+    return codecs
+
+
+class ArrayCompressor:
+    '''Compress arrays before they are sent as frame
+
+    Args:
+        codec:     name of the codec to use (see :func:`get_codecs`)
+        threshold: arrays smaller than this number of bytes are sent raw
+        min_ratio: compression ratio the codec has to achieve. If not
+                   the array is sent raw
+        backoff:   number of arrays sent raw after a poor compression
+                   ratio was found, before compression is tried again
+
+    The codec used is stored in the metadata ('A_codec'), thus the
+    receiver does not need to be configured.
+
+    Compression only pays if the link is slower than the codec: over
+    a local tcp connection arrays are sent faster raw (see
+    examples/benchmarks/zmq_compression_benchmark.py).
+    '''
+    def __init__(self, codec='zlib', *, threshold=64 * 1024, min_ratio=1.25,
+                 backoff=16):
+        codecs = get_codecs()
+        if codec not in codecs:
+            txt = f'codec {codec} unknown, available are {list(codecs)}'
+            raise ValueError(txt)
+        self.codec = codec
+        self._compress = codecs[codec][0]
+        self.threshold = int(threshold)
+        self.min_ratio = float(min_ratio)
+        self.backoff = int(backoff)
+        self._skip = 0
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def encode(self, A):
+        '''Compress array if worth it
+
+        Returns:
+            codec name and the object to send. The latter is the
+            array itself if it was not compressed
+        '''
+        nbytes = A.nbytes
+        self.bytes_in += nbytes
+        if nbytes < self.threshold:
+            self.bytes_out += nbytes
+            return 'raw', A
+
+        if self._skip > 0:
+            self._skip -= 1
+            self.bytes_out += nbytes
+            return 'raw', A
+
+        A = np.ascontiguousarray(A)
+        buf = self._compress(memoryview(A).cast('B'))
+        if nbytes < self.min_ratio * len(buf):
+            # Not worth the cpu time on the other side: try again later
+            self._skip = self.backoff
+            self.bytes_out += nbytes
+            return 'raw', A
+
+        self.bytes_out += len(buf)
+        return self.codec, buf
+
+    @property
+    def ratio(self):
+        '''compression ratio achieved so far'''
+        if self.bytes_out == 0:
+            return 1.0
+        return self.bytes_in / self.bytes_out
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = (
+            f'{cls_name}(codec={self.codec!r}, threshold={self.threshold},'
+            f' min_ratio={self.min_ratio}, backoff={self.backoff})'
+        )
+        return txt
+
 #def array_metadata(A):
 #    md = dict(
 #        dtype = str(A.dtype),
@@ -32,10 +157,43 @@ logger = logging.getLogger('naus')
 def _recv_array(socket, metadata, flags=0, copy=False, track=False):
     msg = socket.recv(flags=flags, copy=copy, track=track)
     buf = memoryview(msg)
+    codec = metadata.get('A_codec', 'raw')
+    if codec != 'raw':
+        buf = get_codecs()[codec][1](buf)
     A = np.frombuffer(buf, dtype=metadata['A_dtype'])
     return A.reshape(metadata['A_shape'])
 
 
+def _recv_arrays(socket, metadata, flags=0, copy=False, track=False):
+    '''receive the named arrays described in metadata['A_arrays']
+
+    Each array is sent as frame on its own.
+
+    Returns:
+        an ordered dictionary of name: array, in the order the
+        arrays were described
+    '''
+    arrays = collections.OrderedDict()
+    for a_md in metadata['A_arrays']:
+        A = _recv_array(socket, a_md, flags=flags, copy=copy, track=track)
+        arrays[a_md['name']] = A
+    return arrays
+
+
+def split_info(info):
+    '''separate arrays from json serialisable info
+
+    Returns:
+        info without the arrays, dictionary of arrays
+    '''
+    arrays = {}
+    info = dict(info)
+    for key, val in list(info.items()):
+        if isinstance(val, np.ndarray):
+            arrays[key] = info.pop(key)
+    return info, arrays
+
+
 #def recv_array(socket, flags=0, copy=True, track=False):
 #    """recv a numpy array
 #
@@ -45,6 +203,55 @@ def _recv_array(socket, metadata, flags=0, copy=False, track=False):
 #    return _recv_array(socket, md)
 
 
+def observation_to_arrays(observation):
+    '''named arrays for an observation
+
+    A dictionary observation (e.g. of a :class:`gym.spaces.Dict`
+    space) is mapped to arrays named 'obs/<key>', any other
+    observation to an array named 'obs'.
+    '''
+    if isinstance(observation, dict):
+        arrays = collections.OrderedDict(
+            (f'obs/{key}', val) for key, val in observation.items()
+        )
+    else:
+        arrays = collections.OrderedDict(obs=observation)
+    return arrays
+
+
+def arrays_to_observation(arrays):
+    '''inverse of :func:`observation_to_arrays`
+
+    Returns:
+        observation, dictionary of the arrays to be stored in info
+        (named 'info/<key>' in arrays)
+
+    The observation is an ordered dictionary as returned by
+    :class:`gym.spaces.Dict` if the arrays were created from a
+    dictionary.
+    '''
+    observation = collections.OrderedDict()
+    info = {}
+    for name, A in arrays.items():
+        if name == 'obs':
+            observation = A
+        elif name.startswith('obs/'):
+            observation[name[4:]] = A
+        elif name.startswith('info/'):
+            info[name[5:]] = A
+        else:
+            raise ValueError(f'Do not know where to put array {name}')
+    return observation, info
+
+
+def _copy_observation(observation):
+    '''copy: pipelines may return views on buffers they reuse
+    '''
+    if isinstance(observation, dict):
+        return {key: np.array(val) for key, val in observation.items()}
+    return np.array(observation)
+
+
 def time_to_expire(max_time, dt=.2, n_max=100):
     import time
     start = time.time()
@@ -67,8 +274,19 @@ def time_to_expire(max_time, dt=.2, n_max=100):
 
 class _EnvironmentProxy:
 
+    #: name of the zmq socket type. PAIR: one client per server
+    socket_type = 'PAIR'
+
     def __init__(self, receiver, *, port=9998, flags=0, copy=False, track=False,
-                 max_time=10,  log=None):
+                 max_time=10,  log=None, compression=None,
+                 compression_threshold=64 * 1024, compression_min_ratio=1.25):
+        '''
+
+        Args:
+            compression: name of the codec used for compressing
+                         arrays sent (see :class:`ArrayCompressor`).
+                         None: send arrays raw
+        '''
         self._rec = receiver
         if log is None:
             log = logger
@@ -83,11 +301,18 @@ class _EnvironmentProxy:
         self.poller_in = None
         self.poller_out = None
         self.max_time = max_time
+
+        self.compressor = None
+        if compression is not None:
+            self.compressor = ArrayCompressor(
+                compression, threshold=compression_threshold,
+                min_ratio=compression_min_ratio
+            )
         self._initConnection()
 
     def _initConnection(self):
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.PAIR)
+        self.socket = self.context.socket(getattr(zmq, self.socket_type))
         self.poller_in =  zmq.Poller()
         self.poller_in.register(self.socket, zmq.POLLIN)
         self.poller_out =  zmq.Poller()
@@ -104,17 +329,52 @@ class _EnvironmentProxy:
     # def __getattr__(self, name):
     #    return getattr(self._rec, name)
 
+    def _encodeArray(self, a_md, A):
+        '''fill array description into a_md
+
+        Returns:
+            the object to send
+        '''
+        A = np.asarray(A)
+        a_md['A_dtype'] = str(A.dtype)
+        a_md['A_shape'] = A.shape
+        if self.compressor is None:
+            a_md['A_codec'] = 'raw'
+        else:
+            a_md['A_codec'], A = self.compressor.encode(A)
+        return A
+
     def sendData(self, md, A):
+        '''send metadata and array(s)
+
+        Args:
+            md: metadata. Will be json encoded
+            A:  None, an array or a dictionary of named arrays. In the
+                last case one header describes all arrays and each
+                array is sent as frame on its own.
+        '''
         flags = self.flags
         if A is None:
             t_flags = flags
             md['has_A'] = False
+            frames = ()
+        elif isinstance(A, dict):
+            t_flags = flags|zmq.SNDMORE
+            md['has_A'] = True
+            a_mds = []
+            frames = []
+            for name, val in A.items():
+                a_md = dict(name=name)
+                frames.append(self._encodeArray(a_md, val))
+                a_mds.append(a_md)
+            md['A_arrays'] = a_mds
+            if not frames:
+                md['has_A'] = False
+                t_flags = flags
         else:
-            A = np.asarray(A)
             t_flags = flags|zmq.SNDMORE
             md['has_A'] = True
-            md['A_dtype'] = str(A.dtype)
-            md['A_shape'] = A.shape
+            frames = [self._encodeArray(md, A)]
 
         copy = self.copy
         track = self.track
@@ -135,9 +395,11 @@ class _EnvironmentProxy:
         # self.log.info(f'{cls_name}: sending metadata {md}')
         socket.send_json(md, t_flags)
         # self.log.info(f'{cls_name}: sent metadata {md}')
-        if A is not None:
+        n_last = len(frames) - 1
+        for cnt, frame in enumerate(frames):
             # self.log.info(f'{cls_name}: sending array {md}')
-            socket.send(A, flags, copy=copy, track=track)
+            f_flags = flags if cnt == n_last else flags|zmq.SNDMORE
+            socket.send(frame, f_flags, copy=copy, track=track)
             # self.log.info(f'{cls_name}: sent array {md}')
 
     def receiveData(self):
@@ -158,21 +420,72 @@ class _EnvironmentProxy:
 
         md = socket.recv_json(flags=flags)
         has_A = md['has_A']
-        if has_A:
+        if has_A and 'A_arrays' in md:
+            A = _recv_arrays(socket, md, flags=flags, track=track, copy=copy)
+        elif has_A:
             A = _recv_array(socket, md, flags=flags, track=track, copy=copy)
         else:
             A = None
         return md, A
 
 
+commands_total = metrics.Counter(
+    'naus_proxy_commands_total', 'Commands processed by the server proxy',
+    ('port', 'command')
+)
+command_exceptions_total = metrics.Counter(
+    'naus_proxy_command_exceptions_total',
+    'Commands of the server proxy that raised an exception',
+    ('port', 'command')
+)
+command_latency_seconds = metrics.Histogram(
+    'naus_proxy_command_latency_seconds',
+    'Time spent by the server proxy executing a command',
+    ('port', 'command')
+)
+connected_clients = metrics.Gauge(
+    'naus_proxy_connected_clients', 'Clients connected to the server proxy',
+    ('port',)
+)
+
+
 class EnvironmentProxyForServer(_EnvironmentProxy):
     '''make method calls return xmlrpc compatible
+
+    Args:
+        receivers: dictionary name: environment. A command carrying
+                   the name in its metadata ('env') is executed by
+                   this environment, all others by the receiver
+
+    The request id ('rid') of a command is returned with its answer,
+    thus a client can have several requests outstanding (see
+    :meth:`EnvironmentProxyForClient.submitCommand`).
+
+    A client can configure a :class:`naus.preprocessing.Pipeline` per
+    environment ('configure_pipeline', or 'pipeline' in the metadata
+    of a reset), applied to the observations and rewards before they
+    are sent. The pipeline is kept until replaced or cleared, also
+    across clients.
+
+    Args:
+        transition_sinks: objects with a method
+                          `add(observation, action, reward,
+                          next_observation, done)`, e.g. a
+                          :class:`naus.replay.ReplayFeeder`. They get
+                          each transition as sent to the client
     '''
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, receivers=None, transition_sinks=(), **kwargs):
+        if receivers is None:
+            receivers = {}
+        self.receivers = dict(receivers)
+        self.pipelines = {}
+        self.transition_sinks = list(transition_sinks)
+        self._last_observations = {}
         super().__init__(*args, **kwargs)
 
         self.command_dic = self._buildCommandDict()
+        self._initMetrics()
 
     def _initConnection(self):
         super()._initConnection()
@@ -181,11 +494,59 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
         self.log.info(f'{cls_name}: Opening port @ {txt}')
         self.socket.bind(txt)
 
+        events = zmq.EVENT_ACCEPTED | zmq.EVENT_DISCONNECTED
+        self._monitor = self.socket.get_monitor_socket(events)
+        # exports run in threads of the metrics server: zmq sockets
+        # must not be used concurrently
+        self._monitor_lock = threading.Lock()
+        self._n_clients = 0
+
+    def _initMetrics(self):
+        '''children of the metrics: recording is then a single update
+        '''
+        port = self.port
+        self._m_commands = {}
+        for cmd in self.command_dic:
+            self._m_commands[cmd] = (
+                commands_total.labels(port, cmd),
+                command_exceptions_total.labels(port, cmd),
+                command_latency_seconds.labels(port, cmd),
+            )
+        connected_clients.labels(port).set_function(self.connectedClients)
+
+    def connectedClients(self):
+        '''number of connected clients
+
+        Evaluated when the metrics are exported: socket monitor
+        events are only processed then, by one export at a time.
+        '''
+        from zmq.utils.monitor import recv_monitor_message
+
+        monitor = self._monitor
+        with self._monitor_lock:
+            while monitor.poll(0):
+                event = recv_monitor_message(monitor)['event']
+                if event == zmq.EVENT_ACCEPTED:
+                    self._n_clients += 1
+                elif event == zmq.EVENT_DISCONNECTED:
+                    self._n_clients = max(self._n_clients - 1, 0)
+            return self._n_clients
+
     def _buildCommandDict(self):
-        commands = ['setup', 'step', 'seed', 'reset', 'set_mode']
+        commands = ['setup', 'step', 'seed', 'reset', 'set_mode',
+                    'instrument', 'dtype_policy', 'configure_pipeline']
         d = {cmd : getattr(self, cmd) for cmd in commands}
         return d
 
+    def receiverFor(self, md):
+        '''the environment the command is addressed to
+        '''
+        try:
+            name = md['env']
+        except KeyError:
+            return self._rec
+        return self.receivers[name]
+
     def commandToMethod(self, name):
         '''
 
@@ -202,18 +563,29 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
         cls_name = self.__class__.__name__
         md, A = self.receiveData()
         cmd = md['cmd']
+        rid = md.get('rid')
         # self.log.info(f'{cls_name}: processing command {cmd}')
         method = self.commandToMethod(cmd)
+        m_count, m_exceptions, m_latency = self._m_commands[cmd]
+        m_count.value += 1
+        start = time.perf_counter()
         try:
             r_md, r_A = method(md, A)
         except Exception as ex:
+            m_latency.observe(time.perf_counter() - start)
+            m_exceptions.value += 1
             txt = f'{cls_name}: command {cmd} raise exeception {ex}'
             self.log.error(txt)
             r_md = dict(exception = ex.__class__.__name__, args=ex.args)
+            if rid is not None:
+                r_md['rid'] = rid
             self.sendData(r_md, None)
 
         else:
+            m_latency.observe(time.perf_counter() - start)
             # self.log.info(f'{cls_name}: command {cmd} returned {r_md}, {r_A}')
+            if rid is not None:
+                r_md['rid'] = rid
             self.sendData(r_md, r_A)
 
     def loop(self):
@@ -224,13 +596,58 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
 
     def set_mode(self, md, A):
         set_mode = md['set_mode']
-        self._rec.set_mode(set_mode)
+        self.receiverFor(md).set_mode(set_mode)
         return {}, None
 
+    def instrument(self, md, A):
+        '''execute an action of an instrument of the environment
+
+        The actions allowed are listed by the instrument in its
+        attribute `remote_actions`
+        '''
+        name = md['instrument']
+        action = md['action']
+        instrument = self.receiverFor(md).instrument(name)
+        if action not in instrument.remote_actions:
+            raise ValueError(f'action {action} not allowed for {name}')
+        r = getattr(instrument, action)()
+        return dict(result=r), None
+
+    def dtype_policy(self, md, A):
+        '''types of observations and actions of the environment
+
+        None if the environment does not define a policy
+        '''
+        get_policy = getattr(self.receiverFor(md), 'dtypePolicy', None)
+        if get_policy is None:
+            return dict(policy=None), None
+        return dict(policy=get_policy().asDict()), None
+
+    def configure_pipeline(self, md, A):
+        '''preprocess observations and rewards of the environment
+
+        md['pipeline']: configuration (see
+        :meth:`naus.preprocessing.Pipeline.fromConfig`). None or empty
+        removes the pipeline
+        '''
+        from .preprocessing import Pipeline
+
+        env = md.get('env')
+        # check that the environment is known
+        self.receiverFor(md)
+        config = md['pipeline']
+        if not config:
+            self.pipelines.pop(env, None)
+            return dict(pipeline=None), None
+        pipeline = Pipeline.fromConfig(config)
+        self.pipelines[env] = pipeline
+        self.log.info(f'Environment {env}: preprocessing by {pipeline}')
+        return dict(pipeline=pipeline.config()), None
+
     def setup(self, md, A):
         self.log.info(f'Setup')
         assert(A is None)
-        r = self._rec.setup()
+        r = self.receiverFor(md).setup()
         A = np.asarray(r)
         self.log.info(f'Setup called with {md} {A} returned {r}')
         return {}, A
@@ -241,7 +658,7 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
         assert(A is not None)
         self.log.info(f'seed {A} type {type(A)}')
         seed = int(A)
-        seed = self._rec.seed(seed)
+        seed = self.receiverFor(md).seed(seed)
         A = np.asarray(seed)
         return {}, seed
 
@@ -251,10 +668,24 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
         Sequences to lists
         '''
         assert(A is None)
-        r = self._rec.reset()
-        A = np.asarray(r)
+        if 'pipeline' in md:
+            self.configure_pipeline(md, None)
+        r = self.receiverFor(md).reset()
+        pipeline = self.pipelines.get(md.get('env'))
+        if pipeline is not None:
+            r = pipeline.reset(r)
+        if self.transition_sinks:
+            self._last_observations[md.get('env')] = _copy_observation(r)
+        if isinstance(r, dict):
+            A = observation_to_arrays(r)
+        else:
+            A = np.asarray(r)
         # self.log.debug(f'Reset returned {r}')
-        return {}, A
+        r_md = {}
+        if md.get('dtype_policy'):
+            # saves the client a round trip before its first step
+            r_md['dtype_policy'] = self.dtype_policy(md, None)[0]['policy']
+        return r_md, A
 
     def step(self, md, A):
         '''
@@ -262,14 +693,37 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
         '''
         assert(A is not None)
         actions = A
-        r = self._rec.step(actions)
+        r = self.receiverFor(md).step(actions)
         state, reward, done, info = r
         # self.log.debug(f'step returned unconverted {r}')
-        A = np.asarray(state)
+        pipeline = self.pipelines.get(md.get('env'))
+        if pipeline is not None:
+            raw_reward = reward
+            state, reward = pipeline.step(state, reward, done)
+            if reward != raw_reward:
+                info = dict(info, raw_reward=raw_reward)
+        if self.transition_sinks:
+            self._feedTransition(md.get('env'), actions, state, reward, done)
+        info, info_arrays = split_info(info)
         md = dict(done=done, reward=reward, info=info)
+        if isinstance(state, dict) or info_arrays:
+            A = observation_to_arrays(state)
+            A.update({f'info/{key}': val for key, val in info_arrays.items()})
+        else:
+            A = np.asarray(state)
         # self.log.debug(f'step returned {r}')
         return md, A
 
+    def _feedTransition(self, env, action, state, reward, done):
+        next_observation = _copy_observation(state)
+        observation = self._last_observations.get(env)
+        self._last_observations[env] = next_observation
+        if observation is None:
+            # step without reset seen: no transition to report
+            return
+        for sink in self.transition_sinks:
+            sink.add(observation, action, reward, next_observation, done)
+
     #def close(self, *args, **kwargs):
     #    r = self._env.close(*args, **kwargs)
     #    self.log.debug(f'close returned {r}')
@@ -278,9 +732,57 @@ class EnvironmentProxyForServer(_EnvironmentProxy):
     def __call__(self):
         return self.loop()
 
+def _policy_from_dict(d):
+    from .dtype_policy import DtypePolicy
+
+    if d is None:
+        return None
+    return DtypePolicy.fromDict(d)
+
+
 class EnvironmentProxyForClient(_EnvironmentProxy):
-    def __init__(self, *args, hostname='127.0.0.1', **kwargs):
+    '''
+
+    Args:
+        recorder: a :class:`naus.recording.CommandRecorder`. If given
+                  all commands are recorded
+        window:   maximum number of requests outstanding
+        dtype_policy: a :class:`naus.dtype_policy.DtypePolicy` the
+                  actions are cast to before sending. 'server': the
+                  server's, returned with the first reset (asked for
+                  if stepping before). None: send the actions as
+                  given
+        pipeline: configuration of the preprocessing the server
+                  applies (see :mod:`naus.preprocessing`). Sent with
+                  the first reset of each environment, also if None:
+                  this replaces or clears a pipeline an earlier client
+                  left on the server
+
+    Each request carries an id ('rid'). :meth:`submitCommand` sends a
+    request without waiting for its answer, as long as less than
+    `window` requests are outstanding. Answers are matched by id in
+    the order they arrive. Thus one client can drive several
+    environments of a server (see
+    :class:`EnvironmentProxyForServer` argument `receivers`) without
+    the link idling while a command is executed:
+
+    ::
+
+        env = EnvironmentProxyForClient(None, port=9998, window=4)
+        results = env.stepMany({'env_a': 0, 'env_b': 1})
+    '''
+    def __init__(self, *args, hostname='127.0.0.1', recorder=None, window=1,
+                 dtype_policy='server', pipeline=None, **kwargs):
         self.hostname = hostname
+        self.dtype_policy = dtype_policy
+        self.pipeline = pipeline
+        self._pipeline_sent = set()
+        self.recorder = recorder
+        self.window = int(window)
+        assert(self.window >= 1)
+        self._rids = itertools.count(1)
+        self._pending = collections.OrderedDict()
+        self._arrived = collections.OrderedDict()
         super().__init__(*args, **kwargs)
 
     def _initConnection(self):
@@ -290,21 +792,49 @@ class EnvironmentProxyForClient(_EnvironmentProxy):
         self.log.info(f'{cls_name}: Opening port @ {txt}')
         self.socket.connect(txt)
 
-    def processCommand(self, md, A):
-        cls_name = self.__class__.__name__
-        # self.log.info(f'{cls_name}: sending command with meta data {md}')
+    @property
+    def outstanding(self):
+        '''number of requests sent but not yet answered
+        '''
+        return len(self._pending)
+
+    def submitCommand(self, md, A, env=None):
+        '''send a command without waiting for its answer
+
+        Waits for an answer first if `window` requests are outstanding.
+
+        Args:
+            env: name of the environment of the server to execute it
+
+        Returns:
+            the request id, to be passed to :meth:`collect`
+        '''
+        while len(self._pending) >= self.window:
+            self._receiveAnswer()
+
+        rid = next(self._rids)
+        md['rid'] = rid
+        if env is not None:
+            md['env'] = env
         self.sendData(md, A)
+        self._pending[rid] = (md['cmd'], env)
+        return rid
 
-        # self.log.info(f'{cls_name}: waiting for answer')
+    def _receiveAnswer(self):
         md, A = self.receiveData()
-        # self.log.info(f'{cls_name}: got answer with meta data {md}')
+        rid = md.pop('rid')
+        del self._pending[rid]
+        self._arrived[rid] = (md, A)
+        return rid
 
+    def _checkAnswer(self, md, A):
         try:
             recv_exception = md['exception']
         except KeyError:
             recv_exception = None
 
         if recv_exception:
+            cls_name = self.__class__.__name__
             args = md['args']
             txt = f'{cls_name}: received exception {recv_exception} with args {args}'
             self.log.error(txt)
@@ -312,30 +842,173 @@ class EnvironmentProxyForClient(_EnvironmentProxy):
 
         return md, A
 
+    def collect(self, rid):
+        '''wait for the answer of request rid
+
+        Answers of other requests arriving meanwhile are kept.
+
+        Returns:
+            metadata and array(s) of the answer
+        '''
+        while rid not in self._arrived:
+            if rid not in self._pending:
+                raise KeyError(f'request {rid} unknown or already collected')
+            self._receiveAnswer()
+        md, A = self._arrived.pop(rid)
+        return self._checkAnswer(md, A)
+
+    def processCommand(self, md, A):
+        rid = self.submitCommand(md, A)
+        return self.collect(rid)
+
+    def _resetResult(self, md, A):
+        if 'dtype_policy' in md and self.dtype_policy == 'server':
+            self.dtype_policy = _policy_from_dict(md['dtype_policy'])
+        if isinstance(A, dict):
+            A, _ = arrays_to_observation(A)
+        return A
+
+    @staticmethod
+    def _stepResult(md, A):
+        reward = md['reward']
+        info = md['info']
+        done = md['done']
+        if isinstance(A, dict):
+            state, info_arrays = arrays_to_observation(A)
+            info.update(info_arrays)
+        else:
+            state = A
+        return state, reward, done, info
+
+    def _processMany(self, requests, to_result):
+        '''submit all requests, then collect the answers as they arrive
+        '''
+        by_rid = {}
+        for env, (md, A) in requests.items():
+            # submitting further requests can receive answers too
+            by_rid[self.submitCommand(md, A, env=env)] = env
+
+        results = {}
+        error = None
+        while by_rid:
+            arrived = [rid for rid in self._arrived if rid in by_rid]
+            if not arrived:
+                self._receiveAnswer()
+                continue
+            for rid in arrived:
+                env = by_rid.pop(rid)
+                try:
+                    md, A = self.collect(rid)
+                except Exception as exc:
+                    error = exc
+                else:
+                    results[env] = to_result(md, A)
+        if error is not None:
+            raise error
+        return results
+
+    def stepMany(self, actions):
+        '''step several environments of the server
+
+        Args:
+            actions: dictionary environment name: actions
+
+        Returns:
+            dictionary environment name: (state, reward, done, info)
+        '''
+        requests = collections.OrderedDict(
+            (env, (dict(cmd='step'), self._castActions(action)))
+            for env, action in actions.items()
+        )
+        return self._processMany(requests, self._stepResult)
+
+    def resetMany(self, envs):
+        '''reset several environments of the server
+
+        Returns:
+            dictionary environment name: observation
+        '''
+        requests = collections.OrderedDict(
+            (env, (self._resetRequest(env), None)) for env in envs
+        )
+        return self._processMany(requests,
+                                 self._resetResult)
+
+    @recorded
     def seed(self, num):
         md = dict(cmd='seed')
         A = np.asarray(num)
         md, A = self.processCommand(md, A)
         return A
 
+    @recorded
     def reset(self):
-        md = dict(cmd='reset')
+        md = self._resetRequest()
         md, A = self.processCommand(md, None)
-        return A
+        return self._resetResult(md, A)
+
+    def dtypePolicy(self, env=None):
+        '''the dtype policy of the server's environment
+
+        Returns:
+            a :class:`naus.dtype_policy.DtypePolicy` or None
+        '''
+        md = dict(cmd='dtype_policy')
+        rid = self.submitCommand(md, None, env=env)
+        md, _ = self.collect(rid)
+        return _policy_from_dict(md['policy'])
 
+    def configurePipeline(self, pipeline, env=None):
+        '''select the preprocessing of the server's environment
+
+        Returns:
+            the configuration applied by the server
+        '''
+        md = dict(cmd='configure_pipeline', pipeline=pipeline)
+        rid = self.submitCommand(md, None, env=env)
+        md, _ = self.collect(rid)
+        self._pipeline_sent.add(env)
+        return md['pipeline']
+
+    def _resetRequest(self, env=None):
+        md = dict(cmd='reset')
+        if self.dtype_policy == 'server':
+            md['dtype_policy'] = True
+        if env not in self._pipeline_sent:
+            # the server keeps the pipeline of an earlier client
+            md['pipeline'] = self.pipeline
+            self._pipeline_sent.add(env)
+        return md
+
+    def _castActions(self, actions):
+        policy = self.dtype_policy
+        if policy == 'server':
+            policy = self.dtype_policy = self.dtypePolicy()
+        if policy is None:
+            return actions
+        return policy.castAction(actions)
+
+    @recorded
     def step(self, actions):
         md = dict(cmd='step')
+        actions = self._castActions(actions)
         md, A = self.processCommand(md, actions)
-        state = A
-        reward = md['reward']
-        info = md['info']
-        done = md['done']
-        return state, reward, done, info
+        return self._stepResult(md, A)
 
+    @recorded
     def set_mode(self, val):
         md = dict(cmd='set_mode', set_mode=val)
         md, _ = self.processCommand(md, None)
 
+    def instrument(self, name, action):
+        '''execute action of the environment's instrument name
+
+        E.g. `instrument('profiler', 'start')`
+        '''
+        md = dict(cmd='instrument', instrument=name, action=action)
+        md, _ = self.processCommand(md, None)
+        return md['result']
+
     #@set_mode.setter
     #def set_mode(self, val):
     #    md = dict(cmd = 'set_mode_put', set_mode=val)
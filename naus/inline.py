@@ -0,0 +1,88 @@
+'''Execute the agent within the RunEngine
+
+:func:`naus.threaded_environment.run_environment` evaluates the agent
+in a second thread: each step crosses the bridge between this thread
+and the RunEngine and both compete for the GIL. If the training loop
+is under our control it can instead be written as plan: a generator
+function getting the environment, which uses the plan methods of
+:class:`naus.environment.Environment` (:meth:`planSetup`,
+:meth:`planReset`, :meth:`planStep`, :meth:`planClose`) instead of
+setup, reset, step and close:
+
+::
+
+    def agent(env):
+        yield from env.planSetup()
+        for episode in range(n_episodes):
+            observation = (yield from env.planReset())
+            done = False
+            while not done:
+                action = policy(observation)
+                observation, reward, done, info = \\
+                    (yield from env.planStep(action))
+
+    RE(run_agent(env, agent))
+
+The environment is the same in both modes. No bridge is needed: the
+plans of the environment are executed in the RunEngine thread directly.
+'''
+from bluesky import preprocessors as bpp
+from .threaded_environment import environment_metadata
+import logging
+
+logger = logging.getLogger('naus')
+
+
+def run_agent(env, agent, md=None, log=None, profiler=None):
+    '''Plan executing an agent written as plan
+
+    Args:
+        env :      an instance of a subclass of
+                   :class:`naus.environment.Environment`
+        agent :    generator function called with env. It drives the
+                   environment by its plan methods
+        profiler : a :class:`naus.profiler.StackSampler`. If given it
+                   samples the RunEngine thread. It is added to the
+                   instruments of the environment.
+
+    Returns:
+        what agent returns
+    '''
+    if log is None:
+        log = logger
+
+    _md = environment_metadata(env)
+    _md['plan_name'] = 'run_agent'
+    _md['executor_type'] = 'inline'
+    _md['plan_args']['agent'] = repr(agent)
+    _md.update(md or {})
+
+    objects_all = (list(env.detectors) + list(env.motors)
+                   + list(env.state_motors))
+
+    @bpp.stage_decorator(objects_all)
+    @bpp.run_decorator(md=_md)
+    def run_inner():
+        watchdog = env.watchdog
+        try:
+            if watchdog is not None:
+                watchdog.watchThread()
+                watchdog.start()
+            if profiler is not None:
+                env.addInstrument(profiler)
+                profiler.addThread(name='RunEngine')
+                profiler.start()
+            log.info(f'run_agent: executing agent {agent}')
+            r = (yield from agent(env))
+        except Exception:
+            log.error(f'run_agent: Failed to execute agent on {env}')
+            raise
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                profiler.flush()
+            if watchdog is not None:
+                watchdog.stop()
+        return r
+
+    return (yield from run_inner())
@@ -0,0 +1,228 @@
+'''Load test of environment servers with synthetic agents
+
+Each synthetic agent runs in a process of its own and drives one
+:class:`naus.environment_proxy_zmq.EnvironmentProxyForClient` with a
+random mix of `reset`, `step` and `set_mode` commands. The zmq proxy
+uses PAIR sockets, thus every agent needs a server (port) of its own.
+
+Per report interval every agent sends the number of commands,
+latencies and errors to the controlling process, which computes
+throughput and latency percentiles over time.
+
+:func:`ramp_up` increases the number of agents until the throughput
+does not increase any more: the saturation point of the server.
+
+See `examples/rl/cart_pole/cart_pole_load_test.py` for running it
+against a simulated cart pole server.
+'''
+from .environment_proxy_zmq import EnvironmentProxyForClient
+import multiprocessing
+import collections
+import logging
+import random
+import time
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+#: default mix of commands: relative weights
+default_mix = {'step': 0.95, 'reset': 0.04, 'set_mode': 0.01}
+
+Report = collections.namedtuple(
+    'Report', ['agent', 't_start', 't_end', 'latencies', 'errors']
+)
+Report.__doc__ = '''What an agent measured in one report interval
+
+latencies: dictionary command: list of latencies in seconds
+errors: dictionary command: number of failed commands
+'''
+
+
+def synthetic_agent(agent, port, hostname, mix, duration, report_interval,
+                    n_actions, seed, queue):
+    '''issue random commands for duration seconds
+
+    Executed in a process of its own
+    '''
+    rng = random.Random(seed)
+    commands = list(mix)
+    weights = [mix[cmd] for cmd in commands]
+
+    try:
+        env = EnvironmentProxyForClient(receiver=None, port=port,
+                                        hostname=hostname)
+        env.seed(seed)
+        env.reset()
+        done = False
+
+        start = time.monotonic()
+        end = start + duration
+        t_report = start
+        latencies = collections.defaultdict(list)
+        errors = collections.Counter()
+
+        while True:
+            now = time.monotonic()
+            if now >= t_report + report_interval or now >= end:
+                queue.put(Report(agent, t_report, now, dict(latencies),
+                                 dict(errors)))
+                latencies = collections.defaultdict(list)
+                errors = collections.Counter()
+                t_report = now
+            if now >= end:
+                break
+
+            cmd = rng.choices(commands, weights)[0]
+            if done:
+                cmd = 'reset'
+
+            t0 = time.perf_counter()
+            try:
+                if cmd == 'step':
+                    r = env.step(rng.randrange(n_actions))
+                    done = bool(r[2])
+                elif cmd == 'reset':
+                    env.reset()
+                    done = False
+                elif cmd == 'set_mode':
+                    env.set_mode(rng.choice(['fit', 'test']))
+                else:
+                    raise ValueError(f'unknown command {cmd}')
+            except Exception:
+                errors[cmd] += 1
+            else:
+                latencies[cmd].append(time.perf_counter() - t0)
+    finally:
+        # the controller counts the agents finished
+        queue.put(None)
+
+
+def summarise(reports, report_interval):
+    '''throughput and latency percentiles per report interval
+
+    Returns:
+        list of dictionaries, one per interval. Intervals are aligned
+        on the first report (the monotonic clock is shared by the
+        processes)
+    '''
+    t_start = min(r.t_start for r in reports)
+    by_interval = collections.defaultdict(list)
+    for report in reports:
+        index = int((report.t_start - t_start) / report_interval + 0.5)
+        by_interval[index].append(report)
+
+    rows = []
+    for index in sorted(by_interval):
+        t_rel = index * report_interval
+        interval = by_interval[index]
+        dt = max(r.t_end - r.t_start for r in interval)
+        lat = [l for r in interval for ls in r.latencies.values() for l in ls]
+        n_errors = sum(n for r in interval for n in r.errors.values())
+        row = dict(t=t_rel, agents=len(interval), commands=len(lat),
+                   errors=n_errors,
+                   throughput=len(lat) / dt if dt > 0 else 0.0,
+                   error_rate=n_errors / max(len(lat) + n_errors, 1))
+        if lat:
+            p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+            row.update(p50=p50, p90=p90, p99=p99, max=max(lat))
+        rows.append(row)
+    return rows
+
+
+def total(reports):
+    '''summary over all reports
+    '''
+    lat = [l for r in reports for ls in r.latencies.values() for l in ls]
+    n_errors = sum(n for r in reports for n in r.errors.values())
+    t_start = min(r.t_start for r in reports)
+    t_end = max(r.t_end for r in reports)
+    d = dict(commands=len(lat), errors=n_errors,
+             throughput=len(lat) / (t_end - t_start),
+             error_rate=n_errors / max(len(lat) + n_errors, 1))
+    if lat:
+        d.update(zip(['p50', 'p90', 'p99'], np.percentile(lat, [50, 90, 99])))
+    return d
+
+
+def run_load_test(ports, *, hostname='127.0.0.1', mix=default_mix,
+                  duration=10.0, report_interval=1.0, n_actions=2, seed=1974,
+                  log=None):
+    '''run one agent per port for duration seconds
+
+    Returns:
+        list of :class:`Report`
+    '''
+    if log is None:
+        log = logger
+
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    procs = []
+    reports = []
+    try:
+        for agent, port in enumerate(ports):
+            args = (agent, port, hostname, mix, duration, report_interval,
+                    n_actions, seed + agent, queue)
+            proc = ctx.Process(target=synthetic_agent, args=args,
+                               name=f'naus synthetic agent {agent}')
+            proc.start()
+            procs.append(proc)
+
+        n_running = len(procs)
+        while n_running:
+            report = queue.get(timeout=duration + 60)
+            if report is None:
+                n_running -= 1
+            else:
+                reports.append(report)
+    finally:
+        # agents left running e.g. if the controller gave up waiting
+        for proc in procs:
+            if proc.is_alive():
+                proc.join(timeout=1.0)
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+
+    log.info(f'Load test with {len(procs)} agents finished:'
+             f' {len(reports)} reports')
+    return reports
+
+
+def ramp_up(ports, *, start=1, factor=2, min_gain=0.1, log=None, **kwargs):
+    '''increase the number of agents until the throughput saturates
+
+    Args:
+        ports:    ports of the servers. Limits the number of agents
+        start:    number of agents of the first level
+        factor:   agents are multiplied by factor for the next level
+        min_gain: relative throughput gain below which the server is
+                  considered saturated
+
+    Further keyword arguments are passed to :func:`run_load_test`.
+
+    Returns:
+        (levels, saturation) : a list of (number of agents, summary)
+        and the number of agents at which the throughput saturated
+        (None if not reached)
+    '''
+    if log is None:
+        log = logger
+
+    ports = list(ports)
+    levels = []
+    n_agents = start
+    saturation = None
+    while n_agents <= len(ports):
+        reports = run_load_test(ports[:n_agents], log=log, **kwargs)
+        summary = total(reports)
+        log.info(f'{n_agents} agents: {summary}')
+        if levels:
+            previous = levels[-1][1]['throughput']
+            if summary['throughput'] < previous * (1 + min_gain):
+                saturation = levels[-1][0]
+                levels.append((n_agents, summary))
+                break
+        levels.append((n_agents, summary))
+        n_agents = max(n_agents + 1, int(n_agents * factor))
+    return levels, saturation
@@ -0,0 +1,247 @@
+'''Track memory growth of long running environment servers
+
+:class:`MemoryTracker` takes :mod:`tracemalloc` snapshots every given
+number of steps or episodes (or when requested by a client), compares
+each to the previous and the first one by allocation site and reports
+the sites growing most. Optionally the number of objects per type
+tracked by the garbage collector is compared too. Reports are logged
+and, if a directory is given, appended as json lines to a file.
+
+Cost: tracing allocations slows down allocation heavy code while
+active (least with `n_frames=1`, the default). Taking and comparing a
+snapshot takes milliseconds to seconds depending on the number of
+allocations alive, thus take snapshots rarely (e.g. every few
+thousand steps). Counting objects per type walks all objects tracked
+by the garbage collector: enable it only when hunting a leak.
+
+Typical usage:
+
+::
+
+    from naus.memory import MemoryTracker
+
+    tracker = MemoryTracker(directory='memory', every_steps=10000)
+    env = UserEnv(..., instruments=[tracker])
+    tracker.start()
+
+    # on the client
+    env.instrument('memory', 'snapshot')
+'''
+import collections
+import tracemalloc
+import logging
+import json
+import time
+import gc
+import os
+
+logger = logging.getLogger('naus')
+
+#: allocations of these files are not reported (including the tracker)
+default_excludes = ('<frozen importlib._bootstrap>',
+                    '<frozen importlib._bootstrap_external>',
+                    '<unknown>', tracemalloc.__file__, __file__)
+
+
+def count_objects():
+    '''number of objects per type tracked by the garbage collector
+    '''
+    counts = collections.Counter()
+    for obj in gc.get_objects():
+        counts[type(obj).__qualname__] += 1
+    return counts
+
+
+def _stat_to_dict(stat):
+    frame = stat.traceback[0]
+    d = dict(site=f'{frame.filename}:{frame.lineno}',
+             size=stat.size, size_diff=stat.size_diff,
+             count=stat.count, count_diff=stat.count_diff)
+    if len(stat.traceback) > 1:
+        d['traceback'] = [f'{f.filename}:{f.lineno}' for f in stat.traceback]
+    return d
+
+
+class MemoryTracker:
+    '''Compare tracemalloc snapshots taken during a run
+
+    Args:
+        directory:      where to write the reports to (json lines).
+                        None: log only
+        prefix:         prefix of the file name
+        every_steps:    take a snapshot every that many steps
+        every_episodes: take a snapshot every that many episodes
+        n_frames:       frames stored per allocation. More frames tell
+                        who called, but cost more
+        top:            number of allocation sites (and types) reported
+        count_objects:  report the number of objects per type too
+        excludes:       file names whose allocations are ignored
+    '''
+    #: name used to find the instrument of an environment
+    name = 'memory'
+    #: methods a client can call through the server proxy
+    remote_actions = ('start', 'stop', 'snapshot', 'status')
+
+    def __init__(self, directory=None, *, prefix='naus-memory',
+                 every_steps=None, every_episodes=None, n_frames=1, top=10,
+                 count_objects=False, excludes=default_excludes, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+
+        self.directory = directory
+        self.prefix = prefix
+        self.every_steps = every_steps
+        self.every_episodes = every_episodes
+        self.n_frames = int(n_frames)
+        self.top = int(top)
+        self.count_objects = count_objects
+        self._filters = [tracemalloc.Filter(False, name) for name in excludes]
+
+        self._started_tracing = False
+        self._first = None
+        self._previous = None
+        self._first_counts = None
+        self._previous_counts = None
+
+        self._n_steps = 0
+        self._n_episodes = 0
+        self.n_snapshots = 0
+        self.time_snapshots = 0.0
+
+    @property
+    def filename(self):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, f'{self.prefix}-{os.getpid()}.jsonl')
+
+    @property
+    def running(self):
+        return tracemalloc.is_tracing() and self._first is not None
+
+    def start(self):
+        '''start tracing and take the reference snapshot
+        '''
+        if self.running:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.n_frames)
+            self._started_tracing = True
+        self._first = self._previous = self._takeSnapshot()
+        if self.count_objects:
+            self._first_counts = self._previous_counts = count_objects()
+        self.log.info(f'Memory tracker started, tracing {self.n_frames} frames')
+
+    def stop(self):
+        '''stop tracing (if started here) and drop the snapshots
+        '''
+        self._first = self._previous = None
+        self._first_counts = self._previous_counts = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _takeSnapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    def _growers(self, snapshot, reference):
+        key = 'traceback' if self.n_frames > 1 else 'lineno'
+        stats = snapshot.compare_to(reference, key)
+        stats = [stat for stat in stats if stat.size_diff > 0]
+        return [_stat_to_dict(stat) for stat in stats[:self.top]]
+
+    def _typeGrowers(self, counts, reference):
+        diff = counts.copy()
+        diff.subtract(reference)
+        return [dict(type=name, count=counts[name], count_diff=n)
+                for name, n in diff.most_common(self.top) if n > 0]
+
+    def snapshot(self):
+        '''take a snapshot and report the growth
+
+        Returns:
+            the report: allocation sites (and types) growing most since
+            the previous snapshot ('interval') and since start
+            ('total')
+        '''
+        if not self.running:
+            self.start()
+
+        start = time.perf_counter()
+        snapshot = self._takeSnapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        report = dict(
+            time=time.time(), steps=self._n_steps, episodes=self._n_episodes,
+            traced_current=current, traced_peak=peak,
+            interval=self._growers(snapshot, self._previous),
+            total=self._growers(snapshot, self._first),
+        )
+        self._previous = snapshot
+
+        if self.count_objects:
+            counts = count_objects()
+            report['types_interval'] = self._typeGrowers(
+                counts, self._previous_counts
+            )
+            report['types_total'] = self._typeGrowers(counts,
+                                                      self._first_counts)
+            self._previous_counts = counts
+
+        dt = time.perf_counter() - start
+        report['duration'] = dt
+        self.n_snapshots += 1
+        self.time_snapshots += dt
+
+        self._write(report)
+        return report
+
+    def _write(self, report):
+        self.log.info(
+            f'Memory: {report["traced_current"] / 2**20:.1f} MiB traced'
+            f' after {report["steps"]} steps, snapshot took'
+            f' {report["duration"]:.3f} s'
+        )
+        for stat in report['total'][:3]:
+            self.log.info(f'Memory: grew {stat["size_diff"]} bytes'
+                          f' ({stat["count_diff"]} blocks) at {stat["site"]}')
+
+        filename = self.filename
+        if filename is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(filename, 'at') as fp:
+            fp.write(json.dumps(report))
+            fp.write('\n')
+
+    def status(self):
+        current, peak = (0, 0)
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+        d = dict(running=self.running, n_snapshots=self.n_snapshots,
+                 time_snapshots=self.time_snapshots, traced_current=current,
+                 traced_peak=peak, filename=self.filename)
+        return d
+
+    # -------------------------------------------------------------------------
+    # Instrument interface called by the environment
+    def onStep(self, env):
+        self._n_steps += 1
+        every = self.every_steps
+        if every and self._n_steps % every == 0 and self.running:
+            self.snapshot()
+
+    def onEpisodeEnd(self, env):
+        self._n_episodes += 1
+        every = self.every_episodes
+        if every and self._n_episodes % every == 0 and self.running:
+            self.snapshot()
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = (
+            f'{cls_name}(directory={self.directory!r},'
+            f' every_steps={self.every_steps},'
+            f' every_episodes={self.every_episodes},'
+            f' n_frames={self.n_frames}, count_objects={self.count_objects})'
+        )
+        return txt
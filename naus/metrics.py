@@ -0,0 +1,400 @@
+'''Metrics of environment servers
+
+Counters, gauges and histograms exported in the prometheus text
+exposition format. No dependency on :mod:`prometheus_client`: only
+what is required for watching an environment server is implemented.
+
+Recording a value is an attribute update on a preallocated child
+(use :meth:`_Metric.labels` once and keep the child), thus it costs
+well below a microsecond. Values are collected only when the metrics
+are exported.
+
+Typical usage:
+
+::
+
+    from naus import metrics
+
+    server = metrics.start_http_server(9100)
+    # now curl http://127.0.0.1:9100/metrics
+'''
+from bisect import bisect_left
+from threading import Thread, Lock
+import collections
+import logging
+import math
+import time
+
+logger = logging.getLogger('naus')
+
+
+def _escape(value):
+    value = str(value)
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    txt = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+    return '{' + txt + '}'
+
+
+class Registry:
+    '''Collection of metrics exported together
+    '''
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'metric {metric.name} already registered')
+            self._metrics[metric.name] = metric
+
+    def unregister(self, metric):
+        with self._lock:
+            del self._metrics[metric.name]
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def exposition(self):
+        '''All metrics in the text exposition format
+        '''
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.exposition())
+        lines.append('')
+        return '\n'.join(lines)
+
+
+#: the registry metrics are registered to by default
+registry = Registry()
+
+
+class _Metric:
+    '''Common part of all metrics
+
+    Args:
+        name:          name of the metric
+        documentation: help text
+        labelnames:    names of the labels. Values are given to
+                       :meth:`labels`
+        registry:      where to register the metric to. None: do not
+                       register
+
+    A metric without labels can be used directly, otherwise use
+    :meth:`labels` to get the child of a label combination.
+    '''
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), *,
+                 registry=registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = collections.OrderedDict()
+        self._lock = Lock()
+
+        if not self.labelnames:
+            self._default = self.labels()
+
+        if registry is not None:
+            registry.register(self)
+
+    def _newChild(self):
+        raise NotImplementedError('implement in derived class')
+
+    def labels(self, *values, **kwargs):
+        '''child for the given label values
+
+        Retrieve it once and keep it for recording
+        '''
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(val) for val in values)
+        if len(values) != len(self.labelnames):
+            txt = (
+                f'{self.name}: expected values for labels {self.labelnames}'
+                f' but got {values}'
+            )
+            raise ValueError(txt)
+
+        try:
+            return self._children[values]
+        except KeyError:
+            pass
+
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._newChild()
+                self._children[values] = child
+        return child
+
+    def remove(self, *values):
+        values = tuple(str(val) for val in values)
+        with self._lock:
+            del self._children[values]
+
+    def _samples(self, child):
+        '''yield suffix, extra labels, value
+        '''
+        yield '', (), child.value
+
+    def exposition(self):
+        lines = [
+            f'# HELP {self.name} {_escape(self.documentation)}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        with self._lock:
+            children = list(self._children.items())
+
+        for values, child in children:
+            labels = tuple(zip(self.labelnames, values))
+            try:
+                samples = list(self._samples(child))
+            except Exception as exc:
+                logger.error(f'metric {self.name}{labels}: collection failed'
+                             f' {exc}')
+                continue
+            for suffix, extra, value in samples:
+                txt = _format_labels(labels + extra)
+                lines.append(f'{self.name}{suffix}{txt} {_format_value(value)}')
+        return lines
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.name!r}, labelnames={self.labelnames})'
+
+
+class _CounterChild:
+    __slots__ = ['value']
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    '''Monotonically increasing value, e.g. number of steps
+    '''
+    kind = 'counter'
+
+    def _newChild(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ['_value', '_function']
+
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    def dec(self, amount=1):
+        self._value -= amount
+
+    def set_function(self, function):
+        '''value is computed by calling function when exported
+        '''
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+
+class Gauge(_Metric):
+    '''Value that can go up and down, e.g. number of clients
+    '''
+    kind = 'gauge'
+
+    def _newChild(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+
+class _StateSetChild:
+    __slots__ = ['state', '_function']
+
+    def __init__(self):
+        self.state = None
+        self._function = None
+
+    def set_function(self, function):
+        '''function returns the current state when exported
+        '''
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self.state
+
+
+class StateSet(_Metric):
+    '''Which of a set of states is active
+
+    Exported as a gauge per state: 1 for the current state, 0 for
+    all others.
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, states, labelnames=(), **kwargs):
+        self.states = tuple(states)
+        super().__init__(name, documentation, labelnames, **kwargs)
+
+    def _newChild(self):
+        return _StateSetChild()
+
+    def _samples(self, child):
+        current = child.value
+        for state in self.states:
+            yield '', ((self.name, state),), float(state == current)
+
+
+class _HistogramChild:
+    __slots__ = ['_upper', '_counts', '_sum']
+
+    def __init__(self, upper):
+        self._upper = upper
+        self._counts = [0] * len(upper)
+        self._sum = 0.0
+
+    def observe(self, value):
+        self._counts[bisect_left(self._upper, value)] += 1
+        self._sum += value
+
+    def time(self):
+        '''context manager observing the time spent in its body
+        '''
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ['_child', '_start']
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+class Histogram(_Metric):
+    '''Distribution of values, typically latencies in seconds
+
+    Args:
+        buckets: upper bounds of the buckets. +Inf is added
+    '''
+    kind = 'histogram'
+
+    #: Default buckets: 10 us to 10 s
+    default_buckets = (
+        1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+        1e-2, 2.5e-2, 5e-2, .1, .25, .5, 1., 2.5, 5., 10.
+    )
+
+    def __init__(self, name, documentation, labelnames=(), *,
+                 buckets=default_buckets, **kwargs):
+        upper = sorted(float(b) for b in buckets)
+        if not upper or upper[-1] != math.inf:
+            upper.append(math.inf)
+        self.buckets = tuple(upper)
+        super().__init__(name, documentation, labelnames, **kwargs)
+
+    def _newChild(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _samples(self, child):
+        counts = list(child._counts)
+        total = 0
+        for upper, count in zip(self.buckets, counts):
+            total += count
+            yield '_bucket', (('le', _format_value(upper)),), total
+        yield '_sum', (), child._sum
+        yield '_count', (), total
+
+
+def start_http_server(port, addr='127.0.0.1', registry=registry):
+    '''serve the metrics over http in a daemon thread
+
+    Args:
+        port:     port to listen on
+        addr:     address to bind to. Defaults to localhost only
+
+    Returns:
+        the http server. Call its `shutdown` method to stop it
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug('metrics http: ' + format % args)
+
+    server = ThreadingHTTPServer((addr, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    thread = Thread(target=server.serve_forever, name='naus metrics',
+                    daemon=True)
+    thread.start()
+    logger.info(f'Serving metrics on http://{addr}:{port}/metrics')
+    return server
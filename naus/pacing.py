@@ -0,0 +1,236 @@
+'''Execute steps at a fixed rate
+
+:class:`PacedStepPlan` wraps a per step plan. Each step is started on
+a grid of a monotonic clock with a fixed period (e.g.
+:attr:`CartPolePhysics.tau`), independent of how fast agent,
+transport and bridge deliver the actions. Late starts are recorded as
+jitter, missed periods as overruns.
+
+Typical usage:
+
+::
+
+    from naus.pacing import PacedStepPlan
+
+    paced = PacedStepPlan(period=0.02)
+    env = UserEnv(..., per_step_plan=paced, instruments=[paced])
+    RE(run_environment(env, partial, cpu_affinity={2}, sched_priority=10))
+
+Adding it as instrument restarts the clock at the end of each episode.
+'''
+from .plans import per_step_plan
+from bisect import bisect_left
+import logging
+import time
+import os
+
+logger = logging.getLogger('naus')
+
+
+class PacingStatistics:
+    '''jitter and overruns of the paced steps
+
+    Jitter is the time a step started after its scheduled time.
+    '''
+    #: upper bounds of the jitter histogram in seconds
+    buckets = (1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2,
+               float('inf'))
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_steps = 0
+        self.n_overruns = 0
+        self.jitter_max = 0.0
+        self.jitter_sum = 0.0
+        self.histogram = [0] * len(self.buckets)
+
+    def record(self, jitter, overrun):
+        self.n_steps += 1
+        self.n_overruns += overrun
+        self.jitter_sum += jitter
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+        self.histogram[bisect_left(self.buckets, jitter)] += 1
+
+    @property
+    def jitter_mean(self):
+        if self.n_steps == 0:
+            return 0.0
+        return self.jitter_sum / self.n_steps
+
+    def asDict(self):
+        d = dict(n_steps=self.n_steps, n_overruns=self.n_overruns,
+                 jitter_mean=self.jitter_mean, jitter_max=self.jitter_max,
+                 histogram=list(zip([str(b) for b in self.buckets],
+                                    self.histogram)))
+        return d
+
+
+class PacedStepPlan:
+    '''per step plan started at a fixed rate
+
+    Args:
+        period:      time between the start of two steps in seconds
+        plan:        the per step plan to execute
+        spin_time:   the last part of the wait is spent busy waiting
+                     instead of sleeping in the RunEngine, for a more
+                     precise start
+        resync_time: a step starting that late is considered the
+                     start of a new sequence, not an overrun
+
+    A step starting more than a period late missed its slot: it is
+    counted as overrun and the grid is restarted from this step.
+    '''
+    #: name used to find the instrument of an environment
+    name = 'pacing'
+    #: methods a client can call through the server proxy
+    remote_actions = ('statistics', 'resetStatistics')
+
+    def __init__(self, period, *, plan=per_step_plan, spin_time=5e-4,
+                 resync_time=1.0):
+        self.period = float(period)
+        assert(self.period > 0)
+        self.plan = plan
+        self.spin_time = float(spin_time)
+        self.resync_time = float(resync_time)
+        self.stats = PacingStatistics()
+        self._next = None
+
+    @property
+    def rate(self):
+        return 1.0 / self.period
+
+    def restart(self):
+        '''the next step starts a new grid
+        '''
+        self._next = None
+
+    def statistics(self):
+        return self.stats.asDict()
+
+    def resetStatistics(self):
+        self.stats.reset()
+
+    def _waitForSlot(self):
+        from bluesky import plan_stubs as bps
+
+        monotonic = time.monotonic
+        scheduled = self._next
+        if scheduled is None:
+            scheduled = monotonic()
+
+        to_sleep = scheduled - monotonic() - self.spin_time
+        if to_sleep > 0:
+            yield from bps.sleep(to_sleep)
+        while monotonic() < scheduled:
+            pass
+
+        start = monotonic()
+        jitter = start - scheduled
+        if self._next is not None and jitter > self.resync_time:
+            # e.g. the agent paused: not a property of the loop
+            self._next = start + self.period
+            return
+        overrun = jitter > self.period
+        self.stats.record(jitter, overrun)
+        if overrun:
+            self._next = start + self.period
+        else:
+            self._next = scheduled + self.period
+
+    def __call__(self, detectors, motors, actions, *args, **kwargs):
+        yield from self._waitForSlot()
+        r = (yield from self.plan(detectors, motors, actions, *args, **kwargs))
+        return r
+
+    # -------------------------------------------------------------------------
+    # Instrument interface called by the environment
+    def onStep(self, env):
+        pass
+
+    def onEpisodeEnd(self, env):
+        self.restart()
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}(period={self.period}, plan={self.plan})'
+
+
+def pin_thread(cpus=None, priority=None, log=None):
+    '''set cpu affinity and real time priority of the calling thread
+
+    Args:
+        cpus:     set of cpu numbers the thread may run on
+        priority: SCHED_FIFO priority (1..99). Typically requires
+                  privileges (CAP_SYS_NICE)
+
+    Only supported on Linux. Failures are logged, not raised. Use
+    :func:`thread_settings` and :func:`restore_thread` to undo it
+    afterwards, e.g. in a thread shared with other tasks.
+
+    Returns:
+        True if all settings were applied
+    '''
+    if log is None:
+        log = logger
+
+    ok = True
+    if cpus is not None:
+        try:
+            # pid 0: the calling thread on Linux
+            os.sched_setaffinity(0, set(cpus))
+        except (AttributeError, OSError) as exc:
+            log.warning(f'Could not set cpu affinity to {cpus}: {exc}')
+            ok = False
+        else:
+            log.info(f'Thread pinned to cpus {sorted(cpus)}')
+
+    if priority is not None:
+        try:
+            param = os.sched_param(int(priority))
+            os.sched_setscheduler(0, os.SCHED_FIFO, param)
+        except (AttributeError, OSError) as exc:
+            log.warning(f'Could not set SCHED_FIFO priority {priority}: {exc}')
+            ok = False
+        else:
+            log.info(f'Thread scheduled SCHED_FIFO priority {priority}')
+    return ok
+
+
+def thread_settings():
+    '''cpu affinity and scheduling of the calling thread
+
+    Returns:
+        (cpus, policy, priority), None for what is not supported
+    '''
+    try:
+        cpus = os.sched_getaffinity(0)
+    except (AttributeError, OSError):
+        cpus = None
+    try:
+        policy = os.sched_getscheduler(0)
+        priority = os.sched_getparam(0).sched_priority
+    except (AttributeError, OSError):
+        policy = priority = None
+    return cpus, policy, priority
+
+
+def restore_thread(settings, log=None):
+    '''reapply settings returned by :func:`thread_settings`
+    '''
+    if log is None:
+        log = logger
+
+    cpus, policy, priority = settings
+    if cpus is not None:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as exc:
+            log.warning(f'Could not restore cpu affinity {cpus}: {exc}')
+    if policy is not None:
+        try:
+            os.sched_setscheduler(0, policy, os.sched_param(priority))
+        except OSError as exc:
+            log.warning(f'Could not restore scheduling policy {policy}: {exc}')
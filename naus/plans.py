@@ -0,0 +1,207 @@
+'''Plans executed by :class:`naus.environment.Environment`
+
+bluesky is imported when a plan is executed, so that the environment
+can be imported without it.
+
+Fused steps
+-----------
+
+:func:`per_step_plan` moves the motors and triggers and reads the
+detectors: set, wait, trigger, wait, create, read, save messages per
+step and a status object each. Devices that apply a set point
+immediately and have their readback ready afterwards (simulated
+devices, hardware with an atomic "apply and read back" command) can
+declare it by the class attribute
+
+::
+
+    naus_fused_step = True
+
+Their `set` must return a finished status and their `read` must
+return the state after the set without a trigger.
+:func:`fused_per_step_plan` then only sends set, create, read and save
+messages. If any motor or detector does not declare it,
+:func:`per_step_plan` is used.
+
+Restoring state
+---------------
+
+Devices implementing `snapshot()` and `restore(snapshot)` (see
+:func:`supports_restore`) can be reset without a plan: the
+environment restores the state motors directly and emits the reading
+of the detectors with the next plan (:func:`emit_reading_first`).
+'''
+import logging
+logger = logging.getLogger('naus')
+
+
+def supports_fused_step(obj):
+    '''True if obj declares the fused step protocol
+    '''
+    return getattr(obj, 'naus_fused_step', False) is True
+
+
+def per_step_plan(detectors, motors, actions, *args, log=None, **kwargs):
+    '''execute one step and return detecors readings
+
+    Applies the actions to the motors and reads the detectors.
+
+    Args:
+        detectors: detectors to read from
+        motors:    motors to apply the actions to
+        actions:   keras-rl requested actions
+
+    Returns:
+        the detector readings.
+    '''
+    from bluesky import plan_stubs as bps
+
+    if log is None:
+        log = logger
+
+    motors = list(motors)
+    action = list(actions)
+
+    # There should be a func
+    ml = []
+    for m, a in zip(motors, action):
+        ml.extend([m, a])
+    args = tuple(ml)
+
+    log.debug(f'Executing move (bps.mv) {args}')
+    yield from bps.mv(*args)
+
+    r = (yield from bps.trigger_and_read(detectors))
+    log.debug(f'Read {detectors} to {r}')
+
+    return r
+
+
+def supports_restore(obj):
+    '''True if obj implements the snapshot / restore protocol
+
+    `snapshot()` returns the state of the object, `restore(snapshot)`
+    applies it immediately, without a plan. Motors of a simulated
+    device restore a single value.
+    '''
+    return (callable(getattr(obj, 'snapshot', None))
+            and callable(getattr(obj, 'restore', None)))
+
+
+def emit_reading_first(detectors, plan, *args, **kwargs):
+    '''read the detectors into the primary stream, then execute plan
+
+    Used for the reading of a reset done without a plan: the detectors
+    still hold the restored state as no plan ran in between.
+    '''
+    from bluesky import Msg
+
+    yield Msg('create', name='primary')
+    try:
+        for det in detectors:
+            yield Msg('read', det)
+    except Exception:
+        yield Msg('drop')
+        raise
+    yield Msg('save')
+    r = (yield from plan(*args, **kwargs))
+    return r
+
+
+def fused_per_step_plan(detectors, motors, actions, *args, log=None,
+                        **kwargs):
+    '''per step plan sending the least messages the devices allow
+
+    Same arguments and result as :func:`per_step_plan`, which is used
+    if not all devices support the fused step protocol (see
+    :func:`supports_fused_step`).
+    '''
+    from bluesky import Msg
+
+    motors = list(motors)
+    detectors = list(detectors)
+    for obj in motors + detectors:
+        if not supports_fused_step(obj):
+            r = (yield from per_step_plan(detectors, motors, actions, *args,
+                                          log=log, **kwargs))
+            return r
+
+    for m, a in zip(motors, list(actions)):
+        yield Msg('set', m, a, group='naus_fused_step')
+    # the statuses are done already, but the RunEngine keeps their
+    # futures (with or without group) until a wait collects them
+    yield Msg('wait', None, group='naus_fused_step')
+
+    # messages yielded directly: the plan stubs cost more than the
+    # messages, the more the deeper the caller is nested
+    yield Msg('create', name='primary')
+    r = {}
+    try:
+        for det in detectors:
+            reading = (yield Msg('read', det))
+            if reading is not None:
+                r.update(reading)
+    except Exception:
+        yield Msg('drop')
+        raise
+    yield Msg('save')
+    return r
+
+
+def setup_plan(detectors, motors, *args, log=None, **kwargs):
+    '''retrieve the actual status
+
+    Reads the detectors and returns the state
+
+    Args:
+        detectors: detectors to read from
+
+    Motors are passed for convenience for a user that intends to
+    implement his own plan.
+    '''
+    from bluesky import plan_stubs as bps
+
+    if log is None:
+        log = logger
+
+    yield from bps.checkpoint()
+    log.info(f'Reading detectors {detectors}')
+    r = (yield from bps.trigger_and_read(detectors))
+    log.info(f'setup returned {r}')
+    return r
+
+
+def reset_plan(detectors, state_motors, saved_state, *args, log=None,
+               **kwargs):
+    '''plan to revert environment to original state
+
+    Uses :func:`per_step_plan`. Passes the `state_motors`
+    as motors and the `saved_state` as actions.
+    '''
+    if log is None:
+        log = logger
+
+    log.info(
+        f'Executing reset plan on {state_motors} and saved_state {saved_state}'
+    )
+    r = (yield from per_step_plan(detectors, state_motors, saved_state))
+    log.info(f'Reset plan read {r}')
+    return r
+
+
+def teardown_plan(detectors, motors, actions, state_motors, state_actions,
+                  *args, log=None, **kwargs):
+    '''Typically: nothing to do
+
+    Args:
+        detectors: the detectors registered to the environment
+
+    Todo:
+        Consider resetting to original state
+    '''
+    from bluesky import plan_stubs as bps
+
+    if log is None:
+        log = logger
+    # a plan nevertheless: the environment executes it by yield from
+    yield from bps.null()
@@ -0,0 +1,223 @@
+'''Preprocessing of observations and rewards on the server
+
+Agents typically stack the last observations, normalise them with a
+running mean and variance and scale or clip the rewards. Done on the
+server, right after the environment computed the state, every client
+gets the processed data without repeating the work.
+
+A :class:`Pipeline` is built from a configuration (a list of
+dictionaries), thus the client can select it when it connects:
+
+::
+
+    env = EnvironmentProxyForClient(None, pipeline=[
+        dict(kind='normalize', clip=5.0),
+        dict(kind='frame_stack', k=4),
+        dict(kind='reward_scale', scale=0.1, clip=1.0),
+    ])
+
+Each stage implements `reset(observation)` returning the observation
+and `step(observation, reward, done)` returning observation and
+reward.
+'''
+import logging
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+
+class FrameStack:
+    '''stack the last k observations
+
+    The observations are kept in a ring buffer of twice the length,
+    each written twice, thus the last k are always a contiguous view.
+
+    Warning:
+        The array returned is a view on the buffer, valid until the
+        next step
+    '''
+    kind = 'frame_stack'
+
+    def __init__(self, k=4):
+        self.k = int(k)
+        assert(self.k >= 1)
+        self._buffer = None
+        self._pos = 0
+
+    def reset(self, observation):
+        observation = np.asarray(observation)
+        k = self.k
+        buf = self._buffer
+        if buf is None or buf.shape[1:] != observation.shape \
+           or buf.dtype != observation.dtype:
+            buf = self._buffer = np.empty((2 * k,) + observation.shape,
+                                          dtype=observation.dtype)
+        buf[:] = observation
+        self._pos = 0
+        return buf[1:k + 1]
+
+    def step(self, observation, reward, done):
+        k = self.k
+        buf = self._buffer
+        pos = self._pos
+        buf[pos] = observation
+        buf[pos + k] = observation
+        pos += 1
+        if pos == k:
+            pos = 0
+        self._pos = pos
+        return buf[pos:pos + k], reward
+
+    def config(self):
+        return dict(kind=self.kind, k=self.k)
+
+
+class RunningNormalizer:
+    '''normalise observations by their running mean and variance
+
+    The statistics are updated with Welford's algorithm, component
+    wise.
+
+    Args:
+        clip:    normalised values are clipped to [-clip, clip]
+        epsilon: added to the variance
+        update:  False: use the statistics without updating them
+                 (e.g. for testing)
+    '''
+    kind = 'normalize'
+
+    def __init__(self, clip=5.0, epsilon=1e-8, update=True):
+        self.clip = clip
+        self.epsilon = float(epsilon)
+        self.update = update
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+    @property
+    def var(self):
+        if self.count < 2:
+            return np.ones_like(self.mean)
+        return self._m2 / (self.count - 1)
+
+    def _observe(self, observation):
+        x = np.asarray(observation, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros_like(x)
+            self._m2 = np.zeros_like(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+
+    def _normalize(self, observation):
+        observation = np.asarray(observation)
+        if self.update:
+            self._observe(observation)
+        r = (observation - self.mean) / np.sqrt(self.var + self.epsilon)
+        if self.clip is not None:
+            np.clip(r, -self.clip, self.clip, out=r)
+        # keep the type chosen by the environment's dtype policy
+        if observation.dtype.kind == 'f':
+            r = r.astype(observation.dtype, copy=False)
+        return r
+
+    def reset(self, observation):
+        return self._normalize(observation)
+
+    def step(self, observation, reward, done):
+        return self._normalize(observation), reward
+
+    def config(self):
+        return dict(kind=self.kind, clip=self.clip, epsilon=self.epsilon,
+                    update=self.update)
+
+
+class RewardScaler:
+    '''scale and clip rewards
+
+    Args:
+        scale:     factor applied to the reward
+        clip:      scaled rewards are clipped to [-clip, clip]
+        normalize: divide by the running standard deviation of the
+                   discounted return (with discount gamma)
+    '''
+    kind = 'reward_scale'
+
+    def __init__(self, scale=1.0, clip=None, normalize=False, gamma=0.99,
+                 epsilon=1e-8):
+        self.scale = float(scale)
+        self.clip = clip
+        self.normalize = normalize
+        self.gamma = float(gamma)
+        self.epsilon = float(epsilon)
+        self._ret = 0.0
+        self._returns = RunningNormalizer(clip=None)
+
+    def reset(self, observation):
+        self._ret = 0.0
+        return observation
+
+    def step(self, observation, reward, done):
+        reward = float(reward) * self.scale
+        if self.normalize:
+            self._ret = self._ret * self.gamma + reward
+            self._returns._observe(self._ret)
+            reward = reward / float(np.sqrt(self._returns.var + self.epsilon))
+            if done:
+                self._ret = 0.0
+        if self.clip is not None:
+            reward = min(max(reward, -self.clip), self.clip)
+        return observation, reward
+
+    def config(self):
+        return dict(kind=self.kind, scale=self.scale, clip=self.clip,
+                    normalize=self.normalize, gamma=self.gamma)
+
+
+#: stages a pipeline can be configured with, by kind
+stages = {cls.kind: cls for cls in (FrameStack, RunningNormalizer,
+                                    RewardScaler)}
+
+
+class Pipeline:
+    '''stages applied in order to observations and rewards
+    '''
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+
+    @classmethod
+    def fromConfig(cls, config):
+        '''
+        Args:
+            config: list of dictionaries with the kind of the stage
+                    (see :data:`stages`) and its arguments
+        '''
+        pipeline = []
+        for stage in config:
+            stage = dict(stage)
+            kind = stage.pop('kind')
+            try:
+                stage_cls = stages[kind]
+            except KeyError:
+                txt = f'unknown stage {kind}, known are {list(stages)}'
+                raise ValueError(txt)
+            pipeline.append(stage_cls(**stage))
+        return cls(pipeline)
+
+    def config(self):
+        return [stage.config() for stage in self.stages]
+
+    def reset(self, observation):
+        for stage in self.stages:
+            observation = stage.reset(observation)
+        return observation
+
+    def step(self, observation, reward, done):
+        for stage in self.stages:
+            observation, reward = stage.step(observation, reward, done)
+        return observation, reward
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.config()})'
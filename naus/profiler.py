@@ -0,0 +1,238 @@
+'''Sampling profiler for the threads executing an environment
+
+The stacks of selected threads (typically the RunEngine thread and the
+'run optimiser' thread started by
+:func:`naus.threaded_environment.run_environment`) are sampled at a
+fixed interval. Samples are aggregated as collapsed stacks and written
+per episode or per number of steps, ready for flamegraph.pl or
+speedscope.
+
+Typical usage:
+
+::
+
+    from naus.profiler import StackSampler
+
+    profiler = StackSampler(directory='profiles', every_steps=1000)
+    RE(run_environment(env, partial, profiler=profiler))
+
+The profiler is an instrument of the environment (see
+:meth:`naus.environment.Environment.addInstrument`): it can be started
+and stopped by the client using the 'instrument' command of the zmq
+proxy.
+'''
+from threading import Thread, Event, Lock
+import collections
+import threading
+import logging
+import time
+import sys
+import os
+
+logger = logging.getLogger('naus')
+
+
+class StackSampler:
+    '''Sample stacks of threads and write them as collapsed stacks
+
+    Args:
+        directory:    where to write the collapsed stack files to
+        prefix:       prefix of the file names
+        interval:     time between two samples in seconds
+        max_overhead: fraction of time the sampler may spend sampling.
+                      The interval follows the average cost of a
+                      sample: it grows if sampling is expensive and
+                      returns to the given one when it is cheap again
+        max_depth:    frames deeper in the stack are dropped
+        every_steps:  write the samples every that many steps.
+                      None: do not write based on the number of steps
+        per_episode:  write the samples at the end of each episode
+        thread_names: threads to sample identified by name. Threads
+                      can be added by :meth:`addThread`
+    '''
+    #: name used to find the instrument of an environment
+    name = 'profiler'
+    #: methods a client can call through the server proxy
+    remote_actions = ('start', 'stop', 'flush', 'status')
+
+    def __init__(self, directory='.', *, prefix='naus-profile', interval=0.01,
+                 max_overhead=0.02, max_depth=64, every_steps=None,
+                 per_episode=True, thread_names=('run optimiser',), log=None):
+        if log is None:
+            log = logger
+        self.log = log
+
+        self.directory = directory
+        self.prefix = prefix
+        self.min_interval = float(interval)
+        self.interval = self.min_interval
+        self.max_overhead = float(max_overhead)
+        self.max_depth = int(max_depth)
+        self.every_steps = every_steps
+        self.per_episode = per_episode
+        self.thread_names = set(thread_names)
+
+        self._idents = {}
+        self._counts = collections.Counter()
+        self._frame_names = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+        self._n_steps = 0
+        self._n_files = 0
+        self.n_samples = 0
+        self.time_sampling = 0.0
+        # exponential average of the time a sample takes
+        self._cost = 0.0
+
+    def addThread(self, ident=None, name=None):
+        '''add a thread to sample
+
+        Args:
+            ident: thread identifier. Defaults to the calling thread
+            name:  name used in the collapsed stacks
+        '''
+        if ident is None:
+            ident = threading.get_ident()
+        if name is None:
+            name = f'thread-{ident}'
+            for thread in threading.enumerate():
+                if thread.ident == ident:
+                    name = thread.name
+                    break
+        self._idents[ident] = name
+
+    def removeThread(self, ident=None):
+        if ident is None:
+            ident = threading.get_ident()
+        self._idents.pop(ident, None)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='naus profiler',
+                              daemon=True)
+        self._thread.start()
+        self.log.info(f'Profiler started sampling every {self.interval} s')
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.log.info(f'Profiler stopped after {self.n_samples} samples')
+
+    def status(self):
+        '''json compatible summary
+        '''
+        d = dict(running=self.running, interval=self.interval,
+                 n_samples=self.n_samples, time_sampling=self.time_sampling,
+                 threads=sorted(self._idents.values()), n_files=self._n_files)
+        return d
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            self.sample()
+            self._account(time.perf_counter() - start)
+
+    def _account(self, dt):
+        '''adapt the interval to the time dt the last sample took
+        '''
+        self.time_sampling += dt
+        # Keep the overhead bounded on average: a single slow sample
+        # (e.g. a gc pause) only lowers the rate for a while
+        self._cost += 0.1 * (dt - self._cost)
+        self.interval = max(self.min_interval, self._cost / self.max_overhead)
+
+    def _threadsToSample(self):
+        idents = dict(self._idents)
+        if self.thread_names:
+            for thread in threading.enumerate():
+                if thread.name in self.thread_names:
+                    idents.setdefault(thread.ident, thread.name)
+        return idents
+
+    def _frameName(self, code):
+        try:
+            return self._frame_names[code]
+        except KeyError:
+            pass
+        filename = os.path.basename(code.co_filename)
+        name = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+        self._frame_names[code] = name
+        return name
+
+    def sample(self):
+        '''take one sample of all selected threads
+        '''
+        frames = sys._current_frames()
+        stacks = []
+        for ident, thread_name in self._threadsToSample().items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < self.max_depth:
+                names.append(self._frameName(frame.f_code))
+                frame = frame.f_back
+            names.append(thread_name)
+            names.reverse()
+            stacks.append(';'.join(names))
+
+        with self._lock:
+            for stack in stacks:
+                self._counts[stack] += 1
+            self.n_samples += 1
+
+    def flush(self, label=None):
+        '''write the samples collected so far and start afresh
+
+        Returns:
+            the name of the file written or None if there were no
+            samples
+        '''
+        with self._lock:
+            counts = self._counts
+            self._counts = collections.Counter()
+        if not counts:
+            return None
+
+        if label is None:
+            label = f'{self._n_files:05d}'
+        self._n_files += 1
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, f'{self.prefix}-{label}.folded')
+        with open(filename, 'wt') as fp:
+            for stack, count in counts.most_common():
+                fp.write(f'{stack} {count}\n')
+        self.log.info(f'Profiler wrote {len(counts)} stacks to {filename}')
+        return filename
+
+    # -------------------------------------------------------------------------
+    # Instrument interface called by the environment
+    def onStep(self, env):
+        self._n_steps += 1
+        every = self.every_steps
+        if every and self._n_steps % every == 0 and self.running:
+            self.flush()
+
+    def onEpisodeEnd(self, env):
+        if self.per_episode and self.running:
+            self.flush()
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = (
+            f'{cls_name}(directory={self.directory!r}, prefix={self.prefix!r},'
+            f' interval={self.min_interval}, every_steps={self.every_steps},'
+            f' per_episode={self.per_episode})'
+        )
+        return txt
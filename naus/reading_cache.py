@@ -0,0 +1,352 @@
+'''Readings of monitored signals kept in memory
+
+:func:`naus.plans.per_step_plan` triggers and reads all detectors each
+step, even if their signals did not change. Signals publishing their
+updates (e.g. EPICS monitors through ophyd subscriptions) can instead
+be cached: :class:`ReadingCache` subscribes once and keeps the latest
+value and timestamp of each signal in arrays.
+
+:class:`CachedStepPlan` moves the motors, waits only for the signals
+the move is expected to change and then emits the event from the
+cache. Signals older than a maximum age are read actively, thus the
+readings are never staler than this bound.
+
+Typical usage:
+
+::
+
+    from naus.reading_cache import ReadingCache, CachedStepPlan
+
+    cache = ReadingCache.fromDevices(detectors)
+    plan = CachedStepPlan(cache, expect=[bpm.x, bpm.y], max_age=1.0)
+    env = UserEnv(detectors=detectors, ..., per_step_plan=plan,
+                  instruments=[plan])
+    cache.start()
+'''
+from concurrent.futures import Future
+from threading import Lock
+import functools
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+#: data key dtypes stored in the array of values
+_numeric_dtypes = ('number', 'integer', 'boolean')
+
+
+def _leaf_signals(obj):
+    '''the signals read when obj is read
+    '''
+    names = getattr(obj, 'read_attrs', None)
+    if names is None:
+        return [obj]
+    signals = []
+    for name in names:
+        child = getattr(obj, name)
+        # read attrs list devices and their components: keep the leaves
+        if getattr(child, 'read_attrs', None) is None:
+            signals.append(child)
+    return signals
+
+
+class ReadingCache:
+    '''latest value and timestamp of subscribed signals
+
+    Args:
+        signals: ophyd signals (or any object with `name`, `read`,
+                 `describe`, `subscribe` and `unsubscribe`)
+
+    Values of signals described as numeric ('number', 'integer',
+    'boolean') are stored in an array, others (e.g. strings, arrays)
+    in a list. The description is taken when the cache starts.
+    '''
+    def __init__(self, signals, *, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+
+        self.signals = list(signals)
+        self.names = [sig.name for sig in self.signals]
+        self._index = {name: cnt for cnt, name in enumerate(self.names)}
+        n = len(self.signals)
+        self.values = np.full(n, np.nan)
+        self.timestamps = np.zeros(n)
+        self.updates = np.zeros(n, dtype=np.int64)
+        self._objects = [None] * n
+        # storage per signal, from the signals' description
+        self._numeric = None
+
+        self._cids = None
+        self._waiters = []
+        self._lock = Lock()
+
+        self._reading = {name: {'value': None, 'timestamp': 0.0}
+                         for name in self.names}
+        self._entries = [self._reading[name] for name in self.names]
+        self._description = None
+
+    @classmethod
+    def fromDevices(cls, devices, **kwargs):
+        '''cache for the signals read from devices
+        '''
+        signals = []
+        for dev in devices:
+            signals.extend(_leaf_signals(dev))
+        return cls(signals, **kwargs)
+
+    def index(self, signal):
+        name = signal if isinstance(signal, str) else signal.name
+        return self._index[name]
+
+    # -------------------------------------------------------------------------
+    def start(self):
+        '''subscribe to the signals
+
+        The subscription runs the callback once with the current
+        value, thus the cache is filled afterwards.
+        '''
+        if self._cids is not None:
+            return
+        self._classify()
+        self._cids = []
+        for cnt, sig in enumerate(self.signals):
+            cb = functools.partial(self._onUpdate, cnt)
+            self._cids.append(sig.subscribe(cb, run=True))
+        self.log.info(f'Reading cache subscribed to {len(self.signals)} signals')
+
+    def stop(self):
+        if self._cids is None:
+            return
+        for sig, cid in zip(self.signals, self._cids):
+            sig.unsubscribe(cid)
+        self._cids = None
+
+    @property
+    def running(self):
+        return self._cids is not None
+
+    def _onUpdate(self, index, value=None, timestamp=None, **kwargs):
+        self._store(index, value, timestamp)
+
+    def _classify(self):
+        if self._numeric is not None:
+            return
+        description = self.describe()
+        self._numeric = [
+            description.get(name, {}).get('dtype') in _numeric_dtypes
+            for name in self.names
+        ]
+
+    def _store(self, index, value, timestamp):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._numeric[index]:
+                try:
+                    self.values[index] = value
+                except (TypeError, ValueError):
+                    # e.g. None of a disconnected signal
+                    self.values[index] = np.nan
+            else:
+                self._objects[index] = value
+            self.timestamps[index] = timestamp
+            self.updates[index] += 1
+
+            if not self._waiters:
+                return
+            waiters = []
+            for indices, counts, future in self._waiters:
+                if (self.updates[indices] > counts).all():
+                    future.set_result(True)
+                else:
+                    waiters.append((indices, counts, future))
+            self._waiters = waiters
+
+    # -------------------------------------------------------------------------
+    def expectUpdate(self, signals):
+        '''future done when all signals were updated after this call
+
+        Call it before triggering the change, e.g. before the move
+        '''
+        future = Future()
+        indices = np.array([self.index(sig) for sig in signals], dtype=int)
+        if not len(indices):
+            future.set_result(True)
+            return future
+        with self._lock:
+            counts = self.updates[indices].copy()
+            self._waiters.append((indices, counts, future))
+        return future
+
+    def cancel(self, future):
+        with self._lock:
+            self._waiters = [w for w in self._waiters if w[2] is not future]
+
+    def stale(self, max_age, now=None):
+        '''indices of the signals older than max_age seconds
+        '''
+        if now is None:
+            now = time.time()
+        return np.nonzero(now - self.timestamps > max_age)[0]
+
+    def refresh(self, indices=None):
+        '''read signals actively (all if indices is None)
+        '''
+        self._classify()
+        if indices is None:
+            indices = range(len(self.signals))
+        for index in indices:
+            sig = self.signals[index]
+            reading = sig.read()[sig.name]
+            self._store(index, reading['value'], reading['timestamp'])
+
+    # -------------------------------------------------------------------------
+    # Readable interface: lets the RunEngine read the cache as device
+    @property
+    def name(self):
+        return 'naus_reading_cache'
+
+    def read(self):
+        '''the cached readings
+
+        Warning:
+            The dictionary is reused. Its values are only valid until
+            the next call
+        '''
+        self._classify()
+        values = self.values.tolist()
+        timestamps = self.timestamps.tolist()
+        objects = self._objects
+        numeric = self._numeric
+        for cnt, entry in enumerate(self._entries):
+            entry['value'] = values[cnt] if numeric[cnt] else objects[cnt]
+            entry['timestamp'] = timestamps[cnt]
+        return self._reading
+
+    def describe(self):
+        if self._description is None:
+            description = {}
+            for sig in self.signals:
+                description.update(sig.describe())
+            self._description = description
+        return self._description
+
+    def read_configuration(self):
+        return {}
+
+    def describe_configuration(self):
+        return {}
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}(signals={self.names})'
+
+
+class CachedStepPlan:
+    '''per step plan emitting the readings from a :class:`ReadingCache`
+
+    Args:
+        cache:   the reading cache of the detectors' signals
+        expect:  signals the move changes: the plan waits for their
+                 next update
+        max_age: signals older than this (seconds) are read actively.
+                 None: no bound
+        timeout: time to wait for the expected updates. If exceeded
+                 the expected signals are read actively
+
+    The detectors passed to the plan are not read: the cache has to
+    hold all signals the environment needs.
+    '''
+    #: name used to find the instrument of an environment
+    name = 'reading_cache'
+    #: methods a client can call through the server proxy
+    remote_actions = ('statistics',)
+
+    def __init__(self, cache, *, expect=(), max_age=None, timeout=1.0,
+                 log=None):
+        if log is None:
+            log = logger
+        self.log = log
+        self.cache = cache
+        self.expect = list(expect)
+        self._expect_indices = [cache.index(sig) for sig in self.expect]
+        self.max_age = max_age
+        self.timeout = timeout
+
+        self.n_steps = 0
+        self.n_timeouts = 0
+        self.n_refreshed = 0
+
+    def _waitForExpected(self, future):
+        from bluesky import plan_stubs as bps
+        import asyncio
+        try:
+            from bluesky.run_engine import WaitForTimeoutError
+        except ImportError:
+            # older bluesky versions
+            WaitForTimeoutError = asyncio.TimeoutError
+
+        if future.done():
+            return True
+        try:
+            yield from bps.wait_for([lambda: asyncio.wrap_future(future)],
+                                    timeout=self.timeout)
+        except (WaitForTimeoutError, asyncio.TimeoutError) as exc:
+            # newer bluesky versions raise on timeout. Anything else,
+            # e.g. the RunEngine aborting the plan, has to propagate
+            self.log.debug(f'waiting for expected updates: {exc}')
+        if future.done():
+            return True
+        self.cache.cancel(future)
+        return False
+
+    def __call__(self, detectors, motors, actions, *args, log=None, **kwargs):
+        from bluesky import plan_stubs as bps
+
+        cache = self.cache
+        assert(cache.running)
+
+        future = cache.expectUpdate(self.expect)
+        ml = []
+        for m, a in zip(motors, list(actions)):
+            ml.extend([m, a])
+        yield from bps.mv(*ml)
+
+        arrived = (yield from self._waitForExpected(future))
+        if not arrived:
+            self.n_timeouts += 1
+            self.log.warning(f'{self}: expected updates not received within'
+                             f' {self.timeout} s: reading actively')
+            cache.refresh(self._expect_indices)
+
+        if self.max_age is not None:
+            stale = cache.stale(self.max_age)
+            if len(stale):
+                self.n_refreshed += len(stale)
+                cache.refresh(stale)
+
+        self.n_steps += 1
+        r = (yield from bps.trigger_and_read([cache]))
+        return r
+
+    def statistics(self):
+        return dict(n_steps=self.n_steps, n_timeouts=self.n_timeouts,
+                    n_refreshed=self.n_refreshed)
+
+    # -------------------------------------------------------------------------
+    # Instrument interface called by the environment
+    def onStep(self, env):
+        pass
+
+    def onEpisodeEnd(self, env):
+        pass
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = (
+            f'{cls_name}({self.cache!r}, expect={[s.name for s in self.expect]},'
+            f' max_age={self.max_age}, timeout={self.timeout})'
+        )
+        return txt
@@ -0,0 +1,226 @@
+'''Record the commands of a client and replay them
+
+A client proxy given a :class:`CommandRecorder` writes every command
+(`seed`, `setup`, `reset`, `step`, `set_mode`) with its arguments, start
+time and latency as a json line. :func:`replay` pushes the same command
+stream to any client proxy, thus any server or transport, as fast as
+possible or with the original pacing. :func:`compare` reports the
+latency per command against the recording.
+
+Typical usage:
+
+::
+
+    from naus.recording import CommandRecorder, load_recording, replay, compare
+
+    env = EnvironmentProxyForClient(None, recorder=CommandRecorder('run.jsonl'))
+    # ... train
+    env.recorder.close()
+
+    entries = load_recording('run.jsonl')
+    results = replay(entries, EnvironmentProxyForClient(None, port=9999))
+    print(compare(results))
+'''
+import functools
+import logging
+import json
+import time
+import sys
+
+logger = logging.getLogger('naus')
+
+
+def _encode(value):
+    # numpy arrays can only be passed if numpy was imported
+    np = sys.modules.get('numpy')
+    if np is None:
+        pass
+    elif isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(), 'dtype': str(value.dtype),
+                'shape': value.shape}
+    elif isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {key: _encode(val) for key, val in value.items()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and '__ndarray__' in value:
+        import numpy as np
+        A = np.asarray(value['__ndarray__'], dtype=value['dtype'])
+        return A.reshape(value['shape'])
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        return {key: _decode(val) for key, val in value.items()}
+    return value
+
+
+class CommandRecorder:
+    '''write the commands of a client proxy as json lines
+
+    Args:
+        filename: file to write to
+
+    Each entry is flushed when written, thus the recording of a
+    crashed session is complete up to its last command. A command
+    that can not be encoded is logged and skipped: recording never
+    fails the command itself.
+    '''
+    def __init__(self, filename, *, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+        self.filename = filename
+        self._fp = open(filename, 'wt')
+        self._t0 = time.perf_counter()
+
+    def record(self, cmd, args, kwargs, start, latency, error=None):
+        entry = dict(t=start - self._t0, cmd=cmd, args=_encode(list(args)),
+                     latency=latency)
+        if kwargs:
+            entry['kwargs'] = {key: _encode(val) for key, val in kwargs.items()}
+        if error is not None:
+            entry['error'] = error
+        try:
+            line = json.dumps(entry)
+        except (TypeError, ValueError) as exc:
+            self.log.error(f'{self}: can not record {cmd}: {exc}')
+            return
+        self._fp.write(line)
+        self._fp.write('\n')
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.filename!r})'
+
+
+def recorded(method):
+    '''record calls of method if the proxy has a recorder
+
+    The proxy needs an attribute `recorder`: None or a
+    :class:`CommandRecorder`.
+    '''
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        recorder = self.recorder
+        if recorder is None:
+            return method(self, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            r = method(self, *args, **kwargs)
+        except Exception as exc:
+            latency = time.perf_counter() - start
+            error = f'{exc.__class__.__name__}: {exc}'
+            recorder.record(name, args, kwargs, start, latency, error=error)
+            raise
+        recorder.record(name, args, kwargs, start, time.perf_counter() - start)
+        return r
+
+    return wrapper
+
+
+def load_recording(filename):
+    '''read the entries written by :class:`CommandRecorder`
+    '''
+    entries = []
+    with open(filename, 'rt') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            entry['args'] = _decode(entry['args'])
+            entry['kwargs'] = {key: _decode(val)
+                               for key, val in entry.get('kwargs', {}).items()}
+            entries.append(entry)
+    return entries
+
+
+def replay(entries, env, *, pacing='fast', speed=1.0, log=None):
+    '''execute the recorded commands on env
+
+    Args:
+        entries: as returned by :func:`load_recording`
+        env:     client proxy (or environment) to call the commands on
+        pacing:  'fast': as fast as possible. 'original': start each
+                 command at its recorded time (divided by speed)
+
+    Returns:
+        list of (entry, latency, error) with the latency of the replay
+    '''
+    if log is None:
+        log = logger
+    if pacing not in ('fast', 'original'):
+        raise ValueError(f'pacing {pacing} not one of fast, original')
+
+    results = []
+    t0 = time.perf_counter()
+    for entry in entries:
+        if pacing == 'original':
+            to_wait = entry['t'] / speed - (time.perf_counter() - t0)
+            if to_wait > 0:
+                time.sleep(to_wait)
+
+        method = getattr(env, entry['cmd'])
+        error = None
+        start = time.perf_counter()
+        try:
+            method(*entry['args'], **entry['kwargs'])
+        except Exception as exc:
+            error = f'{exc.__class__.__name__}: {exc}'
+            if 'error' not in entry:
+                log.error(f'replay: {entry["cmd"]} failed: {error}')
+        results.append((entry, time.perf_counter() - start, error))
+    return results
+
+
+def compare(results):
+    '''latency of the replay per command compared to the recording
+
+    Returns:
+        dictionary command: statistics. Latencies in seconds, delta
+        is replay minus recording
+    '''
+    import numpy as np
+
+    by_cmd = {}
+    for entry, latency, error in results:
+        by_cmd.setdefault(entry['cmd'], []).append(
+            (entry['latency'], latency, error is not None,
+             'error' in entry)
+        )
+
+    report = {}
+    for cmd, rows in by_cmd.items():
+        recorded_lat = np.array([r[0] for r in rows])
+        replay_lat = np.array([r[1] for r in rows])
+        delta = replay_lat - recorded_lat
+        report[cmd] = dict(
+            count=len(rows),
+            recorded_mean=recorded_lat.mean(),
+            replay_mean=replay_lat.mean(),
+            delta_mean=delta.mean(),
+            delta_p50=np.percentile(delta, 50),
+            delta_p99=np.percentile(delta, 99),
+            recorded_errors=sum(r[3] for r in rows),
+            replay_errors=sum(r[2] for r in rows),
+        )
+    return report
@@ -0,0 +1,405 @@
+'''Experience replay shared by several learners
+
+Transitions are stored in preallocated numpy ring buffers.
+:class:`ReplayBuffer` samples uniformly, :class:`PrioritizedReplayBuffer`
+proportionally to priorities kept in a :class:`SumTree` (sampling and
+updating in O(log n), vectorised over the batch).
+
+:class:`ReplayServer` serves a buffer over zmq to any number of
+:class:`ReplayClient` (REQ/REP sockets). Environment servers feed the
+buffer directly: give a :class:`ReplayFeeder` (or an in process
+buffer) as transition sink to
+:class:`naus.environment_proxy_zmq.EnvironmentProxyForServer`, thus the
+transitions never travel through the actor.
+
+Typical usage:
+
+::
+
+    # replay service
+    server = ReplayServer(PrioritizedReplayBuffer(10**6), port=9900)
+    server.loop()
+
+    # environment server
+    feeder = ReplayFeeder(ReplayClient(port=9900), batch_size=256)
+    proxy = EnvironmentProxyForServer(env, transition_sinks=[feeder])
+
+    # each learner
+    replay = ReplayClient(port=9900)
+    batch = replay.sample(64)
+    replay.updatePriorities(batch['indices'], td_errors)
+'''
+from .environment_proxy_zmq import _EnvironmentProxy
+import itertools
+import logging
+import math
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+#: arrays stored per transition
+fields = ('observations', 'actions', 'rewards', 'next_observations', 'dones')
+
+
+class ReplayBuffer:
+    '''ring buffer of transitions, sampled uniformly
+
+    Args:
+        capacity: number of transitions kept. The oldest are
+                  overwritten
+
+    The arrays are allocated with the first transition, taking shape
+    and dtype of its observation and action.
+    '''
+    def __init__(self, capacity, *, seed=None):
+        self.capacity = int(capacity)
+        self.rng = np.random.RandomState(seed)
+        self.arrays = None
+        self.count = 0
+        self._next = 0
+        self.n_added = 0
+
+    def __len__(self):
+        return self.count
+
+    def _allocate(self, observation, action):
+        observation = np.asarray(observation)
+        action = np.asarray(action)
+        n = self.capacity
+        self.arrays = dict(
+            observations=np.empty((n,) + observation.shape,
+                                  dtype=observation.dtype),
+            actions=np.empty((n,) + action.shape, dtype=action.dtype),
+            rewards=np.empty(n, dtype=np.float32),
+            next_observations=np.empty((n,) + observation.shape,
+                                       dtype=observation.dtype),
+            dones=np.empty(n, dtype=bool),
+        )
+
+    def add(self, observation, action, reward, next_observation, done):
+        '''add a single transition
+
+        Returns:
+            its index
+        '''
+        if self.arrays is None:
+            self._allocate(observation, action)
+        index = self._next
+        arrays = self.arrays
+        arrays['observations'][index] = observation
+        arrays['actions'][index] = action
+        arrays['rewards'][index] = reward
+        arrays['next_observations'][index] = next_observation
+        arrays['dones'][index] = done
+        self._stored(np.array([index]))
+        return index
+
+    def addBatch(self, batch):
+        '''add transitions given as dictionary field: array
+
+        Returns:
+            their indices
+        '''
+        n = len(batch['rewards'])
+        if n == 0:
+            return np.empty(0, dtype=int)
+        if self.arrays is None:
+            self._allocate(batch['observations'][0], batch['actions'][0])
+        indices = (self._next + np.arange(n)) % self.capacity
+        for field in fields:
+            self.arrays[field][indices] = batch[field]
+        self._stored(indices)
+        return indices
+
+    def _stored(self, indices):
+        n = len(indices)
+        self._next = (int(indices[-1]) + 1) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+        self.n_added += n
+
+    def _gather(self, indices):
+        batch = {field: self.arrays[field][indices] for field in fields}
+        batch['indices'] = indices
+        return batch
+
+    def sample(self, batch_size):
+        '''uniformly sampled transitions
+
+        Returns:
+            dictionary field: array, with the indices
+        '''
+        if self.count == 0:
+            raise ValueError('replay buffer is empty')
+        indices = self.rng.randint(self.count, size=int(batch_size))
+        return self._gather(indices)
+
+    def updatePriorities(self, indices, priorities):
+        '''uniform sampling: nothing to do'''
+
+    def statistics(self):
+        return dict(capacity=self.capacity, count=self.count,
+                    n_added=self.n_added)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}(capacity={self.capacity}, count={self.count})'
+
+
+class SumTree:
+    '''binary tree whose nodes hold the sum of their children
+
+    The leaves hold the priorities. Finding the leaf at which the
+    cumulative sum passes a value and updating a leaf take
+    O(log capacity); both are vectorised over arrays of values or
+    indices.
+    '''
+    def __init__(self, capacity):
+        self.depth = max(int(math.ceil(math.log2(max(capacity, 1)))), 0)
+        self.size = 2 ** self.depth
+        # heap layout: root at 1, leaves at size ... 2 * size - 1
+        self.tree = np.zeros(2 * self.size)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def __getitem__(self, indices):
+        return self.tree[np.asarray(indices) + self.size]
+
+    def update(self, indices, priorities):
+        tree = self.tree
+        pos = np.asarray(indices, dtype=np.int64) + self.size
+        tree[pos] = priorities
+        for _ in range(self.depth):
+            pos = np.unique(pos // 2)
+            tree[pos] = tree[2 * pos] + tree[2 * pos + 1]
+
+    def find(self, values):
+        '''leaves at which the cumulative sum reaches values
+        '''
+        tree = self.tree
+        values = np.array(values, dtype=np.float64)
+        idx = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * idx
+            left_sum = tree[left]
+            go_right = values > left_sum
+            values -= np.where(go_right, left_sum, 0.0)
+            idx = left + go_right
+        return idx - self.size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    '''proportional prioritized replay
+
+    Args:
+        alpha:   how much the priorities count (0: uniform)
+        beta:    importance sampling correction (1: full)
+        epsilon: added to the priorities, thus every transition can
+                 still be sampled
+
+    New transitions get the largest priority seen so far.
+    '''
+    def __init__(self, capacity, *, alpha=0.6, beta=0.4, epsilon=1e-6,
+                 seed=None):
+        super().__init__(capacity, seed=seed)
+        self.alpha = float(alpha)
+        self.beta = float(beta)
+        self.epsilon = float(epsilon)
+        self.tree = SumTree(self.capacity)
+        self.max_priority = 1.0
+
+    def _stored(self, indices):
+        super()._stored(indices)
+        self.tree.update(indices, self.max_priority ** self.alpha)
+
+    def sample(self, batch_size):
+        '''transitions sampled proportionally to their priorities
+
+        One value per stratum of the total priority. The batch
+        contains the importance sampling 'weights' (normalised to a
+        maximum of 1).
+        '''
+        if self.count == 0:
+            raise ValueError('replay buffer is empty')
+        n = int(batch_size)
+        total = self.tree.total
+        segment = total / n
+        values = (np.arange(n) + self.rng.uniform(size=n)) * segment
+        indices = self.tree.find(values)
+        # rounding may end beyond the stored transitions
+        np.minimum(indices, self.count - 1, out=indices)
+
+        probabilities = self.tree[indices] / total
+        weights = (self.count * probabilities) ** -self.beta
+        weights /= weights.max()
+
+        batch = self._gather(indices)
+        batch['weights'] = weights.astype(np.float32)
+        return batch
+
+    def updatePriorities(self, indices, priorities):
+        '''e.g. with the absolute td errors of the sampled transitions
+        '''
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64))
+        priorities += self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def statistics(self):
+        d = super().statistics()
+        d.update(alpha=self.alpha, beta=self.beta,
+                 max_priority=self.max_priority, total=float(self.tree.total))
+        return d
+
+
+class ReplayServer(_EnvironmentProxy):
+    '''serve a replay buffer to several learners and feeders
+
+    Args:
+        buffer: :class:`ReplayBuffer` or :class:`PrioritizedReplayBuffer`
+
+    The requests of all clients are served one after the other.
+    '''
+    socket_type = 'REP'
+
+    def __init__(self, buffer, **kwargs):
+        super().__init__(buffer, **kwargs)
+        self.command_dic = {
+            'add': self.add,
+            'sample': self.sample,
+            'update_priorities': self.update_priorities,
+            'statistics': self.statistics,
+        }
+
+    def _initConnection(self):
+        super()._initConnection()
+        txt = f"tcp://*:{self.port}"
+        cls_name = self.__class__.__name__
+        self.log.info(f'{cls_name}: Opening port @ {txt}')
+        self.socket.bind(txt)
+
+    def process_single(self):
+        cls_name = self.__class__.__name__
+        md, A = self.receiveData()
+        cmd = md['cmd']
+        try:
+            method = self.command_dic[cmd]
+            r_md, r_A = method(md, A)
+        except Exception as ex:
+            self.log.error(f'{cls_name}: command {cmd} raised {ex}')
+            r_md = dict(exception=ex.__class__.__name__, args=ex.args)
+            r_A = None
+        self.sendData(r_md, r_A)
+
+    def loop(self):
+        self.log.info('Serving replay buffer')
+        for cnt in itertools.count():
+            self.process_single()
+
+    def add(self, md, A):
+        indices = self._rec.addBatch(A)
+        return dict(n=len(indices)), None
+
+    def sample(self, md, A):
+        batch = self._rec.sample(md['batch_size'])
+        return {}, batch
+
+    def update_priorities(self, md, A):
+        self._rec.updatePriorities(A['indices'], A['priorities'])
+        return {}, None
+
+    def statistics(self, md, A):
+        return dict(statistics=self._rec.statistics()), None
+
+    def __call__(self):
+        return self.loop()
+
+
+class ReplayClient(_EnvironmentProxy):
+    '''access a :class:`ReplayServer`
+
+    Args:
+        hostname: where the replay server runs
+    '''
+    socket_type = 'REQ'
+
+    def __init__(self, *, hostname='127.0.0.1', **kwargs):
+        self.hostname = hostname
+        super().__init__(None, **kwargs)
+
+    def _initConnection(self):
+        super()._initConnection()
+        txt = f"tcp://{self.hostname}:{self.port}"
+        cls_name = self.__class__.__name__
+        self.log.info(f'{cls_name}: Opening port @ {txt}')
+        self.socket.connect(txt)
+
+    def _request(self, md, A=None):
+        self.sendData(md, A)
+        md, A = self.receiveData()
+        if 'exception' in md:
+            cls_name = self.__class__.__name__
+            txt = (f'{cls_name}: received exception {md["exception"]}'
+                   f' with args {md["args"]}')
+            raise Exception(txt)
+        return md, A
+
+    def addBatch(self, batch):
+        md, _ = self._request(dict(cmd='add'), batch)
+        return md['n']
+
+    def sample(self, batch_size):
+        _, A = self._request(dict(cmd='sample', batch_size=int(batch_size)))
+        return dict(A)
+
+    def updatePriorities(self, indices, priorities):
+        A = dict(indices=np.asarray(indices),
+                 priorities=np.asarray(priorities, dtype=np.float64))
+        self._request(dict(cmd='update_priorities'), A)
+
+    def statistics(self):
+        md, _ = self._request(dict(cmd='statistics'))
+        return md['statistics']
+
+
+class ReplayFeeder:
+    '''collect transitions and add them to a replay buffer in batches
+
+    Args:
+        target:     :class:`ReplayClient` (or a buffer in process)
+        batch_size: transitions sent at once
+    '''
+    def __init__(self, target, *, batch_size=256):
+        self.target = target
+        self.batch_size = int(batch_size)
+        self._rows = {field: [] for field in fields}
+
+    def add(self, observation, action, reward, next_observation, done):
+        rows = self._rows
+        # copies: the observations may be views on reused buffers
+        rows['observations'].append(np.array(observation))
+        rows['actions'].append(np.array(action))
+        rows['rewards'].append(reward)
+        rows['next_observations'].append(np.array(next_observation))
+        rows['dones'].append(done)
+        if done or len(rows['rewards']) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        rows = self._rows
+        if not rows['rewards']:
+            return
+        batch = dict(
+            observations=np.stack(rows['observations']),
+            actions=np.stack(rows['actions']),
+            rewards=np.asarray(rows['rewards'], dtype=np.float32),
+            next_observations=np.stack(rows['next_observations']),
+            dones=np.asarray(rows['dones'], dtype=bool),
+        )
+        self._rows = {field: [] for field in fields}
+        self.target.addBatch(batch)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.target!r}, batch_size={self.batch_size})'
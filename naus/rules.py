@@ -0,0 +1,257 @@
+'''Declarative termination and reward rules
+
+Instead of coding :meth:`naus.environment.Environment.computeRewardTerminal`
+by hand, an environment can declare
+
+* bounds on named fields of its observation: the episode terminates
+  as soon as a field leaves its bound
+* the reward of each step: a constant or an expression of the fields
+* the reward of the terminating step and of steps beyond it
+
+:class:`Rules` holds the declaration. :meth:`Rules.compile` turns it
+into a :class:`CompiledRules`, evaluating single observations as well
+as batches of shape (N, n_fields) with numpy operations only, thus the
+same rules serve the environment, batched surrogates
+(:class:`naus.surrogate.TransitionModel` accepts
+:meth:`CompiledRules.terminal`) and offline evaluation of recorded
+data. :class:`EpisodeRules` keeps the per episode bookkeeping for a
+single environment.
+
+Typical usage:
+
+::
+
+    rules = Rules(
+        fields=('x', 'x_dot', 'theta', 'theta_dot'),
+        bounds=[Bound('x', -2.4, 2.4), Bound('theta', -0.21, 0.21)],
+        reward=1.0, reward_beyond_done=0.0,
+    ).compile()
+
+    reward, done = rules.evaluate(observation)
+    rewards, dones = rules.evaluate(observations)   # (N, 4)
+'''
+import logging
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+
+class Bound:
+    '''allowed range of an observation field
+
+    Args:
+        field: name of the field
+        low:   the episode terminates if the field is below. None:
+               no lower bound
+        high:  the episode terminates if the field is above. None:
+               no upper bound
+    '''
+    def __init__(self, field, low=None, high=None):
+        assert(low is not None or high is not None)
+        self.field = field
+        self.low = low
+        self.high = high
+
+    @classmethod
+    def fromDict(cls, d):
+        return cls(d['field'], d.get('low'), d.get('high'))
+
+    def asDict(self):
+        return dict(field=self.field, low=self.low, high=self.high)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.field!r}, low={self.low}, high={self.high})'
+
+
+class Rules:
+    '''declaration of the termination and reward rules
+
+    Args:
+        fields:             names of the observation's components, in
+                            order
+        bounds:             :class:`Bound` (or dictionaries describing
+                            them)
+        reward:             reward of each step: a number or an
+                            expression of the fields (e.g.
+                            `'1.0 - abs(theta)'`; numpy is available
+                            as `np`)
+        terminal_reward:    reward of the step terminating the
+                            episode. None: as given by reward
+        reward_beyond_done: reward of steps made after the episode
+                            terminated, as long as the observation
+                            is still out of bounds
+    '''
+    def __init__(self, fields, *, bounds=(), reward=1.0,
+                 terminal_reward=None, reward_beyond_done=0.0):
+        self.fields = tuple(fields)
+        self.bounds = [bound if isinstance(bound, Bound) else
+                       Bound.fromDict(bound) for bound in bounds]
+        self.reward = reward
+        self.terminal_reward = terminal_reward
+        self.reward_beyond_done = reward_beyond_done
+
+        for bound in self.bounds:
+            if bound.field not in self.fields:
+                txt = f'bound on unknown field {bound.field}, known are {self.fields}'
+                raise ValueError(txt)
+
+    @classmethod
+    def fromDict(cls, d):
+        '''inverse of :meth:`asDict`
+        '''
+        d = dict(d)
+        fields = d.pop('fields')
+        return cls(fields, **d)
+
+    def asDict(self):
+        '''json serialisable description
+        '''
+        return dict(fields=list(self.fields),
+                    bounds=[bound.asDict() for bound in self.bounds],
+                    reward=self.reward, terminal_reward=self.terminal_reward,
+                    reward_beyond_done=self.reward_beyond_done)
+
+    def compile(self):
+        return CompiledRules(self)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return (f'{cls_name}(fields={self.fields}, bounds={self.bounds},'
+                f' reward={self.reward!r}, terminal_reward={self.terminal_reward},'
+                f' reward_beyond_done={self.reward_beyond_done})')
+
+
+class CompiledRules:
+    '''vectorised evaluator of :class:`Rules`
+
+    The bounds are gathered into arrays of lower and upper limits over
+    the bounded columns, the reward expression is compiled once.
+    '''
+    def __init__(self, rules):
+        self.rules = rules
+        fields = rules.fields
+        self.n_fields = len(fields)
+
+        index = {field: cnt for cnt, field in enumerate(fields)}
+        columns = sorted({index[bound.field] for bound in rules.bounds})
+        position = {column: cnt for cnt, column in enumerate(columns)}
+        self._columns = np.array(columns, dtype=int)
+        self._low = np.full(len(columns), -np.inf)
+        self._high = np.full(len(columns), np.inf)
+        # several bounds on one field: the narrowest wins
+        for bound in rules.bounds:
+            pos = position[index[bound.field]]
+            if bound.low is not None:
+                self._low[pos] = max(self._low[pos], bound.low)
+            if bound.high is not None:
+                self._high[pos] = min(self._high[pos], bound.high)
+
+        self._reward_code = None
+        if isinstance(rules.reward, str):
+            self._reward_code = compile(rules.reward, '<naus reward>', 'eval')
+
+    def _rewards(self, O):
+        n = len(O)
+        if self._reward_code is None:
+            return np.full(n, float(self.rules.reward))
+        namespace = {field: O[:, cnt]
+                     for cnt, field in enumerate(self.rules.fields)}
+        namespace['np'] = np
+        r = eval(self._reward_code, {'__builtins__': {'abs': abs}}, namespace)
+        return np.array(np.broadcast_to(r, (n,)), dtype=np.float64)
+
+    def terminal(self, observations):
+        '''dones of a batch of observations, shape (N, n_fields)
+        '''
+        O = np.asarray(observations)
+        cols = O[:, self._columns]
+        return ((cols < self._low) | (cols > self._high)).any(axis=1)
+
+    def evaluate(self, observations, beyond_done=None):
+        '''reward and done
+
+        Args:
+            observations: a single observation or a batch of shape
+                          (N, n_fields)
+            beyond_done:  bool (array) telling whether the episode
+                          already terminated before this step. Such
+                          steps get the reward_beyond_done only if
+                          they are done again
+
+        Returns:
+            reward, done: float and bool for a single observation,
+            arrays for a batch
+        '''
+        O = np.asarray(observations)
+        single = O.ndim == 1
+        if single:
+            O = O[np.newaxis, :]
+        assert(O.shape[1] == self.n_fields)
+
+        done = self.terminal(O)
+        reward = self._rewards(O)
+        rules = self.rules
+        if rules.terminal_reward is not None:
+            reward[done] = rules.terminal_reward
+        if beyond_done is not None:
+            beyond = np.broadcast_to(np.asarray(beyond_done, dtype=bool),
+                                     done.shape)
+            reward[beyond & done] = rules.reward_beyond_done
+
+        if single:
+            return float(reward[0]), bool(done[0])
+        return reward, done
+
+    def __call__(self, observations, beyond_done=None):
+        return self.evaluate(observations, beyond_done)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.rules!r})'
+
+
+class EpisodeRules:
+    '''rules applied to the steps of one environment
+
+    Counts the steps made after the episode terminated that are still
+    done: these get the reward_beyond_done and a warning is logged at
+    the first of them. A step back within the bounds is rewarded as
+    usual and not counted. Call :meth:`reset` at the start of each
+    episode.
+    '''
+    def __init__(self, rules, *, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+        if isinstance(rules, Rules):
+            rules = rules.compile()
+        self.rules = rules
+        self.steps_beyond_done = None
+
+    def reset(self):
+        self.steps_beyond_done = None
+
+    def __call__(self, observation):
+        beyond = self.steps_beyond_done is not None
+        reward, done = self.rules.evaluate(observation, beyond_done=beyond)
+        if not done:
+            return reward, done
+        if not beyond:
+            self.steps_beyond_done = 0
+            return reward, done
+
+        if self.steps_beyond_done == 0:
+            txt = (
+                "You are calling 'step()' even though this environment has"
+                " already returned done = True. You should always call"
+                " 'reset()' once you receive 'done = True' -- any further"
+                " steps are undefined behaviour."
+            )
+            self.log.warning(txt)
+        self.steps_beyond_done += 1
+        return reward, done
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.rules!r})'
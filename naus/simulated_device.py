@@ -0,0 +1,213 @@
+'''Simulated devices keeping their state in a numpy array
+
+An ophyd device built from signals creates status objects and runs
+callbacks for every signal it sets. For a simulation that is merely
+updating a few floats this dominates the time spent per step.
+
+:class:`SimulatedDevice` keeps the state in a preallocated array,
+applies the model in place and returns a status object which has
+already finished. The readings are a precomputed dictionary whose
+values and timestamps are updated in place.
+'''
+from ophyd.status import Status
+import numpy as np
+import logging
+import time
+
+logger = logging.getLogger('naus')
+
+
+class SimulatedAxis:
+    '''One field of a :class:`SimulatedDevice`
+
+    Can be used as motor (e.g. as state motor of an environment) or
+    as detector.
+    '''
+    #: see :func:`naus.plans.fused_per_step_plan`
+    naus_fused_step = True
+
+    def __init__(self, parent, field, index):
+        self.parent = parent
+        self.field = field
+        self.index = index
+        self.name = f'{parent.name}_{field}'
+        self._reading = {self.name: parent._reading[self.name]}
+        self._description = {self.name: parent._description[self.name]}
+
+    def set(self, value):
+        self.parent._setField(self.index, self.name, value)
+        return self.parent._status
+
+    def snapshot(self):
+        return self.get()
+
+    def restore(self, value):
+        '''set the value immediately, see :func:`naus.plans.supports_restore`
+        '''
+        self.parent._setField(self.index, self.name, value)
+
+    def get(self):
+        return self.parent._reading[self.name]['value']
+
+    def read(self):
+        return self._reading
+
+    def describe(self):
+        return self._description
+
+    def read_configuration(self):
+        return {}
+
+    def describe_configuration(self):
+        return {}
+
+    @property
+    def hints(self):
+        return {'fields': [self.name]}
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}(parent={self.parent.name!r}, field={self.field!r})'
+
+
+class SimulatedDevice:
+    '''Device whose state is an array updated in place
+
+    Derived classes declare the numeric fields in :attr:`fields` and
+    implement :meth:`apply`. Non numeric values (e.g. a mode) can be
+    declared in :attr:`extra_fields`. Each field is accessible as
+    :class:`SimulatedAxis` attribute of the same name.
+
+    Warning:
+        The dictionary returned by :meth:`read` is reused. Its values
+        are only valid until the next call to :meth:`set`.
+    '''
+    #: names of the numeric fields, in order of the state array
+    fields = ()
+    #: name: initial value of non numeric fields
+    extra_fields = {}
+    #: set applies immediately, read needs no trigger: see
+    #: :func:`naus.plans.fused_per_step_plan`
+    naus_fused_step = True
+
+    def __init__(self, name, *, dtype=float, initial=np.nan, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+        self.name = name
+        self.parent = None
+
+        self._state = np.empty(len(self.fields), dtype=dtype)
+        self._state[:] = initial
+
+        # Templates: filled once, updated in place afterwards
+        now = time.time()
+        self._reading = {}
+        self._description = {}
+        source = f'SIM:{self.__class__.__name__}'
+        for field, val in zip(self.fields, self._state.tolist()):
+            key = f'{name}_{field}'
+            self._reading[key] = {'value': val, 'timestamp': now}
+            self._description[key] = {'source': source, 'dtype': 'number',
+                                      'shape': []}
+        for field, val in self.extra_fields.items():
+            key = f'{name}_{field}'
+            self._reading[key] = {'value': val, 'timestamp': now}
+            self._description[key] = {'source': source, 'dtype': 'string',
+                                      'shape': []}
+        self._entries = [self._reading[f'{name}_{field}']
+                         for field in self.fields]
+
+        for index, field in enumerate(self.fields):
+            setattr(self, field, SimulatedAxis(self, field, index))
+        for field in self.extra_fields:
+            setattr(self, field, SimulatedAxis(self, field, None))
+
+        self._status = Status()
+        self._status.set_finished()
+
+    # -------------------------------------------------------------------------
+    # Methods to override in a derived class
+    def apply(self, state, value):
+        '''apply value to state in place
+
+        Args:
+            state: the state array. Modify it in place
+            value: the value passed to :meth:`set`
+        '''
+        cls_name = self.__class__.__name__
+        raise NotImplementedError(f'{cls_name}.apply implement in derived class')
+
+    # -------------------------------------------------------------------------
+    @property
+    def state(self):
+        '''the state array. Call :meth:`refresh` after modifying it
+        '''
+        return self._state
+
+    def refresh(self):
+        '''copy the state array to the readings
+        '''
+        now = time.time()
+        for entry, val in zip(self._entries, self._state.tolist()):
+            entry['value'] = val
+            entry['timestamp'] = now
+
+    def _setField(self, index, key, value):
+        entry = self._reading[key]
+        if index is not None:
+            self._state[index] = value
+            value = self._state.item(index)
+        entry['value'] = value
+        entry['timestamp'] = time.time()
+
+    def set(self, value):
+        self.apply(self._state, value)
+        self.refresh()
+        return self._status
+
+    def trigger(self):
+        return self._status
+
+    def snapshot(self):
+        '''copy of the state array and the non numeric fields
+        '''
+        extras = {field: self._reading[f'{self.name}_{field}']['value']
+                  for field in self.extra_fields}
+        return self._state.copy(), extras
+
+    def restore(self, snapshot):
+        '''apply a snapshot taken by :meth:`snapshot`
+        '''
+        state, extras = snapshot
+        self._state[:] = state
+        self.refresh()
+        for field, value in extras.items():
+            key = f'{self.name}_{field}'
+            self._setField(None, key, value)
+
+    def read(self):
+        return self._reading
+
+    def describe(self):
+        return self._description
+
+    def read_configuration(self):
+        return {}
+
+    def describe_configuration(self):
+        return {}
+
+    def stage(self):
+        return [self]
+
+    def unstage(self):
+        return [self]
+
+    @property
+    def hints(self):
+        return {'fields': [f'{self.name}_{field}' for field in self.fields]}
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}(name={self.name!r})'
@@ -0,0 +1,572 @@
+'''Surrogate environments learned from recorded steps
+
+Steps of real devices are slow and expensive. A surrogate is a
+transition model
+
+    (state, action) -> (next state, reward, done)
+
+fitted to steps recorded on the real environment. It is stepped at
+memory speed, for many environments at once, thus an agent can be
+pre trained on the surrogate and only fine tuned on the hardware.
+
+* :class:`TransitionRecorder` wraps an environment (or a client proxy)
+  and records the steps into a :class:`TransitionDataset`
+* :class:`PolynomialRegressor` (linear for degree 1) and
+  :class:`MLPRegressor` (small numpy network) fit the data.
+  :class:`TransitionModel` combines one of them with the state and
+  action encoding
+* :class:`SurrogateEnvironment` offers the methods of
+  :class:`naus.environment.Environment` used by the agents and
+  :meth:`SurrogateEnvironment.stepBatch` for stepping a batch
+* :func:`validate` and :func:`validate_rollouts` compare the
+  predictions to held out real steps
+
+Typical usage:
+
+::
+
+    recorder = TransitionRecorder(env)
+    # ... run an agent on recorder instead of env
+    train, test = recorder.dataset.split(0.8)
+    model = TransitionModel(MLPRegressor(), n_actions=2).fit(train)
+    print(validate(model, test))
+    surrogate = SurrogateEnvironment(model, train.initialStates())
+'''
+import logging
+import numpy as np
+
+logger = logging.getLogger('naus')
+
+
+class TransitionDataset:
+    '''Transitions recorded on an environment
+
+    Each transition is stored with the episode it belongs to, thus
+    episodes can be replayed for multi step validation.
+    '''
+    _fields = ('states', 'actions', 'next_states', 'rewards', 'dones',
+               'episodes')
+
+    def __init__(self):
+        self._rows = {field: [] for field in self._fields}
+        self._arrays = None
+        self._episode = 0
+
+    def __len__(self):
+        return len(self._rows['states'])
+
+    def newEpisode(self):
+        if len(self) and self._rows['episodes'][-1] == self._episode:
+            self._episode += 1
+
+    def append(self, state, action, next_state, reward, done):
+        rows = self._rows
+        # copies: environments may update their state arrays in place
+        rows['states'].append(np.array(state, dtype=float).ravel())
+        rows['actions'].append(np.array(action, dtype=float).ravel())
+        rows['next_states'].append(np.array(next_state, dtype=float).ravel())
+        rows['rewards'].append(float(reward))
+        rows['dones'].append(bool(done))
+        rows['episodes'].append(self._episode)
+        self._arrays = None
+        if done:
+            self.newEpisode()
+
+    def arrays(self):
+        '''the transitions as dictionary field: array
+
+        Actions are 2 dimensional (transitions, action components)
+        '''
+        if self._arrays is None:
+            if not len(self):
+                raise ValueError('no transitions recorded')
+            self._arrays = {field: np.asarray(vals)
+                            for field, vals in self._rows.items()}
+        return self._arrays
+
+    def initialStates(self):
+        '''states the episodes started from
+        '''
+        d = self.arrays()
+        episodes = d['episodes']
+        first = np.ones(len(episodes), dtype=bool)
+        first[1:] = episodes[1:] != episodes[:-1]
+        return d['states'][first]
+
+    @classmethod
+    def fromArrays(cls, **arrays):
+        dataset = cls()
+        for field in cls._fields:
+            dataset._rows[field] = list(arrays[field])
+        dataset._episode = int(np.max(arrays['episodes'])) + 1
+        return dataset
+
+    def split(self, fraction=0.8, seed=None):
+        '''split into a training and a validation set by episodes
+
+        Splitting by episodes keeps the validation steps independent
+        of the ones the model was trained on.
+
+        Returns:
+            train, validation
+        '''
+        d = self.arrays()
+        episodes = np.unique(d['episodes'])
+        rng = np.random.RandomState(seed)
+        rng.shuffle(episodes)
+        n_train = max(1, int(round(len(episodes) * fraction)))
+        in_train = np.isin(d['episodes'], episodes[:n_train])
+
+        def subset(sel):
+            return self.fromArrays(**{field: val[sel]
+                                      for field, val in d.items()})
+        return subset(in_train), subset(~in_train)
+
+    def save(self, filename):
+        np.savez_compressed(filename, **self.arrays())
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            arrays = {field: data[field] for field in cls._fields}
+        return cls.fromArrays(**arrays)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        n_episodes = len(set(self._rows['episodes']))
+        return f'{cls_name}(transitions={len(self)}, episodes={n_episodes})'
+
+
+class TransitionRecorder:
+    '''record the steps of an environment
+
+    Args:
+        env:     environment or client proxy. All attributes not
+                 defined here are taken from it
+        dataset: :class:`TransitionDataset` to append to
+    '''
+    def __init__(self, env, dataset=None):
+        if dataset is None:
+            dataset = TransitionDataset()
+        self.env = env
+        self.dataset = dataset
+        self._last = None
+
+    def reset(self):
+        state = self.env.reset()
+        self.dataset.newEpisode()
+        self._last = state
+        return state
+
+    def step(self, actions):
+        r = self.env.step(actions)
+        state, reward, done, info = r
+        if self._last is not None:
+            self.dataset.append(self._last, actions, state, reward, done)
+        self._last = None if done else state
+        return r
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.env!r}, dataset={self.dataset!r})'
+
+
+class _Standardiser:
+    '''scale columns to zero mean and unit variance
+    '''
+    def fit(self, X):
+        self.mean = X.mean(axis=0)
+        std = X.std(axis=0)
+        std[std == 0] = 1.0
+        self.std = std
+        return self
+
+    def forward(self, X):
+        return (X - self.mean) / self.std
+
+    def inverse(self, X):
+        return X * self.std + self.mean
+
+
+def polynomial_features(X, degree=2):
+    '''X extended by a constant and all products up to degree
+
+    Only degrees 1 and 2 are supported: higher degrees explode the
+    number of features for the state sizes typically found
+    '''
+    if degree not in (1, 2):
+        raise ValueError(f'degree {degree} not supported, use 1 or 2')
+    n, m = X.shape
+    columns = [np.ones((n, 1)), X]
+    if degree == 2:
+        i, j = np.triu_indices(m)
+        columns.append(X[:, i] * X[:, j])
+    return np.hstack(columns)
+
+
+class PolynomialRegressor:
+    '''least squares fit of polynomial features
+
+    Args:
+        degree: 1: linear model, 2: quadratic model
+        ridge:  regularisation of the least squares problem
+    '''
+    def __init__(self, degree=1, ridge=1e-6):
+        self.degree = int(degree)
+        self.ridge = float(ridge)
+        self.coefficients = None
+
+    def fit(self, X, Y):
+        self._x_scale = _Standardiser().fit(X)
+        F = polynomial_features(self._x_scale.forward(X), self.degree)
+        # ridge regression: append sqrt(ridge) * identity rows
+        n_f = F.shape[1]
+        F_r = np.vstack([F, np.sqrt(self.ridge) * np.eye(n_f)])
+        Y_r = np.vstack([Y, np.zeros((n_f, Y.shape[1]))])
+        self.coefficients, *_ = np.linalg.lstsq(F_r, Y_r, rcond=None)
+        return self
+
+    def predict(self, X):
+        F = polynomial_features(self._x_scale.forward(X), self.degree)
+        return F @ self.coefficients
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}(degree={self.degree}, ridge={self.ridge})'
+
+
+class MLPRegressor:
+    '''small fully connected network, trained with Adam on the cpu
+
+    Args:
+        hidden:     number of units per hidden layer (tanh activation)
+        epochs:     passes over the training data
+        batch_size: transitions per gradient step
+        lr:         learning rate
+        seed:       for the initial weights and shuffling
+    '''
+    def __init__(self, hidden=(64, 64), *, epochs=200, batch_size=256,
+                 lr=1e-3, seed=None, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+        self.hidden = tuple(hidden)
+        self.epochs = int(epochs)
+        self.batch_size = int(batch_size)
+        self.lr = float(lr)
+        self.seed = seed
+        self.weights = None
+        self.loss = None
+
+    def _forward(self, X):
+        activations = [X]
+        n_layers = len(self.weights)
+        for cnt, (W, b) in enumerate(self.weights):
+            X = X @ W + b
+            if cnt < n_layers - 1:
+                X = np.tanh(X)
+            activations.append(X)
+        return activations
+
+    def _gradients(self, activations, error):
+        grads = []
+        delta = error
+        n_layers = len(self.weights)
+        for cnt in range(n_layers - 1, -1, -1):
+            W, b = self.weights[cnt]
+            grads.append((activations[cnt].T @ delta, delta.sum(axis=0)))
+            if cnt > 0:
+                delta = (delta @ W.T) * (1 - activations[cnt] ** 2)
+        grads.reverse()
+        return grads
+
+    def fit(self, X, Y):
+        rng = np.random.RandomState(self.seed)
+        self._x_scale = _Standardiser().fit(X)
+        self._y_scale = _Standardiser().fit(Y)
+        X = self._x_scale.forward(X)
+        Y = self._y_scale.forward(Y)
+
+        sizes = (X.shape[1],) + self.hidden + (Y.shape[1],)
+        self.weights = [
+            (rng.randn(n_in, n_out) / np.sqrt(n_in), np.zeros(n_out))
+            for n_in, n_out in zip(sizes[:-1], sizes[1:])
+        ]
+        moments = [[np.zeros_like(p) for p in layer for _ in (0, 1)]
+                   for layer in self.weights]
+
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        n = len(X)
+        t = 0
+        for epoch in range(self.epochs):
+            order = rng.permutation(n)
+            loss = 0.0
+            for start in range(0, n, self.batch_size):
+                sel = order[start:start + self.batch_size]
+                activations = self._forward(X[sel])
+                error = activations[-1] - Y[sel]
+                loss += float((error ** 2).sum())
+                grads = self._gradients(activations, error / len(sel))
+
+                t += 1
+                scale = np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+                for layer, grad, m in zip(self.weights, grads, moments):
+                    for cnt, (p, g) in enumerate(zip(layer, grad)):
+                        m1, m2 = m[2 * cnt], m[2 * cnt + 1]
+                        m1 *= beta1
+                        m1 += (1 - beta1) * g
+                        m2 *= beta2
+                        m2 += (1 - beta2) * g ** 2
+                        p -= self.lr * scale * m1 / (np.sqrt(m2) + eps)
+            self.loss = loss / (n * Y.shape[1])
+            if epoch % 50 == 0:
+                self.log.debug(f'MLP epoch {epoch}: loss {self.loss:.3g}')
+        return self
+
+    def predict(self, X):
+        Y = self._forward(self._x_scale.forward(X))[-1]
+        return self._y_scale.inverse(Y)
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = (
+            f'{cls_name}(hidden={self.hidden}, epochs={self.epochs},'
+            f' batch_size={self.batch_size}, lr={self.lr})'
+        )
+        return txt
+
+
+class TransitionModel:
+    '''predict next state, reward and done from state and action
+
+    Args:
+        regressor: e.g. :class:`PolynomialRegressor` or
+                   :class:`MLPRegressor`
+        n_actions: number of actions of a discrete action space. The
+                   actions are then one hot encoded. None: actions are
+                   used as given
+        terminal:  callable(next_states) returning the dones. If None
+                   done is learned as a further output (threshold 0.5)
+
+    The change of the state is learned, not the next state itself:
+    for small time steps it is much easier to fit.
+    '''
+    def __init__(self, regressor, *, n_actions=None, terminal=None):
+        self.regressor = regressor
+        self.n_actions = n_actions
+        self.terminal = terminal
+        self.n_state = None
+
+    def encodeActions(self, actions):
+        actions = np.asarray(actions, dtype=float)
+        if self.n_actions is None:
+            return actions.reshape(len(actions), -1)
+        indices = actions.reshape(len(actions)).astype(int)
+        return np.eye(self.n_actions)[indices]
+
+    def _inputs(self, states, actions):
+        states = np.asarray(states, dtype=float)
+        return np.hstack([states, self.encodeActions(actions)])
+
+    def fit(self, dataset):
+        d = dataset.arrays()
+        X = self._inputs(d['states'], d['actions'])
+        columns = [d['next_states'] - d['states'], d['rewards'][:, None]]
+        if self.terminal is None:
+            columns.append(d['dones'][:, None].astype(float))
+        self.n_state = d['states'].shape[1]
+        self.regressor.fit(X, np.hstack(columns))
+        return self
+
+    def predict(self, states, actions):
+        '''
+        Args:
+            states:  array (batch, state)
+            actions: array (batch,) or (batch, action)
+
+        Returns:
+            next states, rewards, dones
+        '''
+        states = np.asarray(states, dtype=float)
+        Y = self.regressor.predict(self._inputs(states, actions))
+        n = self.n_state
+        next_states = states + Y[:, :n]
+        rewards = Y[:, n]
+        if self.terminal is None:
+            dones = Y[:, n + 1] > 0.5
+        else:
+            dones = np.asarray(self.terminal(next_states), dtype=bool)
+        return next_states, rewards, dones
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return (f'{cls_name}({self.regressor!r}, n_actions={self.n_actions},'
+                f' terminal={self.terminal})')
+
+
+class SurrogateEnvironment:
+    '''environment stepping a transition model
+
+    Args:
+        model:          fitted :class:`TransitionModel`
+        initial_states: states an episode starts from (sampled). E.g.
+                        :meth:`TransitionDataset.initialStates`
+        noise:          standard deviation of the noise added to the
+                        initial states
+        max_steps:      episodes are ended after that many steps
+        batch_size:     number of environments stepped by
+                        :meth:`stepBatch`
+
+    :meth:`reset` and :meth:`step` follow
+    :class:`naus.environment.Environment`, thus an agent can be
+    trained on a surrogate first.
+    '''
+    def __init__(self, model, initial_states, *, noise=0.0, max_steps=None,
+                 batch_size=1, seed=None, log=None):
+        if log is None:
+            log = logger
+        self.log = log
+        self.model = model
+        self.initial_states = np.atleast_2d(np.asarray(initial_states,
+                                                       dtype=float))
+        self.noise = float(noise)
+        self.max_steps = max_steps
+        self.batch_size = int(batch_size)
+        self.seed(seed)
+
+        self.states = None
+        self.n_steps = None
+        self.dones = None
+
+    def seed(self, seed=None):
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
+    def set_mode(self, mode):
+        pass
+
+    def setup(self):
+        return self.initial_states[0]
+
+    def close(self):
+        pass
+
+    def _initialStates(self, n):
+        sel = self.np_random.randint(len(self.initial_states), size=n)
+        states = self.initial_states[sel]
+        if self.noise > 0:
+            states = states + self.np_random.normal(scale=self.noise,
+                                                    size=states.shape)
+        return states
+
+    def resetBatch(self, mask=None):
+        '''reset all environments of the batch or the ones in mask
+
+        Returns:
+            the states of the batch
+        '''
+        if self.states is None or mask is None:
+            self.states = self._initialStates(self.batch_size)
+            self.n_steps = np.zeros(self.batch_size, dtype=int)
+            self.dones = np.zeros(self.batch_size, dtype=bool)
+        else:
+            mask = np.asarray(mask, dtype=bool)
+            self.states[mask] = self._initialStates(int(mask.sum()))
+            self.n_steps[mask] = 0
+            self.dones[mask] = False
+        return self.states.copy()
+
+    def stepBatch(self, actions):
+        '''step all environments of the batch
+
+        Args:
+            actions: one action per environment
+
+        Returns:
+            states, rewards, dones: arrays over the batch
+        '''
+        states, rewards, dones = self.model.predict(self.states, actions)
+        self.n_steps += 1
+        if self.max_steps is not None:
+            dones = dones | (self.n_steps >= self.max_steps)
+        self.states = states
+        self.dones = dones
+        return states.copy(), rewards, dones
+
+    def reset(self):
+        states = self.resetBatch()
+        return states[0]
+
+    def step(self, actions):
+        states, rewards, dones = self.stepBatch(
+            np.asarray(actions)[np.newaxis, ...]
+        )
+        return states[0], float(rewards[0]), bool(dones[0]), {}
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = (
+            f'{cls_name}({self.model!r}, initial_states='
+            f'{len(self.initial_states)}, noise={self.noise},'
+            f' max_steps={self.max_steps}, batch_size={self.batch_size})'
+        )
+        return txt
+
+
+def validate(model, dataset):
+    '''one step prediction errors of model on dataset
+
+    Returns:
+        dictionary with the root mean square error per state
+        component, of the reward, and the fraction of correctly
+        predicted dones
+    '''
+    d = dataset.arrays()
+    next_states, rewards, dones = model.predict(d['states'], d['actions'])
+    state_err = next_states - d['next_states']
+    scale = d['next_states'].std(axis=0)
+    scale[scale == 0] = 1.0
+    report = dict(
+        transitions=len(dataset),
+        state_rmse=np.sqrt((state_err ** 2).mean(axis=0)),
+        state_nrmse=np.sqrt((state_err ** 2).mean(axis=0)) / scale,
+        reward_rmse=float(np.sqrt(((rewards - d['rewards']) ** 2).mean())),
+        done_accuracy=float((dones == d['dones']).mean()),
+    )
+    return report
+
+
+def validate_rollouts(model, dataset, horizon=10):
+    '''multi step prediction error
+
+    The model is stepped open loop with the recorded actions from each
+    recorded state for horizon steps (within the episode), the error
+    to the recorded states is averaged per number of steps. Errors
+    accumulate: this tells how far an agent can trust the surrogate.
+
+    Returns:
+        array (horizon, state): root mean square error after 1 ...
+        horizon steps
+    '''
+    d = dataset.arrays()
+    states, actions = d['states'], d['actions']
+    next_states, episodes = d['next_states'], d['episodes']
+    n = len(states)
+
+    errors = []
+    predicted = states.copy()
+    start = np.arange(n)
+    for k in range(horizon):
+        idx = start + k
+        valid = idx < n
+        valid[valid] &= episodes[idx[valid]] == episodes[start[valid]]
+        if not valid.any():
+            break
+        start, predicted, idx = start[valid], predicted[valid], idx[valid]
+        predicted, _, _ = model.predict(predicted, actions[idx])
+        err = predicted - next_states[idx]
+        errors.append(np.sqrt((err ** 2).mean(axis=0)))
+    return np.array(errors)
@@ -1,36 +1,21 @@
 from bluesky import preprocessors as bpp
-from bcib.threaded_bridge import setup_threaded_callback_iterator_bridge
-from bcib.bridge_plan import bridge_plan_stub
+from bluesky import plan_stubs as bps
+from bluesky.utils import separate_devices, root_ancestor
+from .pacing import pin_thread, thread_settings, restore_thread
 from threading import Thread
+import functools
 import logging
 import itertools
 
 logger = logging.getLogger('bact2')
 
 
-def run_environment(env, partial, md=None, log=None, n_loops=1):
-    '''Plan for executing environment.
-
-    Args:
-        env :     an instance of a subclass of
-                  :class:`naus.environment.Environment`
-        n_loops : number of times to execute.
-                  if negative run for ever
-
-    This plan expects that env is used as an environment in an
-    OpenAI or keras learning environment.
-
-    Warning:
-        The learning environment must be executed in an independent
-        thread or process.
+def environment_metadata(env, n_loops=1):
+    '''metadata of a run of the environment
 
+    Building it calls repr of the environment, the devices and the
+    plans. :class:`EnvironmentSession` does that only once.
     '''
-    if log is None:
-        log = logger
-
-    # 0 loops or no loops does not make sense ...
-    assert(n_loops != 0)
-
     detectors = list(env.detectors)
     motors = list(env.motors)
     state_motors = list(env.state_motors)
@@ -51,47 +36,257 @@ def run_environment(env, partial, md=None, log=None, n_loops=1):
         'executor_type': 'threaded',
         'hints': {}
     }
-    _md.update(md or {})
+    return _md
+
+
+def _execute_environment(env, partial, log, n_loops=1, profiler=None,
+                         bridge=None, cpu_affinity=None, sched_priority=None):
+    '''evaluate partial in a thread, execute the plans it submits
+
+    Staging and opening the run is left to the caller
+    '''
+    # 0 loops or no loops does not make sense ...
+    assert(n_loops != 0)
 
     clear_method = env.clearLinkToBridge
 
-    objects_all = (detectors + motors + state_motors)
-    @bpp.stage_decorator(objects_all)
-    @bpp.run_decorator(md=_md)
-    def run_inner():
+    # bcib is only required for its bridge: not for naus.inline or
+    # bridges providing their plan stub
+    if bridge is None:
+        from bcib.threaded_bridge import setup_threaded_callback_iterator_bridge
         bridge = setup_threaded_callback_iterator_bridge()
-        assert(bridge is not None)
-
-        def run_partial(partial):
-            return partial()
-
-        try:
-            env.bridge = bridge
-            env.bridge
-
-            thread = Thread(target=run_partial, args=[partial],
-                            name='run optimiser')
-            thread.start()
-            log.info(
-                f'run_environment: thread evaluating partial, executing plan'
-            )
-            for cnt in itertools.count():
-                if n_loops < 0 or cnt < n_loops:
-                    log.info(f'run_environment: running loop {cnt}')
-                    r = (yield from bridge_plan_stub(bridge, log=log))
-                    log.info(f'run_environment: loop {cnt} returned {r}')
-                else:
-                    log.info(f'Finished evaluations after {cnt} loops')
-                    break
-        except Exception:
-            log.error(f'run_environment: Failed to execute environment {env}')
-            raise
-        finally:
-            log.info(f'run_environment: Finishing processing  {env}')
+    assert(bridge is not None)
+    plan_stub = getattr(bridge, 'planStub', None)
+    if plan_stub is None:
+        from bcib.bridge_plan import bridge_plan_stub
+        plan_stub = functools.partial(bridge_plan_stub, bridge)
+
+    def run_partial(partial):
+        return partial()
+
+    watchdog = env.watchdog
+    # the RunEngine thread executes later plans too: restore afterwards
+    pinned = None
+    thread = None
+    try:
+        if cpu_affinity is not None or sched_priority is not None:
+            pinned = thread_settings()
+            pin_thread(cpu_affinity, sched_priority, log=log)
+
+        env.bridge = bridge
+        env.bridge
+        if watchdog is not None:
+            watchdog.watchThread()
+            watchdog.start()
+
+        thread = Thread(target=run_partial, args=[partial],
+                        name='run optimiser')
+        thread.start()
+        if profiler is not None:
+            env.addInstrument(profiler)
+            profiler.addThread(name='RunEngine')
+            profiler.addThread(thread.ident)
+            profiler.start()
+        log.info(
+            f'run_environment: thread evaluating partial, executing plan'
+        )
+        for cnt in itertools.count():
+            if n_loops < 0 or cnt < n_loops:
+                log.info(f'run_environment: running loop {cnt}')
+                r = (yield from plan_stub(log=log))
+                log.info(f'run_environment: loop {cnt} returned {r}')
+            else:
+                log.info(f'Finished evaluations after {cnt} loops')
+                break
+    except Exception:
+        log.error(f'run_environment: Failed to execute environment {env}')
+        raise
+    finally:
+        log.info(f'run_environment: Finishing processing  {env}')
+        if thread is not None:
             thread.join()
-            clear_method()
-        # thread.join()
+        if profiler is not None:
+            profiler.stop()
+            profiler.flush()
+        if watchdog is not None:
+            watchdog.stop()
+        clear_method()
+        if pinned is not None:
+            restore_thread(pinned, log=log)
+    # thread.join()
+
+    return r
+
+
+def run_environment(env, partial, md=None, log=None, n_loops=1,
+                    profiler=None, bridge=None, cpu_affinity=None,
+                    sched_priority=None):
+    '''Plan for executing environment.
+
+    Args:
+        env :      an instance of a subclass of
+                   :class:`naus.environment.Environment`
+        n_loops :  number of times to execute.
+                   if negative run for ever
+        profiler : a :class:`naus.profiler.StackSampler`. If given it
+                   samples the RunEngine thread and the thread
+                   evaluating partial. It is added to the instruments
+                   of the environment.
+        bridge :   bridge between the thread evaluating partial and
+                   the RunEngine. If it provides a `planStub` method
+                   (e.g. :class:`naus.bridge.PingPongBridge`) this one
+                   is used as plan. Defaults to the threaded bridge of
+                   :mod:`bcib`
+        cpu_affinity :   cpus the RunEngine thread shall run on
+        sched_priority : SCHED_FIFO priority of the RunEngine thread
+                         (see :func:`naus.pacing.pin_thread`)
+
+    This plan expects that env is used as an environment in an
+    OpenAI or keras learning environment.
 
+    Warning:
+        The learning environment must be executed in an independent
+        thread or process. An agent written as plan can be executed
+        without, see :func:`naus.inline.run_agent`.
+
+    See :class:`EnvironmentSession` for executing many short runs.
+    '''
+    if log is None:
+        log = logger
+
+    _md = environment_metadata(env, n_loops)
+    _md.update(md or {})
+
+    objects_all = (list(env.detectors) + list(env.motors)
+                   + list(env.state_motors))
+    @bpp.stage_decorator(objects_all)
+    @bpp.run_decorator(md=_md)
+    def run_inner():
+        r = (yield from _execute_environment(
+            env, partial, log, n_loops=n_loops, profiler=profiler,
+            bridge=bridge, cpu_affinity=cpu_affinity,
+            sched_priority=sched_priority
+        ))
         return r
 
     return (yield from run_inner())
+
+
+class EnvironmentSession:
+    '''Execute several runs of an environment with the devices staged once
+
+    :func:`run_environment` stages and unstages all devices and builds
+    the metadata for every run. For many short runs (hyper parameter
+    sweeps, evaluation batches) a session stages the deduplicated set
+    of devices once and builds the static part of the metadata once.
+    Each run then only opens and closes a bluesky run.
+
+    The RunEngine unstages all devices when a plan finishes, thus the
+    runs of a session have to be executed within one plan:
+
+    ::
+
+        session = EnvironmentSession(env, bridge=PingPongBridge())
+        RE(session.runs(partials, md={'sweep': 'learning rate'}))
+
+    or composed by hand:
+
+    ::
+
+        def sweep():
+            yield from session.stage()
+            for partial in partials:
+                yield from session.run(partial)
+            yield from session.unstage()
+
+    Args:
+        env:    an instance of a subclass of
+                :class:`naus.environment.Environment`
+
+    Further keyword arguments (profiler, bridge, cpu_affinity,
+    sched_priority) are used for each run (see :func:`run_environment`).
+    '''
+    def __init__(self, env, *, log=None, **kwargs):
+        if log is None:
+            log = logger
+        self.log = log
+        self.env = env
+        self.run_kwargs = kwargs
+
+        objects_all = (list(env.detectors) + list(env.motors)
+                       + list(env.state_motors))
+        self.devices = separate_devices(root_ancestor(obj)
+                                        for obj in objects_all)
+        self.staged = False
+        self._md = None
+
+    def metadata(self, n_loops=1):
+        '''metadata of a run, built once
+        '''
+        if self._md is None:
+            self._md = environment_metadata(self.env)
+        md = dict(self._md)
+        md['plan_args'] = dict(self._md['plan_args'], n_loops=n_loops)
+        md['session'] = True
+        return md
+
+    def stage(self):
+        '''plan staging the devices of the environment
+        '''
+        assert(not self.staged)
+        for device in self.devices:
+            yield from bps.stage(device)
+        self.staged = True
+        self.log.info(f'Session: staged {len(self.devices)} devices')
+
+    def unstage(self):
+        '''plan unstaging the devices, in reverse order
+        '''
+        for device in reversed(self.devices):
+            yield from bps.unstage(device)
+        self.staged = False
+
+    def run(self, partial, md=None, n_loops=1):
+        '''plan executing one run: see :func:`run_environment`
+        '''
+        assert(self.staged)
+        _md = self.metadata(n_loops)
+        _md.update(md or {})
+
+        @bpp.run_decorator(md=_md)
+        def run_inner():
+            r = (yield from _execute_environment(
+                self.env, partial, self.log, n_loops=n_loops,
+                **self.run_kwargs
+            ))
+            return r
+
+        return (yield from run_inner())
+
+    def runs(self, partials, md=None, n_loops=1):
+        '''plan staging the devices, executing a run per partial
+
+        Args:
+            partials: iterable of the callables to evaluate in the
+                      learning thread, one per run
+
+        Returns:
+            list of the results of the runs
+        '''
+        def inner():
+            yield from self.stage()
+            results = []
+            for partial in partials:
+                r = (yield from self.run(partial, md=md, n_loops=n_loops))
+                results.append(r)
+            return results
+
+        def cleanup():
+            if self.staged:
+                yield from self.unstage()
+
+        return (yield from bpp.finalize_wrapper(inner(), cleanup()))
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        return f'{cls_name}({self.env!r}, devices={len(self.devices)})'
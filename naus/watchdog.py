@@ -0,0 +1,242 @@
+'''Deadlines for the plans submitted by the environment
+
+If a device hangs (e.g. a motor never reaching its set point in
+`bps.mv`) the agent would wait for ever in
+:meth:`naus.environment.Environment._submit`. The
+:class:`DeadlineWatchdog` enforces a deadline per command (setup,
+reset, step, teardown):
+
+* the plan is aborted through the RunEngine (the `abort` callable,
+  typically :meth:`RunEngine.abort`)
+* the environment raises :class:`DeadlineExceeded` in the agent thread
+  and moves to the failed state. This requires a bridge whose `submit`
+  accepts a timeout (e.g. :class:`naus.bridge.PingPongBridge`)
+* a report tells where the time went: the elapsed time, the state of
+  the bridge and the stack of the RunEngine thread when the deadline
+  passed
+
+Typical usage:
+
+::
+
+    watchdog = DeadlineWatchdog({'step': 2, 'reset': 30}, abort=RE.abort)
+    env = UserEnv(..., watchdog=watchdog)
+    RE(run_environment(env, partial, bridge=PingPongBridge()))
+'''
+from threading import Thread, Event, Lock
+import traceback
+import threading
+import logging
+import time
+import sys
+
+logger = logging.getLogger('naus')
+
+
+class DeadlineExceeded(TimeoutError):
+    '''A command of the environment missed its deadline
+
+    The report of the watchdog is available as attribute `report`.
+    '''
+    def __init__(self, txt, report=None):
+        super().__init__(txt)
+        self.report = report
+
+
+class DeadlineWatchdog:
+    '''Watch that submitted commands finish within their deadline
+
+    Args:
+        deadlines:  dictionary command kind ('setup', 'reset', 'step',
+                    'teardown', ...): seconds. Commands not listed are
+                    not watched unless 'default' is given
+        abort:      callable called with a reason when a deadline is
+                    missed, e.g. :meth:`RunEngine.abort`
+        grace:      the agent waits that much longer than the deadline
+                    for the aborted plan to return
+        resolution: how often the watchdog thread checks the deadline
+
+    Arming and disarming only set attributes (under a lock shared with
+    the watchdog thread): the watchdog thread polls at the given
+    resolution. A command either finishes or misses its deadline:
+    :meth:`disarm` reports a miss exactly if the watchdog fired for
+    this command.
+    '''
+    #: name used to find the instrument of an environment
+    name = 'watchdog'
+    #: methods a client can call through the server proxy
+    remote_actions = ('lastReport',)
+
+    def __init__(self, deadlines, *, abort=None, grace=1.0, resolution=0.05,
+                 log=None):
+        if log is None:
+            log = logger
+        self.log = log
+
+        self.deadlines = dict(deadlines)
+        self.abort = abort
+        self.grace = float(grace)
+        self.resolution = float(resolution)
+
+        self.bridge = None
+        self._thread_ident = None
+        self._kind = None
+        self._started = None
+        self._expires = None
+        self._missed = False
+
+        self.n_missed = 0
+        self.reports = []
+
+        self._stop = Event()
+        self._thread = None
+        self._lock = Lock()
+        # incremented by each arm: a miss is only reported for the
+        # command it was detected for
+        self._generation = 0
+        self._aborting = False
+
+    def deadline(self, kind):
+        return self.deadlines.get(kind, self.deadlines.get('default'))
+
+    def watchThread(self, ident=None):
+        '''the thread executing the plans (the RunEngine thread)
+        '''
+        if ident is None:
+            ident = threading.get_ident()
+        self._thread_ident = ident
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='naus watchdog',
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        with self._lock:
+            aborting = self._aborting
+        # abort waits for the RunEngine, which may be the caller: the
+        # thread ends by itself afterwards
+        if not aborting:
+            self._thread.join()
+        self._thread = None
+
+    def arm(self, kind):
+        '''start watching a command of kind
+
+        Returns:
+            the time the agent shall wait for the result, None if not
+            watched
+        '''
+        deadline = self.deadline(kind)
+        if deadline is None:
+            return None
+        if self._thread is None:
+            self.start()
+
+        now = time.monotonic()
+        with self._lock:
+            self._generation += 1
+            self._missed = False
+            self._kind = kind
+            self._started = now
+            self._expires = now + deadline
+        return deadline + self.grace
+
+    def disarm(self):
+        '''the command finished
+
+        Returns:
+            True if the command missed its deadline
+        '''
+        with self._lock:
+            self._expires = None
+            return self._missed
+
+    def _run(self):
+        while not self._stop.wait(self.resolution):
+            with self._lock:
+                expires = self._expires
+                if expires is None or time.monotonic() < expires:
+                    continue
+                # Only report once per command
+                self._expires = None
+                self._missed = True
+                generation = self._generation
+            self._onMiss(generation)
+
+    def _onMiss(self, generation):
+        report = self.report()
+        self.n_missed += 1
+        self.reports.append(report)
+        del self.reports[:-10]
+        self.log.error(f'Watchdog: {report["kind"]} missed its deadline of'
+                       f' {report["deadline"]} s: {report["summary"]}')
+        if self.abort is not None:
+            reason = f'naus watchdog: {report["kind"]} missed its deadline'
+            with self._lock:
+                if generation != self._generation:
+                    # a new command was armed meanwhile: the missed
+                    # one finished, do not abort the new one
+                    return
+                self._aborting = True
+            try:
+                self.abort(reason)
+            except Exception as exc:
+                self.log.error(f'Watchdog: abort failed: {exc}')
+            finally:
+                with self._lock:
+                    self._aborting = False
+
+    def report(self):
+        '''where the time went in the command currently watched
+        '''
+        kind = self._kind
+        elapsed = time.monotonic() - self._started
+        bridge_state = None
+        get_state = getattr(self.bridge, 'handoffState', None)
+        if get_state is not None:
+            bridge_state = get_state()
+
+        stack = None
+        frame = sys._current_frames().get(self._thread_ident)
+        if frame is not None:
+            stack = traceback.format_stack(frame)
+
+        if bridge_state == 'queued':
+            summary = 'the RunEngine did not pick up the command'
+        elif stack:
+            summary = f'RunEngine thread in {stack[-1].strip()}'
+        else:
+            summary = 'unknown: RunEngine thread not registered'
+
+        report = dict(kind=kind, deadline=self.deadline(kind),
+                      elapsed=elapsed, bridge_state=bridge_state,
+                      summary=summary, stack=stack)
+        return report
+
+    def lastReport(self):
+        if not self.reports:
+            return None
+        return self.reports[-1]
+
+    # -------------------------------------------------------------------------
+    # Instrument interface called by the environment
+    def onStep(self, env):
+        pass
+
+    def onEpisodeEnd(self, env):
+        pass
+
+    def __repr__(self):
+        cls_name = self.__class__.__name__
+        txt = (
+            f'{cls_name}(deadlines={self.deadlines}, abort={self.abort},'
+            f' grace={self.grace})'
+        )
+        return txt
@@ -0,0 +1,36 @@
+'''binary semaphore of the ping-pong bridge
+'''
+from threading import Thread
+import pytest
+
+pytest.importorskip('bluesky')
+from naus.bridge import _Signal  # noqa: E402
+
+
+def test_signal_set_wait():
+    signal = _Signal()
+    assert not signal.is_set()
+    assert not signal.wait(timeout=0.001)
+    signal.set()
+    signal.set()
+    assert signal.is_set()
+    assert signal.wait(timeout=0.001)
+    assert not signal.is_set()
+    assert not signal.wait(timeout=0.001)
+
+
+def test_signal_ping_pong_loses_no_set():
+    ping, pong = _Signal(), _Signal()
+    n = 20000
+
+    def partner():
+        for i in range(n):
+            assert ping.wait(timeout=5)
+            pong.set()
+
+    thread = Thread(target=partner)
+    thread.start()
+    for i in range(n):
+        ping.set()
+        assert pong.wait(timeout=5)
+    thread.join()
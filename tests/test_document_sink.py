@@ -0,0 +1,54 @@
+'''columnar storage of runs
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+from naus.document_sink import ColumnarSink, load_run, documents  # noqa: E402
+
+
+def descriptor(uid, data_keys):
+    return dict(uid=uid, run_start='run', name='primary', data_keys=data_keys)
+
+
+def event(descriptor_uid, seq_num, t, data):
+    return dict(descriptor=descriptor_uid, uid=f'{descriptor_uid}-{seq_num}',
+                seq_num=seq_num, time=t, data=data,
+                timestamps={key: t for key in data})
+
+
+def emit(sink):
+    '''a run with two descriptors on the stream primary'''
+    docs = [('start', dict(uid='run', time=0.0))]
+    first = descriptor('first', dict(x=dict(dtype='number', shape=[]),
+                                     state=dict(dtype='string', shape=[])))
+    second = descriptor('second', dict(y=dict(dtype='integer', shape=[]),
+                                       v=dict(dtype='array', shape=[2])))
+    docs += [('descriptor', first), ('descriptor', second)]
+    for i in range(5):
+        docs.append(('event', event('first', i + 1, 2.0 * i + 1,
+                                    dict(x=0.5 * i, state=f's{i}'))))
+        docs.append(('event', event('second', i + 1, 2.0 * i + 2,
+                                    dict(y=i, v=[i, -i]))))
+    docs.append(('stop', dict(uid='stop', run_start='run', time=20.0)))
+    for name, doc in docs:
+        sink(name, doc)
+    return docs
+
+
+def test_round_trip(tmp_path):
+    sink = ColumnarSink(str(tmp_path), chunk_size=2)
+    docs = emit(sink)
+    sink.close()
+
+    run = load_run(str(tmp_path / 'run'))
+    assert set(run['streams']) == {'first', 'second'}
+    first = run['streams']['first']
+    second = run['streams']['second']
+    assert first['name'] == second['name'] == 'primary'
+    assert first['data']['x'].tolist() == [0.0, 0.5, 1.0, 1.5, 2.0]
+    assert first['data']['state'] == ['s0', 's1', 's2', 's3', 's4']
+    assert second['data']['y'].tolist() == [0, 1, 2, 3, 4]
+    assert second['data']['v'].tolist() == [[i, -i] for i in range(5)]
+    assert second['seq_num'].tolist() == [1, 2, 3, 4, 5]
+
+    assert list(documents(str(tmp_path / 'run'))) == docs
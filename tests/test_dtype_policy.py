@@ -0,0 +1,33 @@
+'''dtypes derived from spaces and the checked cast of actions
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+from naus.dtype_policy import DtypePolicy, space_dtype  # noqa: E402
+
+
+class Discrete:
+    def __init__(self, n, start=0):
+        self.n = n
+        self.start = start
+
+
+def test_discrete_dtype():
+    assert space_dtype(Discrete(2)) == np.uint8
+    assert space_dtype(Discrete(2, start=255)) == np.uint16
+    assert space_dtype(Discrete(3, start=-1)) == np.int8
+    assert space_dtype(Discrete(300, start=-200)) == np.int16
+
+
+def test_cast_action():
+    policy = DtypePolicy.fromSpaces(action_space=Discrete(2))
+    action = policy.castAction(1)
+    assert action.dtype == np.uint8 and action == 1
+    assert policy.castAction(np.array([0.0, 1.0])).tolist() == [0, 1]
+
+
+@pytest.mark.parametrize('action', [256, -1, 1.5, [1, 300]])
+def test_cast_action_out_of_range(action):
+    policy = DtypePolicy(action='uint8')
+    with pytest.raises(ValueError):
+        policy.castAction(action)
@@ -0,0 +1,24 @@
+'''metrics of environments
+'''
+from naus.environment import Environment, steps_total
+
+
+class Env(Environment):
+    pass
+
+
+def make(**kwargs):
+    return Env(detectors=[], motors=[], state_motors=[], **kwargs)
+
+
+def test_instances_have_own_metrics():
+    first = make()
+    second = make()
+    named = make(metrics_name='beamline')
+    names = {first.metrics_name, second.metrics_name, named.metrics_name}
+    assert len(names) == 3
+    assert named.metrics_name == 'beamline'
+
+    first._steps_total.inc()
+    assert steps_total.labels(first.metrics_name).value == 1
+    assert steps_total.labels(second.metrics_name).value == 0
@@ -0,0 +1,56 @@
+'''the client side must not import bluesky and friends
+
+See also `examples/benchmarks/client_import_time.py`.
+'''
+import subprocess
+import sys
+import os
+import pytest
+
+pytest.importorskip('zmq')
+
+heavy_modules = ('bluesky', 'ophyd', 'super_state_machine')
+client_module = 'naus.environment_proxy_zmq'
+#: generous: the import takes some 20 ms, with bluesky some 500 ms
+max_import_ms = 300
+
+
+def test_client_import_is_lazy():
+    code = (
+        'import sys\n'
+        'import naus.environment_proxy_zmq\n'
+        f'loaded = [m for m in {heavy_modules!r} if m in sys.modules]\n'
+        'print(",".join(loaded))\n'
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    r = subprocess.run([sys.executable, '-c', code], env=env,
+                       capture_output=True, text=True, check=True)
+    loaded = r.stdout.strip()
+    assert loaded == '', f'imported by naus.environment_proxy_zmq: {loaded}'
+
+
+def test_client_import_time():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                        f'import {client_module}'],
+                       env=env, capture_output=True, text=True, check=True)
+
+    cumulative_us = 0
+    packages = set()
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, line_us, name = line[len('import time:'):].split('|')
+        if not line_us.strip().isdigit():
+            # header line
+            continue
+        module = name.strip()
+        packages.add(module.split('.')[0])
+        # not nested: imported by the statement itself
+        nested = name.startswith('   ')
+        if module in ('naus', client_module) and not nested:
+            cumulative_us += int(line_us)
+
+    found = sorted(set(heavy_modules) & packages)
+    assert not found, f'imported by {client_module}: {found}'
+    assert 0 < cumulative_us < max_import_ms * 1000
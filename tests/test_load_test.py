@@ -0,0 +1,44 @@
+'''summaries of the load test reports
+'''
+import pytest
+
+pytest.importorskip('zmq')
+np = pytest.importorskip('numpy')
+from naus.load_test import Report, summarise, total  # noqa: E402
+
+
+def reports():
+    return [
+        Report(0, 0.0, 1.0, dict(step=[0.001] * 90, reset=[0.01] * 10), {}),
+        Report(1, 0.02, 1.0, dict(step=[0.002] * 50), dict(step=2)),
+        Report(0, 1.0, 2.0, dict(step=[0.001] * 100), {}),
+    ]
+
+
+def test_summarise_per_interval():
+    rows = summarise(reports(), report_interval=1.0)
+    assert [row['t'] for row in rows] == [0.0, 1.0]
+    first, second = rows
+    assert first['agents'] == 2
+    assert first['commands'] == 150
+    assert first['errors'] == 2
+    assert first['throughput'] == 150.0
+    assert first['error_rate'] == 2 / 152
+    assert second['agents'] == 1
+    assert second['p50'] == second['max'] == 0.001
+
+
+def test_total():
+    d = total(reports())
+    assert d['commands'] == 250
+    assert d['throughput'] == 125.0
+    assert d['p99'] == pytest.approx(0.01)
+
+
+def test_failing_agents_finish():
+    from naus.load_test import run_load_test
+
+    # the clients can not connect: each agent fails right away
+    reports = run_load_test([9501, 9502], hostname='invalid host',
+                            duration=0.5)
+    assert reports == []
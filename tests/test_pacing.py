@@ -0,0 +1,32 @@
+'''thread pinning of the pacing module
+'''
+from threading import Thread
+import os
+import pytest
+
+from naus.pacing import pin_thread, thread_settings, restore_thread
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'sched_getaffinity'),
+                                reason='thread affinity not supported')
+
+
+def in_thread(function):
+    result = []
+    thread = Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_restore_thread():
+    def pin_and_restore():
+        before = thread_settings()
+        cpus = before[0]
+        pin_thread(cpus={min(cpus)})
+        pinned = thread_settings()
+        restore_thread(before)
+        return before, pinned, thread_settings()
+
+    before, pinned, after = in_thread(pin_and_restore)
+    assert pinned[0] == {min(before[0])}
+    assert after == before
@@ -0,0 +1,48 @@
+'''plans executed by the environment
+'''
+from threading import Timer
+import pytest
+
+pytest.importorskip('bluesky')
+pytest.importorskip('ophyd')
+from bluesky import RunEngine, Msg  # noqa: E402
+from ophyd.status import Status  # noqa: E402
+from naus.plans import fused_per_step_plan  # noqa: E402
+from naus.simulated_device import SimulatedDevice  # noqa: E402
+
+
+class Integrator(SimulatedDevice):
+    fields = ('x', 'v')
+
+    def apply(self, state, value):
+        state[1] += value
+        state[0] += state[1]
+
+
+def steps(RE, device, n, futures=None):
+    yield Msg('open_run')
+    for _ in range(n):
+        yield from fused_per_step_plan([device], [device], [1.0])
+    if futures is not None:
+        futures.extend(f for group in RE._groups.values() for f in group)
+    yield Msg('close_run')
+
+
+def test_fused_steps_leave_no_futures():
+    RE = RunEngine({})
+    device = Integrator('sim', initial=0.0)
+    n = 500
+    futures = []
+    RE(steps(RE, device, n, futures))
+    assert device.state.tolist()[1] == n
+    assert futures == []
+
+
+def test_fused_step_waits_for_late_status():
+    RE = RunEngine({})
+    device = Integrator('sim', initial=0.0)
+    late = Status()
+    device.set = lambda value: late
+    Timer(0.05, late.set_finished).start()
+    RE(steps(RE, device, 1))
+    assert late.done
@@ -0,0 +1,44 @@
+'''stages of the server side preprocessing
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+from naus.preprocessing import (FrameStack, RunningNormalizer,  # noqa: E402
+                                Pipeline)
+
+
+def test_frame_stack_order_across_wrap():
+    k = 3
+    stack = FrameStack(k)
+    frames = stack.reset(np.array([0.0]))
+    assert frames[:, 0].tolist() == [0.0] * k
+    for cnt in range(1, 3 * k + 2):
+        frames, _ = stack.step(np.array([float(cnt)]), 0.0, False)
+        expected = [float(max(cnt - i, 0)) for i in range(k - 1, -1, -1)]
+        assert frames[:, 0].tolist() == expected
+
+
+def test_running_normalizer_statistics():
+    rng = np.random.RandomState(0)
+    X = rng.normal(3.0, 2.0, size=(500, 2))
+    normalizer = RunningNormalizer(clip=None)
+    normalizer.reset(X[0])
+    for x in X[1:]:
+        normalizer.step(x, 0.0, False)
+    assert np.allclose(normalizer.mean, X.mean(axis=0))
+    assert np.allclose(normalizer.var, X.var(axis=0, ddof=1))
+
+
+def test_pipeline_config_round_trip():
+    config = [dict(kind='normalize', clip=5.0, epsilon=1e-8, update=True),
+              dict(kind='frame_stack', k=4),
+              dict(kind='reward_scale', scale=0.1, clip=1.0)]
+    pipeline = Pipeline.fromConfig(config)
+    assert Pipeline.fromConfig(pipeline.config()).config() == \
+        pipeline.config()
+    observation = pipeline.reset(np.ones(2))
+    assert observation.shape == (4, 2)
+    observation, reward = pipeline.step(np.ones(2), 20.0, False)
+    assert reward == 1.0
+    with pytest.raises(ValueError):
+        Pipeline.fromConfig([dict(kind='unknown')])
@@ -0,0 +1,38 @@
+'''stack sampling profiler
+'''
+from threading import Thread, Event
+from naus.profiler import StackSampler
+
+
+def test_interval_recovers_after_slow_sample():
+    sampler = StackSampler(interval=0.01, max_overhead=0.02)
+    sampler._account(0.05)
+    slowed = sampler.interval
+    assert slowed > 0.01
+    for _ in range(200):
+        sampler._account(1e-6)
+    assert sampler.interval == 0.01
+
+
+def test_interval_follows_expensive_sampling():
+    sampler = StackSampler(interval=0.01, max_overhead=0.02)
+    for _ in range(200):
+        sampler._account(0.001)
+    assert abs(sampler.interval - 0.05) < 1e-3
+
+
+def test_samples_registered_thread():
+    stop = Event()
+    thread = Thread(target=stop.wait, name='worker')
+    thread.start()
+    try:
+        sampler = StackSampler(thread_names=('worker',))
+        sampler.sample()
+        sampler.sample()
+    finally:
+        stop.set()
+        thread.join()
+    assert sampler.n_samples == 2
+    stacks = list(sampler._counts)
+    assert len(stacks) == 1 and stacks[0].startswith('worker;')
+    assert sampler._counts[stacks[0]] == 2
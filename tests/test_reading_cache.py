@@ -0,0 +1,53 @@
+'''storage of the cached readings
+'''
+import pytest
+
+pytest.importorskip('ophyd')
+from ophyd import Signal  # noqa: E402
+from naus.reading_cache import ReadingCache  # noqa: E402
+
+
+def test_storage_follows_description():
+    number = Signal(name='number', value=1.0)
+    text = Signal(name='text', value='idle')
+    cache = ReadingCache([number, text])
+    cache.start()
+    try:
+        before = cache.updates.copy()
+        number.put(2.5)
+        # a numeric string stays a string
+        text.put('1.5')
+        reading = cache.read()
+        assert reading['number']['value'] == 2.5
+        assert reading['text']['value'] == '1.5'
+        assert ((cache.updates - before) == 1).all()
+    finally:
+        cache.stop()
+
+
+def waiting(exc):
+    '''the plan waiting for an expected update gets exc thrown in'''
+    pytest.importorskip('bluesky')
+    from naus.reading_cache import CachedStepPlan
+
+    signal = Signal(name='signal', value=1.0)
+    cache = ReadingCache([signal])
+    plan = CachedStepPlan(cache, expect=[signal], timeout=0.1)
+    wait = plan._waitForExpected(cache.expectUpdate([signal]))
+    msg = next(wait)
+    assert msg.command == 'wait_for'
+    try:
+        wait.throw(exc)
+    except StopIteration as stop:
+        return stop.value
+
+
+def test_wait_timeout_reads_actively():
+    from bluesky.run_engine import WaitForTimeoutError
+    assert waiting(WaitForTimeoutError('timeout')) is False
+
+
+def test_wait_lets_abort_propagate():
+    from bluesky.utils import RequestAbort
+    with pytest.raises(RequestAbort):
+        waiting(RequestAbort())
@@ -0,0 +1,41 @@
+'''recording of client commands
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+from naus.recording import CommandRecorder, recorded, load_recording  # noqa: E402,E501
+
+
+class Proxy:
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    @recorded
+    def step(self, actions, **kwargs):
+        return 'stepped'
+
+
+def test_nested_arrays_round_trip(tmp_path):
+    filename = str(tmp_path / 'run.jsonl')
+    proxy = Proxy(CommandRecorder(filename))
+    action = {'motor': np.arange(3, dtype=np.float32), 'gain': np.int64(2)}
+    assert proxy.step(action, extra={'offsets': np.zeros((2, 2))}) == \
+        'stepped'
+
+    # flushed without closing the recorder
+    entry, = load_recording(filename)
+    proxy.recorder.close()
+    recorded_action, = entry['args']
+    assert recorded_action['motor'].dtype == np.float32
+    assert recorded_action['motor'].tolist() == [0, 1, 2]
+    assert recorded_action['gain'] == 2
+    assert entry['kwargs']['extra']['offsets'].shape == (2, 2)
+
+
+def test_recording_failure_does_not_fail_command(tmp_path):
+    filename = str(tmp_path / 'run.jsonl')
+    with CommandRecorder(filename) as recorder:
+        proxy = Proxy(recorder)
+        assert proxy.step(object()) == 'stepped'
+        assert proxy.step(1) == 'stepped'
+    assert [entry['args'] for entry in load_recording(filename)] == [[1]]
@@ -0,0 +1,58 @@
+'''replay buffers and the sum tree of prioritized sampling
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('zmq')
+from naus.replay import SumTree, ReplayBuffer, PrioritizedReplayBuffer  # noqa: E402,E501
+
+
+def test_sum_tree_total_and_find():
+    tree = SumTree(5)
+    priorities = np.array([1.0, 2.0, 0.0, 3.0, 4.0])
+    tree.update(np.arange(5), priorities)
+    assert tree.total == 10.0
+
+    cumulative = np.cumsum(priorities)
+    values = np.array([0.5, 1.0, 1.5, 3.0, 3.5, 6.0, 6.5, 9.9])
+    assert tree.find(values).tolist() == \
+        np.searchsorted(cumulative, values).tolist()
+
+    # after an update the sums follow
+    tree.update([1, 4], [0.0, 1.0])
+    assert tree.total == 5.0
+    assert tree.find([0.5, 1.5, 4.5]).tolist() == [0, 3, 4]
+    assert tree[[1, 4]].tolist() == [0.0, 1.0]
+
+
+def transitions(n, start=0):
+    index = np.arange(start, start + n)
+    return dict(observations=index[:, None] * np.ones((1, 2)),
+                actions=index % 2, rewards=index.astype(np.float32),
+                next_observations=(index + 1)[:, None] * np.ones((1, 2)),
+                dones=index % 5 == 4)
+
+
+def test_ring_buffer_overwrites_oldest():
+    buffer = ReplayBuffer(8, seed=0)
+    buffer.addBatch(transitions(6))
+    indices = buffer.addBatch(transitions(5, start=6))
+    assert indices.tolist() == [6, 7, 0, 1, 2]
+    assert len(buffer) == 8
+    assert buffer.n_added == 11
+    assert sorted(buffer.arrays['rewards'].tolist()) == list(range(3, 11))
+
+    batch = buffer.sample(32)
+    assert (batch['observations'][:, 0] == batch['rewards']).all()
+
+
+def test_prioritized_sampling_follows_priorities():
+    buffer = PrioritizedReplayBuffer(4, alpha=1.0, beta=1.0, epsilon=0.0,
+                                     seed=0)
+    buffer.addBatch(transitions(4))
+    buffer.updatePriorities([0, 1, 2, 3], [0.0, 0.0, 1.0, 3.0])
+    batch = buffer.sample(1000)
+    counts = np.bincount(batch['indices'], minlength=4)
+    assert counts[0] == counts[1] == 0
+    assert 650 < counts[3] < 850
+    assert batch['weights'].max() == 1.0
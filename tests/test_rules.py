@@ -0,0 +1,47 @@
+'''declarative termination and reward rules
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+from naus.rules import Bound, Rules, EpisodeRules  # noqa: E402
+
+
+def cart_pole_rules(**kwargs):
+    return Rules(
+        fields=('x', 'x_dot', 'theta', 'theta_dot'),
+        bounds=[Bound('x', -2.4, 2.4), Bound('theta', -0.21, 0.21)],
+        **kwargs
+    ).compile()
+
+
+def test_batched_equals_single():
+    rules = cart_pole_rules(reward='1.0 - abs(theta)', terminal_reward=-1.0,
+                            reward_beyond_done=0.0)
+    rng = np.random.RandomState(0)
+    observations = rng.uniform(-3, 3, size=(200, 4)) * [1, 1, 0.1, 1]
+    beyond = rng.uniform(size=200) < 0.3
+
+    rewards, dones = rules.evaluate(observations, beyond_done=beyond)
+    for cnt, observation in enumerate(observations):
+        reward, done = rules.evaluate(observation, beyond_done=beyond[cnt])
+        assert reward == rewards[cnt]
+        assert done == dones[cnt]
+    assert dones.any() and not dones.all()
+
+
+def test_steps_beyond_done():
+    episode = EpisodeRules(cart_pole_rules(reward=1.0, reward_beyond_done=0.0))
+    inside = [0.0, 0.0, 0.0, 0.0]
+    outside = [3.0, 0.0, 0.0, 0.0]
+
+    assert episode(inside) == (1.0, False)
+    assert episode(outside) == (1.0, True)
+    assert episode.steps_beyond_done == 0
+    assert episode(outside) == (0.0, True)
+    assert episode.steps_beyond_done == 1
+    # back within the bounds: rewarded, not counted
+    assert episode(inside) == (1.0, False)
+    assert episode.steps_beyond_done == 1
+
+    episode.reset()
+    assert episode.steps_beyond_done is None
@@ -0,0 +1,50 @@
+'''state, readings and snapshots of simulated devices
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('ophyd')
+from naus.simulated_device import SimulatedDevice  # noqa: E402
+from naus.plans import supports_restore  # noqa: E402
+
+
+class Integrator(SimulatedDevice):
+    fields = ('x', 'v')
+    extra_fields = {'mode': 'idle'}
+
+    def apply(self, state, value):
+        state[1] += value
+        state[0] += state[1]
+
+
+def test_set_updates_readings_in_place():
+    device = Integrator('sim', initial=0.0)
+    reading = device.read()
+    status = device.set(2.0)
+    assert status.done and status.success
+    assert reading['sim_x']['value'] == 2.0
+    assert reading['sim_v']['value'] == 2.0
+    device.x.set(5.0)
+    assert device.state.tolist() == [5.0, 2.0]
+    assert device.x.read()['sim_x']['value'] == 5.0
+
+
+def test_snapshot_restore():
+    device = Integrator('sim', initial=0.0)
+    assert supports_restore(device) and supports_restore(device.x)
+    device.set(1.0)
+    device.mode.set('running')
+    snapshot = device.snapshot()
+
+    device.set(3.0)
+    device.mode.set('done')
+    device.restore(snapshot)
+    assert device.state.tolist() == [1.0, 1.0]
+    reading = device.read()
+    assert reading['sim_x']['value'] == 1.0
+    assert reading['sim_mode']['value'] == 'running'
+
+    # the snapshot is a copy
+    device.set(1.0)
+    device.restore(snapshot)
+    assert device.state.tolist() == [1.0, 1.0]
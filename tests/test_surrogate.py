@@ -0,0 +1,74 @@
+'''surrogate environments fitted to recorded transitions
+'''
+import pytest
+
+np = pytest.importorskip('numpy')
+from naus.surrogate import (TransitionDataset, TransitionModel,  # noqa: E402
+                            PolynomialRegressor, MLPRegressor,
+                            SurrogateEnvironment, validate)
+
+
+def linear_dataset(n_episodes=20, n_steps=25, seed=0):
+    '''x' = x + 0.1 v, v' = v + 0.1 (2 a - 1), reward 1 - |x|'''
+    rng = np.random.RandomState(seed)
+    dataset = TransitionDataset()
+    for episode in range(n_episodes):
+        state = rng.uniform(-1, 1, size=2)
+        for step in range(n_steps):
+            action = rng.randint(2)
+            next_state = state + 0.1 * np.array([state[1], 2 * action - 1])
+            done = step == n_steps - 1
+            dataset.append(state, action, next_state, 1 - abs(state[0]),
+                           done)
+            state = next_state
+    return dataset
+
+
+def test_dataset_split_by_episodes():
+    dataset = linear_dataset()
+    train, validation = dataset.split(0.75, seed=1)
+    assert len(train) + len(validation) == len(dataset)
+    assert not set(train.arrays()['episodes']) & \
+        set(validation.arrays()['episodes'])
+    assert len(dataset.initialStates()) == 20
+
+
+def test_polynomial_regressor_linear_dynamics():
+    dataset = linear_dataset()
+    model = TransitionModel(PolynomialRegressor(degree=1), n_actions=2,
+                            terminal=lambda states: np.zeros(len(states)))
+    model.fit(dataset)
+    report = validate(model, dataset)
+    assert (report['state_rmse'] < 1e-4).all()
+
+
+def test_mlp_regressor_fit():
+    rng = np.random.RandomState(0)
+    X = rng.uniform(-1, 1, size=(512, 2))
+    Y = np.stack([np.sin(2 * X[:, 0]), X[:, 0] * X[:, 1]], axis=1)
+    regressor = MLPRegressor(hidden=(32,), epochs=300, batch_size=64,
+                             lr=1e-2, seed=0).fit(X, Y)
+    assert regressor.loss < 0.01
+    rmse = np.sqrt(((regressor.predict(X) - Y) ** 2).mean())
+    assert rmse < 0.05
+
+
+def test_surrogate_environment_steps_model():
+    dataset = linear_dataset()
+    model = TransitionModel(PolynomialRegressor(degree=1), n_actions=2,
+                            terminal=lambda states: np.abs(states[:, 0]) > 5)
+    model.fit(dataset)
+    env = SurrogateEnvironment(model, dataset.initialStates(), max_steps=3,
+                               batch_size=4, seed=0)
+    states = env.resetBatch()
+    assert states.shape == (4, 2)
+    for cnt in range(3):
+        states, rewards, dones = env.stepBatch(np.ones(4))
+    assert dones.all()
+
+    env = SurrogateEnvironment(model, dataset.initialStates(), seed=0)
+    state = env.reset()
+    next_state, reward, done, info = env.step(1)
+    assert next_state.shape == state.shape == (2,)
+    assert np.allclose(next_state, state + 0.1 * np.array([state[1], 1.0]),
+                       atol=1e-4)
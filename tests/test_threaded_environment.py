@@ -0,0 +1,48 @@
+'''executing an environment with the agent in a thread
+'''
+import subprocess
+import logging
+import sys
+import os
+import pytest
+
+pytest.importorskip('bluesky')
+
+
+def test_inline_does_not_need_bcib():
+    code = (
+        'import sys\n'
+        'import naus.inline, naus.threaded_environment\n'
+        'print("bcib" in sys.modules)\n'
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    r = subprocess.run([sys.executable, '-c', code], env=env,
+                       capture_output=True, text=True, check=True)
+    assert r.stdout.strip() == 'False'
+
+
+def test_setup_failure_is_raised():
+    from naus.threaded_environment import _execute_environment
+
+    class Watchdog:
+        def watchThread(self):
+            raise RuntimeError('watchdog failed')
+
+        def stop(self):
+            pass
+
+    class Env:
+        watchdog = Watchdog()
+        bridge = None
+
+        def clearLinkToBridge(self):
+            pass
+
+    class Bridge:
+        def planStub(self, log=None):
+            yield from ()
+
+    plan = _execute_environment(Env(), None, log=logging.getLogger('naus'),
+                                bridge=Bridge())
+    with pytest.raises(RuntimeError, match='watchdog failed'):
+        next(plan)
@@ -0,0 +1,61 @@
+'''deadline watchdog
+'''
+from naus.watchdog import DeadlineWatchdog
+import time
+
+
+def make(deadline):
+    reasons = []
+    watchdog = DeadlineWatchdog({'step': deadline}, abort=reasons.append,
+                                resolution=0.001)
+    return watchdog, reasons
+
+
+def test_command_within_deadline():
+    watchdog, reasons = make(1.0)
+    try:
+        for i in range(100):
+            assert watchdog.arm('step') is not None
+            assert not watchdog.disarm()
+    finally:
+        watchdog.stop()
+    assert reasons == []
+    assert watchdog.n_missed == 0
+
+
+def test_missed_deadline_aborts_once():
+    watchdog, reasons = make(0.005)
+    try:
+        watchdog.arm('step')
+        time.sleep(0.1)
+        assert watchdog.disarm()
+    finally:
+        watchdog.stop()
+    assert len(reasons) == 1
+    assert watchdog.n_missed == 1
+    assert watchdog.lastReport()['kind'] == 'step'
+
+
+def test_unwatched_kind():
+    watchdog, reasons = make(0.001)
+    assert watchdog.arm('reset') is None
+    assert not watchdog.disarm()
+    watchdog.stop()
+
+
+def test_miss_reported_exactly_when_fired():
+    # commands finishing around the deadline: disarm must report a
+    # miss exactly for the commands the watchdog aborted
+    watchdog, reasons = make(0.002)
+    missed = 0
+    try:
+        for i in range(200):
+            watchdog.arm('step')
+            time.sleep(0.002)
+            missed += watchdog.disarm()
+    finally:
+        watchdog.stop()
+    assert missed == watchdog.n_missed
+    # a miss of a command already finished is not aborted if the next
+    # one was armed meanwhile
+    assert len(reasons) <= missed